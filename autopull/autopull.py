@@ -1,6 +1,8 @@
 #!/usr/bin/env python3
-import os, sys, time, re, shlex, subprocess, pathlib, urllib.parse
-from typing import List, Tuple, Set
+import os, sys, time, re, shlex, subprocess, pathlib, urllib.parse, urllib.request
+import asyncio, contextlib, fnmatch, hmac, hashlib, json, signal, threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional, Tuple, Set
 
 # ----------------------- БАЗОВЫЕ УТИЛИТЫ -----------------------
 
@@ -24,6 +26,33 @@ DOCKER_COMPOSE_CMD = env("DOCKER_COMPOSE_CMD", "").strip()
 ALWAYS_REBUILD_ON_COMMIT = (env("ALWAYS_REBUILD_ON_COMMIT","1").lower() in {"1","true","yes"})
 AUTOPULL_RETRIES = max(1, int(env("AUTOPULL_RETRIES", "2")))      # сколько раз повторять неудачные compose-команды
 RETRY_SLEEP_BASE = max(1, int(env("RETRY_SLEEP_BASE", "2")))      # базовая пауза между ретраями
+# Пересобирать/перезапускать только сервисы, чьи входы (build context, bind-тома, env_file) изменились
+SCOPED_UPDATES = (env("AUTOPULL_SCOPED","1").lower() in {"1","true","yes"})
+# Параллельные pull/build и таймауты шагов деплоя (секунды)
+AUTOPULL_PARALLEL = max(1, int(env("AUTOPULL_PARALLEL", "4")))
+STEP_TIMEOUTS = {
+    "pull": int(env("AUTOPULL_PULL_TIMEOUT", "600")),
+    "build": int(env("AUTOPULL_BUILD_TIMEOUT", "1800")),
+    "up": int(env("AUTOPULL_UP_TIMEOUT", "300")),
+    "healthy": int(env("AUTOPULL_HEALTH_TIMEOUT", "180")),
+}
+
+# Неудачный деплой одного и того же SHA повторяется с экспоненциальной паузой
+# (POLL_INTERVAL * 2^n, не больше DEPLOY_BACKOFF_MAX), после DEPLOY_MAX_ATTEMPTS
+# попыток - алерт и ожидание следующего коммита
+DEPLOY_MAX_ATTEMPTS = max(1, int(env("AUTOPULL_DEPLOY_ATTEMPTS", "5")))
+DEPLOY_BACKOFF_MAX = max(POLL_INTERVAL, int(env("AUTOPULL_DEPLOY_BACKOFF_MAX", "3600")))
+# Discord/Slack-совместимый webhook для алертов (POST {"content": ...}); пусто - только лог
+ALERT_WEBHOOK_URL = env("AUTOPULL_ALERT_WEBHOOK", "").strip()
+# Последний развёрнутый SHA remote: переживает рестарт autopull (лежит в .git тома)
+DEPLOYED_FILE = pathlib.Path(env("AUTOPULL_STATE_FILE", str(WORK_DIR / ".git" / "autopull-deployed")))
+
+# Webhook: при заданном порту слушаем POST о push'е и проверяем сразу, не дожидаясь POLL_INTERVAL
+WEBHOOK_PORT = int(env("AUTOPULL_WEBHOOK_PORT", "0") or 0)
+WEBHOOK_SECRET = env("AUTOPULL_WEBHOOK_SECRET", "").strip()   # секрет GitHub/Gitea (X-Hub-Signature-256) или ?token=
+
+# Счётчики: проверки ls-remote, fetch'и, деплои, вебхуки
+STATS = {"checks": 0, "fetches": 0, "deploys": 0, "deploy_failures": 0, "webhooks": 0, "webhooks_rejected": 0, "errors": 0}
 
 # Цвета
 if AUTOPULL_COLOR:
@@ -55,6 +84,45 @@ def run_cmd(cmd: List[str], cwd: pathlib.Path=None) -> Tuple[int,str]:
     except Exception as e:
         return 999, f"EXC: {e!r}"
 
+async def arun_cmd(cmd: List[str], cwd: pathlib.Path=None, timeout: Optional[float]=None,
+                   label: str="", stream: bool=True) -> Tuple[int,str]:
+    """
+    Как run_cmd, но асинхронно: вывод печатается построчно по мере появления
+    (с меткой времени из log и меткой сервиса), по таймауту процесс убивается
+    и возвращается rc=124.
+    """
+    if AUTOPULL_VERBOSE:
+        log("$ " + " ".join(shlex.quote(c) for c in cmd), "cmd")
+    try:
+        proc = await asyncio.create_subprocess_exec(
+            *cmd, cwd=str(cwd) if cwd else None, limit=1 << 20, start_new_session=True,
+            stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.STDOUT)
+    except Exception as e:
+        return 999, f"EXC: {e!r}"
+    lines: List[str] = []
+
+    async def pump() -> int:
+        while True:
+            raw = await proc.stdout.readline()
+            if not raw:
+                break
+            line = raw.decode(errors="replace").rstrip()
+            lines.append(line)
+            if stream and line:
+                log(f"[{label}] {line}" if label else line, "dim")
+        return await proc.wait()
+
+    try:
+        rc = await asyncio.wait_for(pump(), timeout)
+    except asyncio.TimeoutError:
+        # Убиваем всю группу: дочерние процессы compose (buildx и т.п.) держат pipe открытым
+        with contextlib.suppress(ProcessLookupError):
+            os.killpg(proc.pid, signal.SIGKILL)
+        await proc.wait()
+        log(f"Таймаут {timeout:g} с: {' '.join(cmd)}", "err")
+        rc = 124
+    return rc, "\n".join(lines)
+
 # ----------------------- COMPOSE ДЕТЕКТ/ОБВЁРТКИ -----------------------
 
 def decide_compose_cmd() -> List[str]:
@@ -92,9 +160,9 @@ def _is_legacy(base: List[str]) -> bool:
     """True для ['docker-compose']"""
     return len(base) == 1 and base[0].endswith("docker-compose")
 
-def compose(args: List[str]) -> Tuple[int,str]:
+def compose_cmd(args: List[str]) -> Tuple[List[str], pathlib.Path]:
     """
-    Единая точка вызова docker compose / docker-compose.
+    Единая точка сборки команды docker compose / docker-compose.
     ВАЖНО: project-directory = директория, где лежит COMPOSE_FILE_PATH, чтобы чинить относительные пути (env_file и т.п.).
     """
     base = COMPOSE_BASE[:]
@@ -112,22 +180,35 @@ def compose(args: List[str]) -> Tuple[int,str]:
         os.environ.setdefault("COMPOSE_FILE", str(COMPOSE_FILE_PATH))
         base += ["-f", str(COMPOSE_FILE_PATH)]
 
-    return run_cmd(base + args, cwd=project_dir)
+    return base + args, project_dir
+
+def compose(args: List[str]) -> Tuple[int,str]:
+    """Короткие служебные команды (config, ps): вывод не печатается, а возвращается"""
+    cmd, project_dir = compose_cmd(args)
+    return run_cmd(cmd, cwd=project_dir)
 
-def compose_safe(args: List[str], retries: int = AUTOPULL_RETRIES) -> Tuple[int, str]:
+async def acompose_safe(args: List[str], retries: int = AUTOPULL_RETRIES,
+                        timeout: Optional[float] = None, label: str = "") -> Tuple[int, str]:
     """
     Повторяем команду с небольшими паузами, чтобы сетевые/реестровые глюки не валили процесс.
+    Вывод идёт в лог построчно; упавшую по таймауту команду не повторяем.
     """
+    cmd, project_dir = compose_cmd(args)
     last_rc, last_out = 1, ""
     for attempt in range(1, retries + 1):
-        rc, out = compose(args)
+        rc, out = await arun_cmd(cmd, cwd=project_dir, timeout=timeout, label=label)
         if rc == 0:
             return rc, out
         last_rc, last_out = rc, out
+        if rc == 124:
+            break
         log(f"Команда {' '.join(args)} завершилась rc={rc}. Попытка {attempt}/{retries}.", "warn")
-        time.sleep(RETRY_SLEEP_BASE * attempt)
+        await asyncio.sleep(RETRY_SLEEP_BASE * attempt)
     return last_rc, last_out
 
+def compose_safe(args: List[str], retries: int = AUTOPULL_RETRIES, timeout: Optional[float] = None) -> Tuple[int, str]:
+    return asyncio.run(acompose_safe(args, retries, timeout))
+
 def compose_validate() -> bool:
     rc, out = compose(["config"])
     if rc != 0:
@@ -170,10 +251,40 @@ def ensure_repo() -> None:
         run_cmd(["git","remote","set-url","origin", url_with_auth], cwd=WORK_DIR)
         run_cmd(["git","fetch","origin","--prune"], cwd=WORK_DIR)
 
+def remote_sha() -> str:
+    """
+    SHA ветки на remote одним `git ls-remote` - без fetch и без rev-parse.
+    Пустая строка, если remote недоступен.
+    """
+    STATS["checks"] += 1
+    rc, out = run_cmd(["git","ls-remote","origin", f"refs/heads/{GIT_BRANCH}"], cwd=WORK_DIR)
+    if rc != 0:
+        return ""
+    for line in out.splitlines():
+        parts = line.split()
+        if len(parts) == 2 and parts[1] == f"refs/heads/{GIT_BRANCH}":
+            return parts[0]
+    return ""
+
 def rev_parse(ref: str) -> str:
     rc, out = run_cmd(["git","rev-parse", ref], cwd=WORK_DIR)
     return out.strip() if rc==0 else ""
 
+def load_deployed() -> str:
+    """SHA последнего успешного деплоя из DEPLOYED_FILE; пусто, если файла нет"""
+    try:
+        return DEPLOYED_FILE.read_text(encoding="utf-8").strip()
+    except OSError:
+        return ""
+
+def save_deployed(sha: str) -> None:
+    tmp = DEPLOYED_FILE.with_name(DEPLOYED_FILE.name + ".tmp")
+    try:
+        tmp.write_text(sha + "\n", encoding="utf-8")
+        os.replace(tmp, DEPLOYED_FILE)
+    except OSError as e:
+        log(f"Не удалось сохранить {DEPLOYED_FILE}: {e!r}", "warn")
+
 def list_new_commits(old: str, new: str) -> List[str]:
     if not old or not new or old==new: return []
     rc, out = run_cmd(["git","rev-list", f"{old}..{new}"], cwd=WORK_DIR)
@@ -188,6 +299,44 @@ def changed_files(commit: str) -> Set[str]:
     rc, out = run_cmd(["git","diff-tree","--no-commit-id","--name-only","-r", commit], cwd=WORK_DIR)
     return {l.strip() for l in (out.splitlines() if rc==0 else []) if l.strip()}
 
+# Разделители записей git log: начало коммита и конец сообщения
+_REC, _END = "\x1e", "\x1f"
+
+def collect_commits(old: str, new: str) -> List[Tuple[str, str, Set[str]]]:
+    """
+    Все коммиты old..new (от старых к новым) одним `git log`: (sha, сообщение,
+    изменённые пути). Вывод разбирается построчно по мере чтения.
+    """
+    if not old or not new or old==new: return []
+    cmd = ["git","log","--reverse","--no-renames","--name-only",
+           f"--format={_REC}%H%n%B{_END}", f"{old}..{new}"]
+    if AUTOPULL_VERBOSE:
+        log("$ " + " ".join(shlex.quote(c) for c in cmd), "cmd")
+    commits: List[Tuple[str, str, Set[str]]] = []
+    try:
+        with subprocess.Popen(cmd, cwd=str(WORK_DIR), text=True, errors="replace",
+                              stdout=subprocess.PIPE, stderr=subprocess.DEVNULL) as p:
+            sha = None; body: List[str] = []; files: Set[str] = set(); in_body = False
+            for line in p.stdout:
+                line = line.rstrip("\n")
+                if line.startswith(_REC):
+                    if sha: commits.append((sha, "\n".join(body).strip(), files))
+                    sha = line[1:].strip(); body = []; files = set(); in_body = True
+                elif in_body:
+                    if line.endswith(_END):
+                        body.append(line[:-1]); in_body = False
+                    else:
+                        body.append(line)
+                elif line.strip():
+                    files.add(line.strip())
+            if sha: commits.append((sha, "\n".join(body).strip(), files))
+            if p.wait() != 0:
+                return []
+    except Exception as e:
+        log(f"git log упал: {e!r}", "warn")
+        return []
+    return commits
+
 # ----------------------- ЛОГИКА ИЗМЕНЕНИЙ -----------------------
 
 DOCKER_PATTERNS = [
@@ -216,14 +365,278 @@ def parse_flags_from_messages(msgs: List[str]) -> Tuple[bool,bool,int]:
             except: pass
     return need_build, need_restart, reverse_n
 
+# ----------------------- ВХОДЫ СЕРВИСОВ -----------------------
+
+def compose_services() -> Optional[Dict[str, dict]]:
+    """
+    Сервисы из `compose config --format json` (пути уже абсолютные).
+    Если compose так не умеет (legacy docker-compose) - из самого файла через
+    PyYAML, если он есть. None - разобрать не удалось.
+    """
+    rc, out = compose(["config","--format","json"])
+    if rc == 0:
+        # stderr смешан со stdout: предупреждения compose идут до JSON
+        start = out.find("{")
+        if start >= 0:
+            try:
+                return json.JSONDecoder().raw_decode(out[start:])[0].get("services") or {}
+            except ValueError:
+                pass
+    try:
+        import yaml
+        with open(COMPOSE_FILE_PATH, encoding="utf-8") as f:
+            return (yaml.safe_load(f) or {}).get("services") or {}
+    except Exception as e:
+        log(f"Не удалось разобрать сервисы compose ({e!r}) - обновляю весь стек", "warn")
+        return None
+
+def _project_rel(path: str) -> Optional[str]:
+    """Путь относительно каталога compose-файла (= корня репозитория); None - снаружи"""
+    p = pathlib.PurePosixPath(path)
+    if not p.is_absolute():
+        p = pathlib.PurePosixPath(COMPOSE_FILE_PATH.parent) / p
+    p = pathlib.PurePosixPath(os.path.normpath(str(p)))
+    try:
+        rel = p.relative_to(pathlib.PurePosixPath(COMPOSE_FILE_PATH.parent))
+    except ValueError:
+        return None
+    return "" if str(rel) == "." else str(rel)
+
+def _under(path: str, prefix: str) -> bool:
+    return prefix == "" or path == prefix or path.startswith(prefix + "/")
+
+def _dockerignore_rules(context: str) -> List[Tuple[bool, Tuple[str, ...]]]:
+    """Правила .dockerignore контекста из рабочей копии: (исключение?, сегменты шаблона)"""
+    rules = []
+    try:
+        text = (WORK_DIR / context / ".dockerignore").read_text(encoding="utf-8")
+    except OSError:
+        return rules
+    for line in text.splitlines():
+        line = line.strip()
+        if not line or line.startswith("#"):
+            continue
+        include = line.startswith("!")
+        pat = os.path.normpath(line.lstrip("!").strip()).lstrip("/")
+        if pat and pat != ".":
+            rules.append((include, tuple(pat.split("/"))))
+    return rules
+
+def _glob_match(pat: Tuple[str, ...], parts: Tuple[str, ...]) -> bool:
+    """
+    Шаблон .dockerignore по сегментам пути: сегмент - fnmatch (*, ?, [..]
+    не выходят за "/"), "**" - любое число каталогов, в том числе ноль.
+    Совпадение с каталогом покрывает и всё внутри него.
+    """
+    if not pat:
+        return True
+    if pat[0] == "**":
+        return any(_glob_match(pat[1:], parts[i:]) for i in range(len(parts) + 1))
+    return bool(parts) and fnmatch.fnmatchcase(parts[0], pat[0]) and _glob_match(pat[1:], parts[1:])
+
+def _dockerignored(path: str, rules) -> bool:
+    parts = tuple(path.split("/"))
+    ignored = False
+    for include, pat in rules:
+        if _glob_match(pat, parts):
+            ignored = not include
+    return ignored
+
+def service_inputs(services: Dict[str, dict]) -> Dict[str, dict]:
+    """
+    Что считается входом каждого сервиса, в путях относительно корня репозитория:
+    build - каталог контекста (с его .dockerignore) и Dockerfile,
+    mounts - bind-тома внутри проекта (том на весь корень - для доступа
+    к файлам, а не вход, его пропускаем), env_files - env_file.
+    """
+    result = {}
+    for name, svc in services.items():
+        svc = svc or {}
+        inputs = {"context": None, "dockerfile": None, "ignore": [], "mounts": [], "env_files": []}
+        build = svc.get("build")
+        if build:
+            build = {"context": build} if isinstance(build, str) else build
+            ctx = _project_rel(str(build.get("context") or "."))
+            if ctx is not None:
+                inputs["context"] = ctx
+                inputs["ignore"] = _dockerignore_rules(ctx)
+                dockerfile = str(build.get("dockerfile") or "Dockerfile")
+                full = dockerfile if dockerfile.startswith("/") else str(pathlib.PurePosixPath(COMPOSE_FILE_PATH.parent, ctx, dockerfile))
+                inputs["dockerfile"] = _project_rel(full)
+        for vol in svc.get("volumes") or []:
+            if isinstance(vol, dict):
+                source = vol.get("source") if vol.get("type", "bind") == "bind" else None
+            else:
+                source = str(vol).split(":")[0] if ":" in str(vol) else None
+                if source and not source.startswith((".", "/", "~")):
+                    source = None  # именованный том
+            rel = _project_rel(source) if source else None
+            if rel:
+                inputs["mounts"].append(rel)
+        env_files = svc.get("env_file") or []
+        for item in [env_files] if isinstance(env_files, str) else env_files:
+            rel = _project_rel(item.get("path") if isinstance(item, dict) else item)
+            if rel:
+                inputs["env_files"].append(rel)
+        result[name] = inputs
+    return result
+
+def plan_services(changed: Set[str], inputs: Dict[str, dict]) -> Tuple[Set[str], Set[str], Set[str], Set[str]]:
+    """
+    Раскладывает изменённые пути по сервисам: (пересобрать, из них - с
+    изменённым Dockerfile, пересоздать из-за env_file, только перезапустить).
+    """
+    rebuild, dockerfile_changed, recreate, restart = set(), set(), set(), set()
+    for name, inp in inputs.items():
+        ctx = inp["context"]
+        for path in changed:
+            if path == inp["dockerfile"]:
+                rebuild.add(name); dockerfile_changed.add(name)
+            elif ctx is not None and _under(path, ctx):
+                inner = path[len(ctx):].lstrip("/")
+                if inner == ".dockerignore" or not _dockerignored(inner, inp["ignore"]):
+                    rebuild.add(name)
+            if path in inp["env_files"]:
+                recreate.add(name)
+            elif any(_under(path, m) for m in inp["mounts"]):
+                restart.add(name)
+    recreate -= rebuild
+    restart -= rebuild | recreate
+    return rebuild, dockerfile_changed, recreate, restart
+
+def scoped_update(changed: Set[str]) -> Optional[bool]:
+    """
+    Обновляет только затронутые сервисы. None - точечно нельзя (compose-файл
+    изменился или не разобран), нужен обычный путь по всему стеку.
+    """
+    if not COMPOSE_FILE_PATH.exists():
+        return None
+    compose_rel = _project_rel(str(COMPOSE_FILE_PATH))
+    # compose-файл и .env рядом с ним (подстановка переменных) меняют конфиг целиком
+    if compose_rel in changed or ".env" in changed:
+        return None
+    services = compose_services()
+    if services is None:
+        return None
+
+    rebuild, dockerfile_changed, recreate, restart = plan_services(changed, service_inputs(services))
+    if not (rebuild or recreate or restart):
+        log("Изменения не затрагивают ни один сервис - стек не трогаю", "ok")
+        return True
+    log(f"Точечное обновление: пересборка={sorted(rebuild) or '-'} пересоздание={sorted(recreate) or '-'} "
+        f"перезапуск={sorted(restart) or '-'}", "info")
+
+    ok = True
+    if dockerfile_changed:
+        # Dockerfile поменялся - как и раньше, без кеша, но только эти сервисы
+        with timed("build"):
+            rc, _ = compose_safe(["build","--pull","--no-cache", *sorted(dockerfile_changed)], timeout=STEP_TIMEOUTS["build"])
+        ok &= rc == 0
+    if rebuild:
+        with timed("build"):
+            rc, _ = compose_safe(["up","-d","--no-deps","--build", *sorted(rebuild)], timeout=STEP_TIMEOUTS["build"])
+        ok &= rc == 0
+    if recreate:
+        with timed("up"):
+            rc, _ = compose_safe(["up","-d","--no-deps","--force-recreate", *sorted(recreate)], timeout=STEP_TIMEOUTS["up"])
+        ok &= rc == 0
+    if restart:
+        with timed("up"):
+            rc, _ = compose_safe(["restart", *sorted(restart)], timeout=STEP_TIMEOUTS["up"])
+        ok &= rc == 0
+    return ok
+
+# ----------------------- ВРЕМЯ ДЕПЛОЯ -----------------------
+
+# Шаг -> секунды за текущий деплой (pull, build, up, healthy, ...)
+TIMINGS: Dict[str, float] = {}
+
+@contextlib.contextmanager
+def timed(step: str):
+    start = time.monotonic()
+    try:
+        yield
+    finally:
+        TIMINGS[step] = TIMINGS.get(step, 0.0) + time.monotonic() - start
+
+def log_timings(total: float):
+    parts = ", ".join(f"{k} {v:.1f} с" for k, v in TIMINGS.items())
+    log(f"Время деплоя: {parts or '-'}; всего {total:.1f} с", "ok")
+
 # ----------------------- ДЕЙСТВИЯ С СТЕКОМ -----------------------
 
+def _depends_on(svc: dict) -> List[str]:
+    deps = (svc or {}).get("depends_on") or []
+    return list(deps) if isinstance(deps, (dict, list)) else []
+
+def build_waves(services: Dict[str, dict]) -> List[List[str]]:
+    """
+    Собираемые сервисы волнами по depends_on: в волне - сервисы, чьи
+    собираемые зависимости уже собраны; волна собирается параллельно.
+    """
+    pending = {n: {d for d in _depends_on(s) if (services.get(d) or {}).get("build")}
+               for n, s in services.items() if (s or {}).get("build")}
+    waves = []
+    while pending:
+        wave = sorted(n for n, deps in pending.items() if not deps & pending.keys())
+        if not wave:
+            # цикл в depends_on - compose его всё равно не примет, собираем остаток разом
+            wave = sorted(pending)
+        waves.append(wave)
+        for n in wave:
+            pending.pop(n)
+    return waves
+
+async def _gather_limited(jobs: List[Tuple[List[str], str]], timeout: float) -> List[int]:
+    """Команды compose параллельно, не больше AUTOPULL_PARALLEL одновременно; rc каждой"""
+    sem = asyncio.Semaphore(AUTOPULL_PARALLEL)
+
+    async def one(args, label):
+        async with sem:
+            rc, _ = await acompose_safe(args, timeout=timeout, label=label)
+            return rc
+
+    return await asyncio.gather(*(one(args, label) for args, label in jobs))
+
+async def _hard_update(services: Optional[Dict[str, dict]], no_cache: bool) -> bool:
+    pulls = sorted(n for n, s in (services or {}).items() if (s or {}).get("image") and not (s or {}).get("build"))
+    with timed("pull"):
+        if services is None:
+            log("Тяну образы (compose pull)", "info")
+            rcs = [(await acompose_safe(["pull"], timeout=STEP_TIMEOUTS["pull"]))[0]]
+        else:
+            log(f"Тяну образы параллельно: {', '.join(pulls) or '-'}", "info")
+            rcs = await _gather_limited([(["pull", n], n) for n in pulls], STEP_TIMEOUTS["pull"])
+    if any(rcs):
+        log("pull завершился с ошибкой — продолжаю (может быть локальная сборка).", "warn")
+
+    build_args = ["build", "--pull"] + (["--no-cache"] if no_cache else [])
+    with timed("build"):
+        if services is None:
+            log(f"Собираю сервисы ({'без кеша, ' if no_cache else ''}compose build)", "ok")
+            rcs = [(await acompose_safe(build_args, timeout=STEP_TIMEOUTS["build"]))[0]]
+        else:
+            rcs = []
+            for wave in build_waves(services):
+                log(f"Собираю {'без кеша ' if no_cache else ''}параллельно: {', '.join(wave)}", "ok")
+                rcs = await _gather_limited([(build_args + [n], n) for n in wave], STEP_TIMEOUTS["build"])
+                if any(rcs):
+                    break
+    if any(rcs):
+        log("build завершился с ошибкой", "err")
+        return False
+
+    log("Поднимаю стек (up -d --remove-orphans)", "ok")
+    with timed("up"):
+        rc, _ = await acompose_safe(["up","-d","--remove-orphans"], timeout=STEP_TIMEOUTS["up"])
+    return (rc == 0)
+
 def hard_update(no_cache: bool=False) -> bool:
     """
     Тяжёлый путь для docker-изменений:
     - docker compose config (валидация)
-    - pull
-    - build [--pull] [--no-cache]
+    - pull образов сервисов без build - параллельно
+    - build [--pull] [--no-cache] - волнами по depends_on, внутри волны параллельно
     - up -d --remove-orphans
     """
     if not COMPOSE_FILE_PATH.exists():
@@ -233,21 +646,7 @@ def hard_update(no_cache: bool=False) -> bool:
     if not compose_validate():
         return False
 
-    log("Тяну образы (compose pull)", "info")
-    rc, out = compose_safe(["pull"]); log(out, "dim")
-    if rc != 0:
-        log("pull завершился с ошибкой — продолжаю (может быть локальная сборка).", "warn")
-
-    build_args = ["build", "--pull"] + (["--no-cache"] if no_cache else [])
-    log(f"Собираю сервисы ({'без кеша, ' if no_cache else ''}compose build)", "ok")
-    rc, out = compose_safe(build_args); log(out, "dim")
-    if rc != 0:
-        log("build завершился с ошибкой", "err")
-        return False
-
-    log("Поднимаю стек (up -d --remove-orphans)", "ok")
-    rc, out = compose_safe(["up","-d","--remove-orphans"]); log(out, "dim")
-    return (rc == 0)
+    return asyncio.run(_hard_update(compose_services(), no_cache))
 
 def light_update() -> bool:
     """
@@ -261,21 +660,131 @@ def light_update() -> bool:
         return False
 
     log("Применяю изменения (up -d --build)", "ok")
-    rc, out = compose_safe(["up","-d","--build"]); log(out, "dim")
+    with timed("build"):
+        rc, _ = compose_safe(["up","-d","--build"], timeout=STEP_TIMEOUTS["build"])
     return (rc == 0)
 
 def restart_stack() -> bool:
     log("Перезапуск сервисов (compose restart)", "ok")
-    rc, out = compose_safe(["restart"]); log(out, "dim")
-    if rc != 0:
-        log("restart вернул ошибку, пробую up -d", "warn")
-        rc, out = compose_safe(["up","-d"]); log(out, "dim")
+    with timed("up"):
+        rc, _ = compose_safe(["restart"], timeout=STEP_TIMEOUTS["up"])
+        if rc != 0:
+            log("restart вернул ошибку, пробую up -d", "warn")
+            rc, _ = compose_safe(["up","-d"], timeout=STEP_TIMEOUTS["up"])
     return (rc == 0)
 
 def up_if_present():
     if COMPOSE_FILE_PATH.exists():
         compose_validate()
-        rc, out = compose_safe(["up","-d"]); log(out, "dim")
+        compose_safe(["up","-d"], timeout=STEP_TIMEOUTS["up"])
+
+def _ps_entries(out: str) -> List[dict]:
+    """`compose ps --format json`: JSON-массив (старые v2) или по объекту на строку"""
+    out = out.strip()
+    if out.startswith("["):
+        return json.loads(out)
+    return [json.loads(line) for line in out.splitlines() if line.startswith("{")]
+
+def wait_healthy(timeout: float = STEP_TIMEOUTS["healthy"]) -> Optional[bool]:
+    """
+    Ждёт, пока все контейнеры стека будут running, а с healthcheck - healthy.
+    None - compose не умеет ps --format json, проверить нельзя.
+    """
+    deadline = time.monotonic() + timeout
+    while True:
+        rc, out = compose(["ps","--all","--format","json"])
+        try:
+            entries = _ps_entries(out) if rc == 0 else None
+        except ValueError:
+            entries = None
+        if entries is None:
+            return None
+        pending = sorted(e.get("Service", "?") for e in entries
+                         if e.get("State") != "running" or e.get("Health") not in ("", None, "healthy"))
+        if not pending:
+            return True
+        if time.monotonic() >= deadline:
+            log(f"Не дождался готовности за {timeout:g} с: {', '.join(pending)}", "warn")
+            return False
+        time.sleep(2)
+
+# ----------------------- WEBHOOK -----------------------
+
+WAKEUP = threading.Event()
+
+class WebhookHandler(BaseHTTPRequestHandler):
+    """
+    POST (любой путь) - сигнал о push'е; проверяем подпись/токен и ветку из
+    payload (если она там есть) и будим основной цикл.
+    GET /stats - счётчики в JSON.
+    """
+
+    def log_message(self, fmt, *args):
+        if AUTOPULL_VERBOSE:
+            log("webhook: " + (fmt % args), "dim")
+
+    def _reply(self, code: int, body: dict):
+        data = json.dumps(body).encode()
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _authorized(self, body: bytes) -> bool:
+        if not WEBHOOK_SECRET:
+            return True
+        sig = self.headers.get("X-Hub-Signature-256", "")
+        if sig:
+            expected = "sha256=" + hmac.new(WEBHOOK_SECRET.encode(), body, hashlib.sha256).hexdigest()
+            return hmac.compare_digest(sig, expected)
+        token = urllib.parse.parse_qs(urllib.parse.urlsplit(self.path).query).get("token", [""])[0]
+        return hmac.compare_digest(token, WEBHOOK_SECRET)
+
+    def do_GET(self):
+        if urllib.parse.urlsplit(self.path).path == "/stats":
+            self._reply(200, STATS)
+        else:
+            self._reply(404, {"error": "not found"})
+
+    def do_POST(self):
+        length = min(int(self.headers.get("Content-Length") or 0), 5 * 1024 * 1024)
+        body = self.rfile.read(length) if length else b""
+        if not self._authorized(body):
+            STATS["webhooks_rejected"] += 1
+            self._reply(403, {"error": "bad signature"})
+            return
+        ref = ""
+        try:
+            ref = (json.loads(body or b"{}") or {}).get("ref", "") or ""
+        except Exception:
+            pass
+        if ref and ref != f"refs/heads/{GIT_BRANCH}":
+            self._reply(202, {"ignored": ref})
+            return
+        STATS["webhooks"] += 1
+        WAKEUP.set()
+        self._reply(202, {"queued": True})
+
+def start_webhook_server():
+    server = ThreadingHTTPServer(("0.0.0.0", WEBHOOK_PORT), WebhookHandler)
+    threading.Thread(target=server.serve_forever, name="autopull-webhook", daemon=True).start()
+    log(f"Webhook слушает :{WEBHOOK_PORT} (POST - проверить обновления, GET /stats - счётчики)", "info")
+
+def alert(msg: str) -> None:
+    """Ошибка, требующая человека: в лог и, если задан, в ALERT_WEBHOOK_URL"""
+    log(msg, "err")
+    if not ALERT_WEBHOOK_URL:
+        return
+    body = json.dumps({"content": f"[autopull] {msg}"[:2000]}).encode()
+    req = urllib.request.Request(ALERT_WEBHOOK_URL, data=body, headers={"Content-Type": "application/json"})
+    try:
+        urllib.request.urlopen(req, timeout=10).close()
+    except Exception as e:
+        log(f"Алерт не отправлен: {e!r}", "warn")
+
+def log_stats():
+    log("Счётчики: " + " ".join(f"{k}={v}" for k, v in STATS.items()), "dim")
 
 # ----------------------- ОСНОВНОЙ ЦИКЛ -----------------------
 
@@ -293,62 +802,134 @@ def main():
     elif COMPOSE_FILE_PATH.exists():
         up_if_present()
 
-    local_head = rev_parse("HEAD")
+    if WEBHOOK_PORT:
+        start_webhook_server()
+
+    # Последний успешно развёрнутый SHA ветки на remote. Сравниваем с ним, а не
+    # с HEAD: после reverse HEAD отстаёт от remote намеренно. Он сохраняется в
+    # DEPLOYED_FILE, поэтому рестарт autopull не отменяет reverse, а коммиты,
+    # пришедшие, пока autopull лежал, всё равно развернутся. Без файла
+    # (первый запуск) - от HEAD
+    seen_remote = load_deployed() or rev_parse("HEAD")
+    # Неудачные попытки деплоя текущего SHA и когда можно пробовать снова
+    failed_sha, failures, retry_at = "", 0, 0.0
+    last_stats_log = time.monotonic()
     while True:
         try:
-            run_cmd(["git","fetch","origin","--prune"], cwd=WORK_DIR)
-            remote_head = rev_parse(f"origin/{GIT_BRANCH}")
-            local_head = rev_parse("HEAD")
-
-            if remote_head and local_head and remote_head != local_head:
-                log(f"Новые коммиты: {local_head[:7]}..{remote_head[:7]}", "info")
-                new_commits = list_new_commits(local_head, remote_head)
-
-                rc, out = run_cmd(["git","pull","--rebase","origin", GIT_BRANCH], cwd=WORK_DIR); log(out, "dim")
-                if rc != 0:
-                    log("pull упал, делаю reset --hard на remote_head и clean -df", "warn")
-                    run_cmd(["git","reset","--hard", remote_head], cwd=WORK_DIR)
-                    run_cmd(["git","clean","-df"], cwd=WORK_DIR)
-
-                local_head = rev_parse("HEAD")
-
-                messages = [commit_msg(c) for c in new_commits] if new_commits else [commit_msg(local_head)]
-                need_build, need_restart, reverse_n = parse_flags_from_messages(messages)
-
-                changed: Set[str] = set()
-                for c in new_commits or [local_head]:
-                    changed |= changed_files(c)
-
-                docker_changed = any(is_docker_related(p) for p in changed)
-                if docker_changed:
-                    log(f"Изменены docker/compose-файлы: {sorted(changed)}", "info")
-
-                # Обработка reverse
-                if reverse_n > 0:
-                    log(f"Откат reverse {reverse_n}: git reset --hard HEAD~{reverse_n}", "warn")
-                    rc, out = run_cmd(["git","reset","--hard", f"HEAD~{reverse_n}"], cwd=WORK_DIR); log(out, "dim")
-                    hard_update(no_cache=True)
-                else:
-                    # Приоритет действий: docker-изменения → build; иначе — общий апдейт
-                    if docker_changed:
-                        ok = hard_update(no_cache=True)
-                        if not ok:
-                            log("Тяжёлый апдейт не удался, пробую лёгкий путь.", "warn")
-                            light_update()
+            # Простой: один ls-remote вместо fetch + двух rev-parse
+            remote = remote_sha()
+            backing_off = remote == failed_sha and (failures >= DEPLOY_MAX_ATTEMPTS or time.monotonic() < retry_at)
+            if remote and remote != seen_remote and not backing_off:
+                STATS["fetches"] += 1
+                run_cmd(["git","fetch","origin","--prune"], cwd=WORK_DIR)
+                remote_head = rev_parse(f"origin/{GIT_BRANCH}")
+
+                # Диапазон - от последнего успешного деплоя: неудачный
+                # повторится на следующем опросе, даже если HEAD уже подтянут
+                if remote_head and remote_head != seen_remote:
+                    if deploy(seen_remote or rev_parse("HEAD"), remote_head):
+                        seen_remote = remote_head
+                        save_deployed(seen_remote)
+                        failed_sha, failures = "", 0
+                        STATS["deploys"] += 1
                     else:
-                        if need_build or ALWAYS_REBUILD_ON_COMMIT:
-                            light_update()
-                        elif need_restart:
-                            restart_stack()
+                        STATS["deploy_failures"] += 1
+                        if remote_head != failed_sha:
+                            failed_sha, failures = remote_head, 0
+                        failures += 1
+                        if failures >= DEPLOY_MAX_ATTEMPTS:
+                            alert(f"Деплой {remote_head[:7]} не удался {failures} раз подряд - "
+                                  f"больше не пробую до нового коммита или рестарта autopull")
                         else:
-                            log("Коммиты без спец-флагов — применяю по умолчанию up -d --build", "info")
-                            light_update()
+                            delay = min(DEPLOY_BACKOFF_MAX, POLL_INTERVAL * 2 ** failures)
+                            retry_at = time.monotonic() + delay
+                            log(f"Деплой {remote_head[:7]} не удался ({failures}/{DEPLOY_MAX_ATTEMPTS}) - "
+                                f"повтор через {delay} с", "warn")
+                    log_stats()
 
-            time.sleep(POLL_INTERVAL)
+            if time.monotonic() - last_stats_log >= 3600:
+                last_stats_log = time.monotonic()
+                log_stats()
 
         except Exception as e:
+            STATS["errors"] += 1
             log(f"ERROR loop: {e!r}", "err")
-            time.sleep(POLL_INTERVAL)
+
+        # Спим до следующего опроса или до вебхука
+        WAKEUP.wait(POLL_INTERVAL)
+        WAKEUP.clear()
+
+def deploy(local_head: str, remote_head: str) -> bool:
+    """Разворачивает коммиты local_head..remote_head; False - не удалось"""
+    log(f"Новые коммиты: {local_head[:7]}..{remote_head[:7]}", "info")
+    TIMINGS.clear()
+    started = time.monotonic()
+    try:
+        ok = apply_commits(local_head, remote_head) is not False
+        if ok and COMPOSE_FILE_PATH.exists():
+            with timed("healthy"):
+                if wait_healthy() is None:
+                    log("compose не умеет ps --format json - готовность не проверяю", "dim")
+        return ok
+    finally:
+        log_timings(time.monotonic() - started)
+
+def apply_commits(local_head: str, remote_head: str) -> Optional[bool]:
+    """git pull новых коммитов и обновление стека по ним; False - обновить не удалось"""
+    with timed("git"):
+        # Сообщения и изменённые файлы всех новых коммитов - одним git log
+        new_commits = collect_commits(local_head, remote_head)
+
+        rc, out = run_cmd(["git","pull","--rebase","origin", GIT_BRANCH], cwd=WORK_DIR); log(out, "dim")
+        if rc != 0:
+            log("pull упал, делаю reset --hard на remote_head и clean -df", "warn")
+            run_cmd(["git","reset","--hard", remote_head], cwd=WORK_DIR)
+            run_cmd(["git","clean","-df"], cwd=WORK_DIR)
+        head = rev_parse("HEAD")
+
+    # git log ничего не дал - судим по коммиту, на котором оказались после pull
+    if not new_commits:
+        new_commits = [(head, commit_msg(head), changed_files(head))]
+    messages = [msg for _, msg, _ in new_commits]
+    need_build, need_restart, reverse_n = parse_flags_from_messages(messages)
+
+    changed: Set[str] = set()
+    for _, _, files in new_commits:
+        changed |= files
+
+    docker_changed = any(is_docker_related(p) for p in changed)
+    if docker_changed:
+        log(f"Изменены docker/compose-файлы: {sorted(changed)}", "info")
+
+    # Обработка reverse
+    if reverse_n > 0:
+        log(f"Откат reverse {reverse_n}: git reset --hard HEAD~{reverse_n}", "warn")
+        rc, out = run_cmd(["git","reset","--hard", f"HEAD~{reverse_n}"], cwd=WORK_DIR); log(out, "dim")
+        return hard_update(no_cache=True)
+    else:
+        # Без явных --build/--restart трогаем только затронутые сервисы
+        if SCOPED_UPDATES and not need_build and not need_restart:
+            scoped = scoped_update(changed)
+            if scoped:
+                return True
+            if scoped is False:
+                log("Точечное обновление не удалось, обновляю весь стек", "warn")
+
+        # Приоритет действий: docker-изменения → build; иначе — общий апдейт
+        if docker_changed:
+            ok = hard_update(no_cache=True)
+            if not ok:
+                log("Тяжёлый апдейт не удался, пробую лёгкий путь.", "warn")
+                ok = light_update()
+            return ok
+        else:
+            if need_build or ALWAYS_REBUILD_ON_COMMIT:
+                return light_update()
+            elif need_restart:
+                return restart_stack()
+            else:
+                log("Коммиты без спец-флагов — применяю по умолчанию up -d --build", "info")
+                return light_update()
 
 if __name__ == "__main__":
     if not pathlib.Path("/var/run/docker.sock").exists():
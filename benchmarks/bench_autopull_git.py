@@ -0,0 +1,96 @@
+"""
+Бенчмарк сбора метаданных новых коммитов в autopull.
+
+Старый путь: rev-list + по два процесса git на коммит (commit_msg и
+changed_files). Новый: один `git log --name-only`, разобранный потоком
+(collect_commits). Репозиторий синтетический, коммиты создаются через
+git fast-import во временном каталоге.
+
+    python benchmarks/bench_autopull_git.py [кол-во коммитов]
+"""
+import os
+import pathlib
+import random
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, "autopull"))
+
+FILES = ["bot.py", "storage.py", "cogs/websocket.py", "cogs/mod.py", "cogs/stats.py",
+         "bridge/index.js", "README.md", "Dockerfile", "docker-compose.yml", "requirements.txt"]
+
+
+def make_repo(path: pathlib.Path, n: int) -> None:
+    """Базовый коммит + n коммитов по 1-3 файла, с --build/--restart в части сообщений"""
+    rnd = random.Random(1)
+    subprocess.run(["git", "init", "-q", "-b", "main", str(path)], check=True)
+    lines = []
+    for i in range(n + 1):
+        ts = 1700000000 + i * 60
+        msg = f"commit {i}\n\n" + ("--build\n" if i % 17 == 0 else "") + ("--restart\n" if i % 23 == 0 else "")
+        data = msg.encode()
+        lines.append("commit refs/heads/main")
+        lines.append(f"mark :{i + 1}")
+        lines.append(f"committer Bench <bench@example.com> {ts} +0000")
+        lines.append(f"data {len(data)}\n{msg}")
+        if i:
+            lines.append(f"from :{i}")
+        for name in (FILES if i == 0 else rnd.sample(FILES, rnd.randint(1, 3))):
+            content = f"{name} {i} {rnd.random()}\n"
+            lines.append(f"M 100644 inline {name}")
+            lines.append(f"data {len(content.encode())}\n{content}")
+        lines.append("")
+    subprocess.run(["git", "fast-import", "--quiet"], cwd=path, input="\n".join(lines).encode(), check=True)
+    subprocess.run(["git", "reset", "-q", "--hard", "main"], cwd=path, check=True)
+
+
+def old_path(ap, old, new):
+    commits = ap.list_new_commits(old, new)
+    messages = [ap.commit_msg(c) for c in commits]
+    changed = set()
+    for c in commits:
+        changed |= ap.changed_files(c)
+    return len(commits), messages, changed
+
+
+def new_path(ap, old, new):
+    commits = ap.collect_commits(old, new)
+    changed = set()
+    for _, _, files in commits:
+        changed |= files
+    return len(commits), [msg for _, msg, _ in commits], changed
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+    with tempfile.TemporaryDirectory() as tmp:
+        repo = pathlib.Path(tmp) / "repo"
+        make_repo(repo, n)
+
+        # autopull читает настройки при импорте; compose не ищем - задаём явно
+        os.environ["WORK_DIR"] = str(repo)
+        os.environ["AUTOPULL_VERBOSE"] = "0"
+        os.environ.setdefault("DOCKER_COMPOSE_CMD", "docker compose")
+        import autopull as ap
+
+        old = ap.rev_parse(f"main~{n}")
+        new = ap.rev_parse("main")
+        print(f"Синтетический репозиторий: {n} новых коммитов")
+
+        results = {}
+        for name, fn in (("по коммиту", old_path), ("один git log", new_path)):
+            start = time.perf_counter()
+            results[name] = fn(ap, old, new)
+            elapsed = time.perf_counter() - start
+            count = results[name][0]
+            print(f"  {name:>13}: {elapsed * 1e3:8.1f} мс  ({count} коммитов, {elapsed * 1e3 / max(count, 1):.2f} мс/коммит)")
+
+        a, b = results.values()
+        print(f"Результаты совпадают: {a == b}")
+
+
+if __name__ == "__main__":
+    main()
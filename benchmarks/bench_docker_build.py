@@ -0,0 +1,84 @@
+"""
+Бенчмарк сборки образа через `docker compose build`: холодная и тёплые
+сборки. Нужен docker с compose v2 (BuildKit) и сеть для первой сборки.
+
+Сценарии:
+  - холодная: без кеша слоёв и без кеша pip (cache mount сброшен);
+  - без кеша слоёв, но с тёплым кешем pip - как при смене requirements.txt;
+  - изменился только код - пересобирается слой COPY . . и байткод;
+  - ничего не изменилось - всё из кеша.
+
+    python benchmarks/bench_docker_build.py [сервис] [повторов]
+
+Внимание: холодный сценарий чистит кеш cache mount'ов BuildKit
+(docker builder prune --filter type=exec.cachemount).
+"""
+import os
+import subprocess
+import sys
+import time
+import uuid
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+COMPOSE = ["docker", "compose", "-f", os.path.join(ROOT, "docker-compose.yml"), "--project-directory", ROOT]
+TOUCH_FILE = os.path.join(ROOT, "cogs", "_bench_build_touch.py")
+
+
+def run(cmd, quiet=True) -> float:
+    start = time.perf_counter()
+    p = subprocess.run(cmd, cwd=ROOT, text=True,
+                       stdout=subprocess.PIPE if quiet else None, stderr=subprocess.STDOUT if quiet else None)
+    elapsed = time.perf_counter() - start
+    if p.returncode != 0:
+        print(p.stdout or "")
+        raise SystemExit(f"команда упала: {' '.join(cmd)}")
+    return elapsed
+
+
+def build(service: str, *flags) -> float:
+    return run(COMPOSE + ["build", *flags, service])
+
+
+def cold(service):
+    run(["docker", "builder", "prune", "-f", "--filter", "type=exec.cachemount"])
+    return build(service, "--no-cache")
+
+
+def warm_pip(service):
+    return build(service, "--no-cache")
+
+
+def code_changed(service):
+    # новый файл в контексте - инвалидирует COPY . ., но не слой с зависимостями
+    with open(TOUCH_FILE, "w", encoding="utf-8") as f:
+        f.write(f"# {uuid.uuid4()}\n")
+    try:
+        return build(service)
+    finally:
+        os.remove(TOUCH_FILE)
+
+
+def unchanged(service):
+    return build(service)
+
+
+def main():
+    service = sys.argv[1] if len(sys.argv) > 1 else "discord-bot"
+    repeats = int(sys.argv[2]) if len(sys.argv) > 2 else 3
+    os.environ.setdefault("DOCKER_BUILDKIT", "1")
+
+    print(f"Сервис: {service}, повторов: {repeats}")
+    build(service)  # прогрев: дальше сценарии сравниваются от одного состояния
+
+    for name, fn in (
+        ("холодная", cold),
+        ("смена зависимостей", warm_pip),
+        ("изменился код", code_changed),
+        ("без изменений", unchanged),
+    ):
+        times = sorted(fn(service) for _ in range(repeats))
+        print(f"  {name:>19}: медиана {times[len(times) // 2]:6.1f} с  (min {times[0]:.1f}, max {times[-1]:.1f})")
+
+
+if __name__ == "__main__":
+    main()
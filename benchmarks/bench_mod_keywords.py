@@ -0,0 +1,80 @@
+"""
+Бенчмарк фильтра запрещённых слов ModerationCog.
+
+Сравнивает старый подход (any(keyword in content) по двум спискам) с
+KeywordMatcher на синтетическом корпусе сообщений.
+
+    python benchmarks/bench_mod_keywords.py [кол-во сообщений]
+"""
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from cogs.mod import KeywordMatcher, ModerationCog  # noqa: E402
+
+WORDS = (
+    "привет как дела сегодня играем на сервере кто онлайн го в войс лол ну да нет "
+    "ok gg спасибо завтра вечером майнкрафт шахта алмазы база незер крипер"
+).split()
+
+
+def make_corpus(n: int, keywords: list, hit_rate: float = 0.02) -> list:
+    rnd = random.Random(42)
+    corpus = []
+    for _ in range(n):
+        words = rnd.choices(WORDS, k=rnd.randint(3, 25))
+        if rnd.random() < hit_rate:
+            words.insert(rnd.randrange(len(words) + 1), rnd.choice(keywords))
+        corpus.append(" ".join(words))
+    return corpus
+
+
+RELIGIOUS = ModerationCog.religious_keywords
+POLITICAL = ModerationCog.political_keywords
+MATCHER = KeywordMatcher({"religious": RELIGIOUS, "political": POLITICAL})
+
+
+def old_check(content: str):
+    content = content.lower()
+    religious = any(keyword in content for keyword in RELIGIOUS)
+    political = any(keyword in content for keyword in POLITICAL)
+    return religious, political
+
+
+def new_check(content: str):
+    found = MATCHER.match(content)
+    return "religious" in found, "political" in found
+
+
+def bench(name, fn, corpus):
+    start = time.perf_counter()
+    hits = 0
+    for content in corpus:
+        religious, political = fn(content)
+        hits += religious or political
+    elapsed = time.perf_counter() - start
+    print(f"{name:>16}: {elapsed:7.2f} s  {len(corpus) / elapsed:>12,.0f} msg/s  hits={hits}")
+    return elapsed
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000
+    corpus = make_corpus(n, RELIGIOUS + POLITICAL)
+
+    # Всё, что находил старый подход, обязан находить и новый
+    # (новый дополнительно ловит написания, сведённые нормализацией)
+    for content in corpus[:20000]:
+        old, new = old_check(content), new_check(content)
+        assert (old[0] <= new[0]) and (old[1] <= new[1]), content
+
+    print(f"Корпус: {n:,} сообщений")
+    old = bench("any(in)", old_check, corpus)
+    new = bench("KeywordMatcher", new_check, corpus)
+    print(f"Ускорение: x{old / new:.2f}")
+
+
+if __name__ == "__main__":
+    main()
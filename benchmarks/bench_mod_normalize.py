@@ -0,0 +1,55 @@
+"""
+Микробенчмарк нормализации текста перед поиском запрещённых слов.
+
+Показывает стоимость fold_text (то, что делается с каждым сообщением)
+и полной normalize_text в сравнении с простым lower(), который делался
+раньше. Отдельно для чисто кириллических и смешанных сообщений: первые
+пропускают translate() целиком.
+
+    python benchmarks/bench_mod_normalize.py [кол-во сообщений]
+"""
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from cogs.mod import fold_text, normalize_text  # noqa: E402
+
+CYRILLIC_WORDS = (
+    "Привет как дела СЕГОДНЯ играем на сервере кто онлайн го в войс лол ну даааа нет "
+    "спасибо завтра вечером шахта алмазы база незер крипер"
+).split()
+LATIN_WORDS = "ok GG spasibo minecraft н3зер l0l".split()
+
+
+def make_corpus(n: int, words: list) -> list:
+    rnd = random.Random(7)
+    return [" ".join(rnd.choices(words, k=rnd.randint(3, 25))) for _ in range(n)]
+
+
+def bench(name, fn, corpus):
+    start = time.perf_counter()
+    for content in corpus:
+        fn(content)
+    elapsed = time.perf_counter() - start
+    print(f"  {name:>15}: {elapsed * 1e9 / len(corpus):8.0f} нс/сообщение")
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 200_000
+    corpora = {
+        "кириллица": make_corpus(n, CYRILLIC_WORDS),
+        "смешанный": make_corpus(n, CYRILLIC_WORDS + LATIN_WORDS),
+    }
+    for title, corpus in corpora.items():
+        avg_len = sum(map(len, corpus)) / len(corpus)
+        print(f"Корпус '{title}': {n:,} сообщений, средняя длина {avg_len:.0f} символов")
+        bench("str.lower", str.lower, corpus)
+        bench("fold_text", fold_text, corpus)
+        bench("normalize_text", normalize_text, corpus)
+
+
+if __name__ == "__main__":
+    main()
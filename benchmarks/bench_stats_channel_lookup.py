@@ -0,0 +1,74 @@
+"""
+Бенчмарк проверки канала статистики на событиях участников.
+
+Сервер с 500 каналами в 25 категориях. Старый путь (без кэша) на каждое
+событие ищет категорию и перебирает её каналы, если канала статистики нет
+или его id не сохранён. С кэшем событие обходится поиском в dict до
+ближайшего изменения каналов сервера.
+
+    python benchmarks/bench_stats_channel_lookup.py
+"""
+import asyncio
+import os
+import sys
+import time
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from cogs.stats import Stats  # noqa: E402
+
+EVENTS = 20_000
+CHANNELS = 500
+CATEGORIES = 25
+
+
+def make_guild(with_stats_channel: bool):
+    channels = {}
+    categories = []
+    per_category = CHANNELS // CATEGORIES
+    for c in range(CATEGORIES):
+        name = "https://discord.moonrein.net" if c == CATEGORIES - 1 else f"категория {c}"
+        category = SimpleNamespace(id=10_000 + c, name=name, channels=[])
+        for i in range(per_category):
+            ch = SimpleNamespace(id=c * per_category + i, name=f"канал-{c}-{i}")
+            category.channels.append(ch)
+            channels[ch.id] = ch
+        categories.append(category)
+    if with_stats_channel:
+        categories[-1].channels[-1].name = "👥 Всего участников: 123"
+    return SimpleNamespace(id=1, categories=categories, get_channel=channels.get)
+
+
+def make_cog():
+    cog = Stats.__new__(Stats)
+    cog.server_stats = {}
+    cog.stats_channel_cache = {}
+    cog.set_stats_channel = cog.server_stats.__setitem__
+    return cog
+
+
+async def bench(name, check, guild):
+    start = time.perf_counter()
+    for _ in range(EVENTS):
+        await check(guild)
+    elapsed = time.perf_counter() - start
+    print(f"  {name:>10}: {elapsed * 1e6 / EVENTS:8.2f} мкс/событие")
+
+
+async def main():
+    for title, with_stats in (("канала статистики нет", False), ("канал есть, id не сохранён", True)):
+        print(f"{CHANNELS} каналов, {title}:")
+        cog = make_cog()
+
+        async def uncached(guild):
+            cog.server_stats.clear()
+            return await cog._resolve_stats_channel(guild)
+
+        await bench("без кэша", uncached, make_guild(with_stats))
+        cog = make_cog()
+        await bench("с кэшем", cog.is_stats_channel_exists, make_guild(with_stats))
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,62 @@
+"""
+Бенчмарк обновления счётчика участников в Stats.
+
+Сравнивает старый подсчёт (sum по guild.members на каждое обновление) с
+MemberCounter, который считает сервер один раз и дальше меняется по
+событиям. Стоимость одного обновления у MemberCounter не зависит от
+размера сервера.
+
+    python benchmarks/bench_stats_member_count.py
+"""
+import os
+import random
+import sys
+import time
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from cogs.stats import MemberCounter  # noqa: E402
+
+UPDATES = 200
+
+
+def make_guild(size: int):
+    rnd = random.Random(size)
+    guild = SimpleNamespace(id=size, members=[])
+    guild.members = [SimpleNamespace(bot=rnd.random() < 0.02, guild=guild) for _ in range(size)]
+    return guild
+
+
+def bench_old(guild) -> float:
+    start = time.perf_counter()
+    for _ in range(UPDATES):
+        sum(1 for member in guild.members if not member.bot)
+    return (time.perf_counter() - start) / UPDATES
+
+
+def bench_new(guild) -> float:
+    counter = MemberCounter()
+    counter.seed(guild)
+    newcomer = SimpleNamespace(bot=False, guild=guild)
+    start = time.perf_counter()
+    for i in range(UPDATES):
+        if i % 2:
+            counter.member_left(newcomer)
+        else:
+            counter.member_joined(newcomer)
+        counter.humans(guild)
+    return (time.perf_counter() - start) / UPDATES
+
+
+def main():
+    print(f"{'участников':>12} | {'sum(members)':>14} | {'MemberCounter':>14}")
+    for size in (1_000, 10_000, 50_000, 100_000):
+        guild = make_guild(size)
+        old = bench_old(guild)
+        new = bench_new(guild)
+        print(f"{size:>12,} | {old * 1e6:>11.1f} мкс | {new * 1e6:>11.2f} мкс")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,150 @@
+"""
+Сквозной бенчмарк MinecraftCog против подменного bridge (fake_bridge.py)
+и заглушки Discord: настоящий aiohttp-сокет, настоящий ког, каналы -
+объекты в памяти.
+
+Меряет:
+  - задержку кадр -> состояние (отправка bridge -> обновлён RealmState);
+  - CPU кода кога на кадр (разбор + обработка) и всего процесса;
+  - время восстановления после разрыва (разрыв -> первый применённый кадр).
+
+    python benchmarks/bench_ws_bridge.py [секунд] [кадров/с на realm]
+"""
+import asyncio
+import json
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from fake_bridge import FakeBridge  # noqa: E402
+
+REALMS = ["anarchy", "smp", "creative"]
+
+
+# -------------------- заглушка Discord --------------------
+
+class FakeChannel:
+    def __init__(self, channel_id: int):
+        self.id = channel_id
+        self.name = ""
+        self.edits = 0
+
+    async def edit(self, name: str, reason: str = None):
+        self.name = name
+        self.edits += 1
+
+
+class FakeBot:
+    def __init__(self, loop, channel_ids):
+        self.loop = loop
+        self.guilds = []
+        self.channels = {cid: FakeChannel(cid) for cid in channel_ids}
+
+    def get_channel(self, channel_id):
+        return self.channels.get(channel_id)
+
+    async def wait_until_ready(self):
+        return None
+
+
+# -------------------- прогоны --------------------
+
+def make_cog(url: str):
+    os.environ["MC_WS_URL"] = url
+    os.environ["MC_WS_DEBUG"] = "0"
+    os.environ.pop("MC_HISTORY_DIR", None)
+    os.environ["MC_REALMS"] = json.dumps({
+        realm: {"online_channel_id": 1000 + 2 * i, "tps_channel_id": 1001 + 2 * i}
+        for i, realm in enumerate(REALMS)
+    })
+    from cogs.websocket import MinecraftCog
+
+    bot = FakeBot(asyncio.get_running_loop(), [1000 + k for k in range(2 * len(REALMS))])
+    return MinecraftCog(bot), bot
+
+
+async def main():
+    seconds = float(sys.argv[1]) if len(sys.argv) > 1 else 10.0
+    rate = float(sys.argv[2]) if len(sys.argv) > 2 else 50.0
+
+    bridge = FakeBridge(REALMS + ["lobby"], rate=rate, noise=rate * 4, players=60, fmt="mixed", seq_players=True)
+    url = await bridge.start()
+    print(f"bridge: {url}, {len(REALMS)} наших realm'а + 1 чужой, {rate:g} кадров/с на realm, шум {rate * 4:g}/с")
+
+    cog, bot = make_cog(url)
+    latencies = []
+    applied_at = []
+    cog_cpu = [0.0]
+    original_decode = cog.decoder.decode
+    original_handle = cog._handle_message
+
+    def decode(raw):
+        cpu = time.process_time()
+        frame = original_decode(raw)
+        cog_cpu[0] += time.process_time() - cpu
+        return frame
+
+    async def handle(frame):
+        cpu = time.process_time()
+        await original_handle(frame)
+        cog_cpu[0] += time.process_time() - cpu
+        now = time.perf_counter()
+        sent = bridge.sent_at.pop((frame.realm, frame.players), None)
+        if sent is not None:
+            latencies.append(now - sent)
+            applied_at.append(now)
+
+    cog.decoder.decode = decode
+    cog._handle_message = handle
+
+    # Ждём подключения
+    while not bridge.clients:
+        await asyncio.sleep(0.05)
+
+    # 1. Установившийся поток: задержка и CPU
+    frames_before = cog.decoder.received
+    cog_cpu[0] = 0.0
+    cpu = time.process_time()
+    await asyncio.sleep(seconds)
+    cpu = time.process_time() - cpu
+    frames = cog.decoder.received - frames_before
+
+    lat = sorted(latencies)
+    print(f"\nКадров получено: {frames:,} ({frames / seconds:,.0f}/с), применено статистики: {len(lat):,}")
+    if lat:
+        print(f"Задержка кадр -> состояние: p50={lat[len(lat) // 2] * 1e3:.2f} мс "
+              f"p99={lat[int(len(lat) * 0.99)] * 1e3:.2f} мс max={lat[-1] * 1e3:.2f} мс")
+    print(f"CPU на кадр: {cog_cpu[0] / max(frames, 1) * 1e6:.1f} мкс ког (разбор + обработка), "
+          f"{cpu / max(frames, 1) * 1e6:.1f} мкс весь процесс вместе с bridge и aiohttp")
+
+    # 2. Восстановление после разрывов. Разрывы здесь идут раз в пару
+    # секунд; чтобы каждый считался разрывом стабильной сессии, а не
+    # флапом, сокращаем stable_after (в бою 30 с).
+    cog.backoff.stable_after = 0.5
+    print(f"\nВосстановление после разрыва (разрыв -> первый применённый кадр), stable_after={cog.backoff.stable_after} с:")
+    for down_for in (0.0, 2.0):
+        values = []
+        for _ in range(3):
+            await bridge.drop_all(down_for=down_for)
+            dropped = bridge.disconnects[-1]
+            while not applied_at or applied_at[-1] <= dropped:
+                await asyncio.sleep(0.01)
+            values.append(applied_at[-1] - dropped)
+            await asyncio.sleep(1.0)
+        print(f"  bridge недоступен {down_for:g} с: среднее {statistics.mean(values):.2f} с, max {max(values):.2f} с")
+
+    print(f"\nСоединение: {cog.connection_stats()}")
+    print(f"Переименования: {cog.rename_stats()}")
+    print(f"Каналы: {[ch.name for ch in bot.channels.values()]}")
+
+    cog.cog_unload()
+    await bridge.stop()
+    await asyncio.sleep(0.1)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,119 @@
+"""
+Бенчмарк разбора кадров bridge в MinecraftCog.
+
+Сравнивает старый путь (json.loads каждого кадра + цепочки .get()) с
+FrameDecoder (фильтр по подстрокам + orjson/json + StatsFrame) на потоке,
+где статистика - малая доля кадров, остальное чат и события игроков.
+
+    python benchmarks/bench_ws_frames.py [кол-во кадров]
+"""
+import json
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import cogs.websocket as ws  # noqa: E402
+from cogs.websocket import FrameDecoder, _to_float, _to_int  # noqa: E402
+
+OUR_REALMS = ("anarchy", "smp")
+ALL_REALMS = OUR_REALMS + ("creative", "lobby", "events")
+NAMES = [f"Player{i}" for i in range(200)]
+
+
+def make_stream(n: int, stats_rate: float = 0.05) -> list:
+    rnd = random.Random(42)
+    frames = []
+    for _ in range(n):
+        realm = rnd.choice(ALL_REALMS)
+        r = rnd.random()
+        if r < stats_rate:
+            players = rnd.sample(NAMES, rnd.randint(0, 60))
+            payload = {"type": "server.stats", "realm": realm, "data": {
+                "players": {"online": len(players), "max": 100},
+                "players_list": players,
+                "tps": {"1m": round(rnd.uniform(15, 20), 2), "mspt": round(rnd.uniform(5, 60), 2)},
+            }}
+        elif r < 0.6:
+            payload = {"type": "chat.message", "realm": realm, "data": {
+                "player": rnd.choice(NAMES),
+                "text": " ".join(rnd.choices(["привет", "го", "в", "шахту", "lol", "gg", "tps", "лагает"], k=8)),
+            }}
+        else:
+            payload = {"type": rnd.choice(("player.join", "player.quit", "player.death")),
+                       "realm": realm, "data": {"player": rnd.choice(NAMES)}}
+        frames.append(json.dumps(payload, ensure_ascii=False))
+    return frames
+
+
+def old_path(raw: str):
+    try:
+        payload = json.loads(raw)
+    except Exception:
+        return None
+    if payload.get("type") not in ("server.stats", "stats.report"):
+        return None
+    data = payload.get("data") or payload.get("payload") or {}
+    realm = (payload.get("realm") or data.get("realm") or "").strip()
+    if realm not in OUR_REALMS:
+        return None
+    players_section = data.get("players") or {}
+    tps_section = data.get("tps") or {}
+    return (
+        _to_int(data.get("players_online"), data.get("players_count"),
+                players_section.get("online"), len(data.get("players_list") or [])),
+        _to_int(data.get("players_max"), players_section.get("max")),
+        _to_float(tps_section.get("1m"), data.get("tps_1m")),
+        _to_float(tps_section.get("mspt"), data.get("mspt")),
+    )
+
+
+def new_path_factory():
+    decoder = FrameDecoder(OUR_REALMS)
+
+    def new_path(raw: str):
+        frame = decoder.decode(raw)
+        if frame is None or (frame.realm and frame.realm not in OUR_REALMS):
+            return None
+        return frame.players, frame.max_players, frame.tps_1m, frame.mspt
+
+    return new_path, decoder
+
+
+def bench(name, fn, frames):
+    start = time.perf_counter()
+    hits = 0
+    for raw in frames:
+        hits += fn(raw) is not None
+    elapsed = time.perf_counter() - start
+    print(f"{name:>22}: {elapsed:7.2f} s  {len(frames) / elapsed:>12,.0f} frames/s  stats={hits}")
+    return elapsed
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 500_000
+    frames = make_stream(n)
+
+    # Оба пути должны находить одни и те же кадры статистики
+    new_path, _ = new_path_factory()
+    for raw in frames[:20000]:
+        assert old_path(raw) == new_path(raw), raw
+
+    print(f"Поток: {n:,} кадров, JSON: {ws.JSON_BACKEND}")
+    old = bench("json.loads + .get()", old_path, frames)
+
+    backend, ws._json_loads = ws._json_loads, json.loads
+    fn, _ = new_path_factory()
+    filtered_json = bench("фильтр + json", fn, frames)
+    ws._json_loads = backend
+
+    fn, decoder = new_path_factory()
+    new = bench(f"фильтр + {ws.JSON_BACKEND}", fn, frames)
+    print(f"Ускорение: x{old / filtered_json:.2f} (только фильтр), x{old / new:.2f} (итог)")
+    print(f"Счётчики: {decoder.stats()}")
+
+
+if __name__ == "__main__":
+    main()
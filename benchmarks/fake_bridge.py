@@ -0,0 +1,247 @@
+"""
+Подменный bridge для MinecraftCog: WS-сервер на aiohttp, который шлёт
+кадры server.stats / stats.report с заданной частотой, разбавляет их
+"шумом" (чат, события игроков) и умеет рвать соединения по расписанию.
+
+Можно запустить отдельно и направить на него бота (MC_WS_URL):
+
+    python benchmarks/fake_bridge.py --port 8765 --realms anarchy,smp --rate 2 --noise 20
+
+Или использовать FakeBridge из кода (см. bench_ws_bridge.py).
+"""
+import argparse
+import asyncio
+import json
+import random
+import time
+from typing import Dict, List, Optional, Tuple
+
+from aiohttp import WSMsgType, web
+
+NAMES = [f"Player{i}" for i in range(1000)]
+CHAT = "привет го в шахту кто онлайн лагает tps норм gg lol база незер".split()
+
+
+class FakeBridge:
+    """
+    rate             - кадров статистики в секунду на каждый realm
+    noise            - кадров чата/событий в секунду (на все realm'ы)
+    players          - длина players_list (основной вклад в размер кадра)
+    fmt              - "server.stats", "stats.report" или "mixed"
+    disconnect_every - рвать все соединения каждые N секунд (0 - никогда)
+    down_for         - после разрыва N секунд отвечать 503 на подключение
+    seq_players      - players_online = номер кадра realm'а; по нему
+                       бенчмарк сопоставляет кадр с моментом отправки
+    """
+
+    def __init__(
+        self,
+        realms: List[str],
+        rate: float = 1.0,
+        noise: float = 0.0,
+        players: int = 20,
+        fmt: str = "server.stats",
+        disconnect_every: float = 0.0,
+        down_for: float = 0.0,
+        token: str = "",
+        seq_players: bool = False,
+        seed: int = 42,
+    ):
+        self.realms = realms
+        self.rate = rate
+        self.noise = noise
+        self.players = players
+        self.fmt = fmt
+        self.disconnect_every = disconnect_every
+        self.down_for = down_for
+        self.token = token
+        self.seq_players = seq_players
+        self.rnd = random.Random(seed)
+
+        self.clients = set()
+        self.seq: Dict[str, int] = {r: 0 for r in realms}
+        self.sent_at: Dict[Tuple[str, int], float] = {}  # (realm, seq) -> perf_counter
+        self.disconnects: List[float] = []               # perf_counter момента разрыва
+        self.frames_sent = 0
+        self.bytes_sent = 0
+        self.connections = 0
+        self.rejected = 0
+        self._down_until = 0.0
+        self._tasks = []
+        self._runner: Optional[web.AppRunner] = None
+
+    # ---------------- кадры ----------------
+
+    def stats_frame(self, realm: str) -> Tuple[str, int]:
+        self.seq[realm] += 1
+        seq = self.seq[realm]
+        rnd = self.rnd
+        players_list = rnd.sample(NAMES, min(self.players, len(NAMES)))
+        online = seq if self.seq_players else len(players_list)
+        tps = round(rnd.uniform(15.0, 20.0), 2)
+        mspt = round(rnd.uniform(5.0, 60.0), 2)
+
+        fmt = self.fmt if self.fmt != "mixed" else rnd.choice(("server.stats", "stats.report"))
+        if fmt == "server.stats":
+            payload = {"type": "server.stats", "realm": realm, "data": {
+                "players": {"online": online, "max": 1000},
+                "players_list": players_list,
+                "tps": {"1m": tps, "mspt": mspt},
+            }}
+        else:
+            payload = {"type": "stats.report", "payload": {
+                "realm": realm,
+                "players_online": online,
+                "players_max": 1000,
+                "players_list": players_list,
+                "tps_1m": tps,
+                "mspt": mspt,
+            }}
+        return json.dumps(payload, ensure_ascii=False), seq
+
+    def noise_frame(self) -> str:
+        rnd = self.rnd
+        realm = rnd.choice(self.realms)
+        if rnd.random() < 0.7:
+            payload = {"type": "chat.message", "realm": realm, "data": {
+                "player": rnd.choice(NAMES), "text": " ".join(rnd.choices(CHAT, k=rnd.randint(2, 12))),
+            }}
+        else:
+            payload = {"type": rnd.choice(("player.join", "player.quit", "player.death")),
+                       "realm": realm, "data": {"player": rnd.choice(NAMES)}}
+        return json.dumps(payload, ensure_ascii=False)
+
+    # ---------------- сервер ----------------
+
+    async def handle_ws(self, request: web.Request):
+        if self.token and request.headers.get("Authorization") != f"Bearer {self.token}":
+            self.rejected += 1
+            return web.Response(status=401)
+        if time.monotonic() < self._down_until:
+            self.rejected += 1
+            return web.Response(status=503)
+
+        ws = web.WebSocketResponse(heartbeat=20.0)
+        await ws.prepare(request)
+        self.connections += 1
+        self.clients.add(ws)
+        try:
+            async for msg in ws:
+                if msg.type == WSMsgType.ERROR:
+                    break
+        finally:
+            self.clients.discard(ws)
+        return ws
+
+    async def broadcast(self, raw: str):
+        for ws in list(self.clients):
+            try:
+                await ws.send_str(raw)
+            except Exception:
+                self.clients.discard(ws)
+                continue
+            self.frames_sent += 1
+            self.bytes_sent += len(raw)
+
+    async def _stats_loop(self, realm: str):
+        interval = 1.0 / self.rate
+        next_at = time.perf_counter()
+        while True:
+            next_at += interval
+            if self.clients:
+                raw, seq = self.stats_frame(realm)
+                self.sent_at[(realm, seq)] = time.perf_counter()
+                await self.broadcast(raw)
+            await asyncio.sleep(max(0.0, next_at - time.perf_counter()))
+
+    async def _noise_loop(self):
+        interval = 1.0 / self.noise
+        next_at = time.perf_counter()
+        while True:
+            next_at += interval
+            if self.clients:
+                await self.broadcast(self.noise_frame())
+            await asyncio.sleep(max(0.0, next_at - time.perf_counter()))
+
+    async def _disconnect_loop(self):
+        while True:
+            await asyncio.sleep(self.disconnect_every)
+            await self.drop_all()
+
+    async def drop_all(self, down_for: Optional[float] = None):
+        """Рвёт все соединения; down_for секунд после этого отвечает 503"""
+        self.disconnects.append(time.perf_counter())
+        self._down_until = time.monotonic() + (self.down_for if down_for is None else down_for)
+        for ws in list(self.clients):
+            await ws.close(code=1012, message=b"fake bridge restart")
+        self.clients.clear()
+
+    async def start(self, host: str = "127.0.0.1", port: int = 0) -> str:
+        app = web.Application()
+        app.router.add_get("/ws", self.handle_ws)
+        app.router.add_get("/", self.handle_ws)
+        self._runner = web.AppRunner(app)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, host, port)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+
+        for realm in self.realms:
+            self._tasks.append(asyncio.create_task(self._stats_loop(realm)))
+        if self.noise > 0:
+            self._tasks.append(asyncio.create_task(self._noise_loop()))
+        if self.disconnect_every > 0:
+            self._tasks.append(asyncio.create_task(self._disconnect_loop()))
+        return f"ws://{host}:{port}/ws"
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        for ws in list(self.clients):
+            await ws.close()
+        if self._runner is not None:
+            await self._runner.cleanup()
+
+
+def parse_args(argv=None):
+    p = argparse.ArgumentParser(description="Подменный bridge для MinecraftCog")
+    p.add_argument("--host", default="127.0.0.1")
+    p.add_argument("--port", type=int, default=8765)
+    p.add_argument("--realms", default="anarchy", help="через запятую")
+    p.add_argument("--rate", type=float, default=1.0, help="кадров статистики/с на realm")
+    p.add_argument("--noise", type=float, default=0.0, help="кадров чата/событий/с")
+    p.add_argument("--players", type=int, default=20, help="длина players_list")
+    p.add_argument("--format", dest="fmt", default="server.stats", choices=("server.stats", "stats.report", "mixed"))
+    p.add_argument("--disconnect-every", type=float, default=0.0, help="рвать соединения каждые N с")
+    p.add_argument("--down-for", type=float, default=0.0, help="после разрыва N с отвечать 503")
+    p.add_argument("--token", default="", help="ожидаемый Bearer-токен (MC_WS_TOKEN)")
+    return p.parse_args(argv)
+
+
+async def _serve(args):
+    bridge = FakeBridge(
+        realms=[r.strip() for r in args.realms.split(",") if r.strip()],
+        rate=args.rate,
+        noise=args.noise,
+        players=args.players,
+        fmt=args.fmt,
+        disconnect_every=args.disconnect_every,
+        down_for=args.down_for,
+        token=args.token,
+    )
+    url = await bridge.start(args.host, args.port)
+    print(f"Подменный bridge слушает {url}")
+    try:
+        while True:
+            await asyncio.sleep(10)
+            print(f"клиентов={len(bridge.clients)} кадров={bridge.frames_sent} байт={bridge.bytes_sent} "
+                  f"подключений={bridge.connections} отказов={bridge.rejected}")
+    finally:
+        await bridge.stop()
+
+
+if __name__ == "__main__":
+    try:
+        asyncio.run(_serve(parse_args()))
+    except KeyboardInterrupt:
+        pass
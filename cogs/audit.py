@@ -1,55 +1,244 @@
 import disnake
 from disnake.ext import commands
+import asyncio
+import collections
 import datetime
-import json
-import os
+import time
 from typing import Optional
 
+from storage import get_state_db
+
+
+# ===== БУФЕРИЗОВАННАЯ ОТПРАВКА ЛОГОВ =====
+
+def _retry_after(e: disnake.HTTPException, default: float) -> float:
+    """Пауза из заголовка Retry-After ответа 429 (своего retry_after у HTTPException нет)"""
+    try:
+        return float(e.response.headers["Retry-After"])
+    except (AttributeError, KeyError, TypeError, ValueError):
+        return default
+
+
+class _ChannelBuffer:
+    """Очередь эмбедов одного лог-канала"""
+
+    def __init__(self, channel):
+        self.channel = channel
+        self.items = collections.deque()  # (время постановки, embed)
+        self.event = asyncio.Event()
+        self.task: Optional[asyncio.Task] = None
+        self.dropped = 0  # события, вытесненные из переполненной очереди
+
+
+class LogSink:
+    """
+    Пакетная отправка логов: вместо одного send() на событие копим эмбеды
+    по каждому лог-каналу и отправляем до 10 штук одним сообщением.
+
+    - очередь ограничена MAX_QUEUE; при переполнении вытесняются самые старые
+      события, а их количество сворачивается в один сводный эмбед;
+    - сброс происходит, когда набралось 10 эмбедов или прошло FLUSH_INTERVAL;
+    - при 429 ждём Retry-After и повторяем ту же пачку; события не ушедшей
+      пачки попадают в счётчик dropped (сводный эмбед - не событие и в
+      счётчики событий не входит);
+    - при выгрузке кога очередь один раз отправляется без повторов, а
+      счётчики пишутся в лог.
+    """
+
+    MAX_EMBEDS = 10           # лимит Discord на сообщение
+    MAX_CHARS = 6000          # лимит Discord на суммарный текст эмбедов сообщения
+    FLUSH_INTERVAL = 2.0      # секунд ожидания добора пачки
+    MAX_QUEUE = 500           # эмбедов в очереди одного канала
+
+    def __init__(self, bot):
+        self.bot = bot
+        self.buffers = {}
+        self.counters = {
+            "queued": 0,
+            "sent_embeds": 0,
+            "sent_messages": 0,
+            "dropped": 0,
+            "rate_limited": 0,
+            "errors": 0,
+        }
+        self.last_flush_latency = 0.0  # сек от постановки самого старого эмбеда до отправки
+        self.max_flush_latency = 0.0
+
+    def push(self, channel, embed: disnake.Embed):
+        """Ставит эмбед в очередь канала (не блокирует обработчик события)"""
+        buf = self.buffers.get(channel.id)
+        if buf is None:
+            buf = self.buffers[channel.id] = _ChannelBuffer(channel)
+        buf.channel = channel
+
+        if len(buf.items) >= self.MAX_QUEUE:
+            buf.items.popleft()
+            buf.dropped += 1
+            self.counters["dropped"] += 1
+
+        buf.items.append((time.monotonic(), embed))
+        self.counters["queued"] += 1
+        buf.event.set()
+
+        if buf.task is None or buf.task.done():
+            buf.task = self.bot.loop.create_task(self._flush_loop(buf))
+
+    def queue_depth(self) -> int:
+        return sum(len(buf.items) for buf in self.buffers.values())
+
+    def stats(self) -> dict:
+        return {
+            **self.counters,
+            "queue_depth": self.queue_depth(),
+            "last_flush_latency": round(self.last_flush_latency, 3),
+            "max_flush_latency": round(self.max_flush_latency, 3),
+        }
+
+    def _take_batch(self, buf: _ChannelBuffer) -> list:
+        """Забирает из очереди пачку, укладывающуюся в лимиты одного сообщения"""
+        batch = []
+        chars = 0
+
+        if buf.dropped:
+            summary = disnake.Embed(
+                title="⚠️ Логи пропущены",
+                description=f"Очередь переполнена, пропущено событий: **{buf.dropped}**",
+                color=disnake.Color.dark_grey(),
+                timestamp=datetime.datetime.now()
+            )
+            buf.dropped = 0
+            # Время None: сводка не событие, её не считают счётчики и задержка
+            batch.append((None, summary))
+            chars += len(summary)
+
+        while buf.items and len(batch) < self.MAX_EMBEDS:
+            size = len(buf.items[0][1])
+            if batch and chars + size > self.MAX_CHARS:
+                break
+            batch.append(buf.items.popleft())
+            chars += size
+        return batch
+
+    async def _flush_loop(self, buf: _ChannelBuffer):
+        while True:
+            if not buf.items and not buf.dropped:
+                buf.event.clear()
+                try:
+                    await asyncio.wait_for(buf.event.wait(), timeout=60)
+                except asyncio.TimeoutError:
+                    # Канал затих — завершаем задачу, push() запустит новую
+                    return
+
+            # Даём пачке набраться, если эмбедов пока мало
+            if len(buf.items) < self.MAX_EMBEDS:
+                await asyncio.sleep(self.FLUSH_INTERVAL)
+
+            batch = self._take_batch(buf)
+            if not batch:
+                continue
+            await self._send_batch(buf, batch)
+
+    async def _send_batch(self, buf: _ChannelBuffer, batch: list, attempts: int = 3) -> bool:
+        embeds = [embed for _, embed in batch]
+        queued_at = [ts for ts, _ in batch if ts is not None]
+        for attempt in range(attempts):
+            try:
+                await buf.channel.send(embeds=embeds)
+                if queued_at:
+                    latency = time.monotonic() - queued_at[0]
+                    self.last_flush_latency = latency
+                    self.max_flush_latency = max(self.max_flush_latency, latency)
+                self.counters["sent_embeds"] += len(queued_at)
+                self.counters["sent_messages"] += 1
+                return True
+            except disnake.HTTPException as e:
+                if e.status != 429:
+                    self.counters["errors"] += 1
+                    print(f"Ошибка отправки логов: {e}")
+                    break
+                self.counters["rate_limited"] += 1
+                if attempt < attempts - 1:
+                    await asyncio.sleep(_retry_after(e, 5))
+            except Exception as e:
+                self.counters["errors"] += 1
+                print(f"Ошибка отправки логов: {e}")
+                break
+        # Пачка не ушла - события потеряны, как и вытесненные из очереди
+        self.counters["dropped"] += len(queued_at)
+        return False
+
+    async def _final_flush(self, buffers: list):
+        """Последняя отправка очередей при выгрузке: без ожидания добора и повторов"""
+        for buf in buffers:
+            while buf.items or buf.dropped:
+                batch = self._take_batch(buf)
+                if not await self._send_batch(buf, batch, attempts=1):
+                    break
+            self.counters["dropped"] += len(buf.items)
+            buf.items.clear()
+        self._log_stats()
+
+    def _log_stats(self):
+        print(f"Логи при выгрузке: {self.stats()}")
+
+    def close(self):
+        pending = []
+        for buf in self.buffers.values():
+            if buf.task and not buf.task.done():
+                buf.task.cancel()
+            if buf.items or buf.dropped:
+                pending.append(buf)
+        self.buffers.clear()
+
+        if pending and not self.bot.loop.is_closed():
+            self.bot.loop.create_task(self._final_flush(pending))
+            return
+        for buf in pending:
+            self.counters["dropped"] += len(buf.items)
+        self._log_stats()
+
 
 class ChatLogger(commands.Cog):
     def __init__(self, bot):
         self.bot = bot
-        self.config_file = "chat_logger_config.json"
+        self.db = get_state_db()
+        self.sink = LogSink(bot)
         self.load_config()
 
-    def load_config(self):
-        """Загрузить настройки из файла"""
-        if os.path.exists(self.config_file):
-            try:
-                with open(self.config_file, 'r', encoding='utf-8') as f:
-                    config = json.load(f)
+    def cog_unload(self):
+        self.sink.close()
 
-                self.voice_log_channel_id = config.get('voice_log_channel_id')
-                self.text_log_channel_id = config.get('text_log_channel_id')
-                self.ignored_channels = config.get('ignored_channels', [])
-            except Exception as e:
-                print(f"❌ Ошибка загрузки настроек: {e}")
+    def load_config(self):
+        """Загрузить настройки из базы"""
+        try:
+            row = self.db.fetchone_sync(
+                "SELECT voice_log_channel_id, text_log_channel_id FROM chat_logger_config WHERE id = 1"
+            )
+            if row is None:
                 self.set_default_config()
-        else:
+                return
+
+            self.voice_log_channel_id, self.text_log_channel_id = row
+            self.ignored_channels = {
+                channel_id for channel_id, in self.db.fetchall_sync("SELECT channel_id FROM chat_logger_ignored")
+            }
+        except Exception as e:
+            print(f"❌ Ошибка загрузки настроек: {e}")
             self.set_default_config()
 
     def set_default_config(self):
         """Установить настройки по умолчанию"""
         self.voice_log_channel_id = None
         self.text_log_channel_id = None
-        self.ignored_channels = []
+        self.ignored_channels = set()
         self.save_config()
 
     def save_config(self):
-        """Сохранить настройки в файл"""
-        try:
-            config = {
-                'voice_log_channel_id': self.voice_log_channel_id,
-                'text_log_channel_id': self.text_log_channel_id,
-                'ignored_channels': self.ignored_channels
-            }
-
-            with open(self.config_file, 'w', encoding='utf-8') as f:
-                json.dump(config, f, indent=4, ensure_ascii=False)
-
-            print("✅ Настройки чат-логгера сохранены")
-        except Exception as e:
-            print(f"❌ Ошибка сохранения настроек: {e}")
+        """Сохранить каналы логов в базу (запись в фоне)"""
+        self.db.submit(
+            "INSERT OR REPLACE INTO chat_logger_config (id, voice_log_channel_id, text_log_channel_id) VALUES (1, ?, ?)",
+            (self.voice_log_channel_id, self.text_log_channel_id)
+        )
 
 
     # ===== ЛОГИРОВАНИЕ ГОЛОСОВЫХ КАНАЛОВ =====
@@ -116,10 +305,7 @@ class ChatLogger(commands.Cog):
         embed.set_thumbnail(url=member.display_avatar.url)
         embed.set_footer(text=f"ID: {member.id}")
 
-        try:
-            await log_channel.send(embed=embed)
-        except Exception as e:
-            print(f"Ошибка отправки голосового лога: {e}")
+        self.sink.push(log_channel, embed)
 
     # ===== ЛОГИРОВАНИЕ ТЕКСТОВЫХ СООБЩЕНИЙ =====
 
@@ -167,10 +353,7 @@ class ChatLogger(commands.Cog):
         embed.set_thumbnail(url=message.author.display_avatar.url)
         embed.set_footer(text=f"ID пользователя: {message.author.id}")
 
-        try:
-            await log_channel.send(embed=embed)
-        except Exception as e:
-            print(f"Ошибка отправки текстового лога: {e}")
+        self.sink.push(log_channel, embed)
 
     @commands.Cog.listener()
     async def on_message_edit(self, before, after):
@@ -206,10 +389,7 @@ class ChatLogger(commands.Cog):
         embed.set_thumbnail(url=after.author.display_avatar.url)
         embed.set_footer(text=f"ID пользователя: {after.author.id}")
 
-        try:
-            await log_channel.send(embed=embed)
-        except Exception as e:
-            print(f"Ошибка отправки лога редактирования: {e}")
+        self.sink.push(log_channel, embed)
 
     @commands.Cog.listener()
     async def on_message_delete(self, message):
@@ -246,10 +426,7 @@ class ChatLogger(commands.Cog):
         embed.set_thumbnail(url=message.author.display_avatar.url)
         embed.set_footer(text=f"ID пользователя: {message.author.id}")
 
-        try:
-            await log_channel.send(embed=embed)
-        except Exception as e:
-            print(f"Ошибка отправки лога удаления: {e}")
+        self.sink.push(log_channel, embed)
 
     # ===== ЛОГИРОВАНИЕ РЕАКЦИЙ =====
 
@@ -297,10 +474,7 @@ class ChatLogger(commands.Cog):
         embed.set_thumbnail(url=user.display_avatar.url)
         embed.set_footer(text=f"ID пользователя: {user.id}")
 
-        try:
-            await log_channel.send(embed=embed)
-        except Exception as e:
-            print(f"Ошибка отправки лога добавления реакции: {e}")
+        self.sink.push(log_channel, embed)
 
     @commands.Cog.listener()
     async def on_reaction_remove(self, reaction, user):
@@ -346,10 +520,7 @@ class ChatLogger(commands.Cog):
         embed.set_thumbnail(url=user.display_avatar.url)
         embed.set_footer(text=f"ID пользователя: {user.id}")
 
-        try:
-            await log_channel.send(embed=embed)
-        except Exception as e:
-            print(f"Ошибка отправки лога удаления реакции: {e}")
+        self.sink.push(log_channel, embed)
 
     @commands.Cog.listener()
     async def on_reaction_clear(self, message, reactions):
@@ -398,10 +569,7 @@ class ChatLogger(commands.Cog):
             inline=False
         )
 
-        try:
-            await log_channel.send(embed=embed)
-        except Exception as e:
-            print(f"Ошибка отправки лога очистки реакций: {e}")
+        self.sink.push(log_channel, embed)
 
 def setup(bot):
     bot.add_cog(ChatLogger(bot))
\ No newline at end of file
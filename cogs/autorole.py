@@ -1,42 +1,41 @@
 import disnake
-import json
-import os
 from disnake.ext import commands
 
+from storage import get_state_db
+
 
 class ReactionRoleCog(commands.Cog):
     def __init__(self, bot):
         self.bot = bot
-        self.config_file = "reactionrole_config.json"
-        self.load_config()
-
-    def load_config(self):
-        """Загружает конфигурацию из JSON файла"""
-        if os.path.exists(self.config_file):
-            with open(self.config_file, 'r', encoding='utf-8') as f:
-                self.config = json.load(f)
-        else:
-            self.config = {}
-            self.save_config()
-
-    def save_config(self):
-        """Сохраняет конфигурацию в JSON файл"""
-        with open(self.config_file, 'w', encoding='utf-8') as f:
-            json.dump(self.config, f, indent=4, ensure_ascii=False)
+        self.db = get_state_db()
+        # guild_id -> конфигурация ({} если не настроено); заполняется по запросу
+        self.config = {}
 
-    def get_guild_config(self, guild_id):
+    async def get_guild_config(self, guild_id):
         """Получает конфигурацию для сервера"""
-        return self.config.get(str(guild_id), {})
+        if guild_id not in self.config:
+            row = await self.db.fetchone(
+                "SELECT channel_id, role_id, message_id FROM reaction_roles WHERE guild_id = ?", (guild_id,)
+            )
+            # Пока ждали базу, set_guild_config мог записать более новое значение
+            self.config.setdefault(guild_id, {
+                "channel_id": row[0],
+                "role_id": row[1],
+                "message_id": row[2]
+            } if row else {})
+        return self.config[guild_id]
 
     def set_guild_config(self, guild_id, channel_id, role_id, message_id=None):
         """Устанавливает конфигурацию для сервера"""
-        guild_id_str = str(guild_id)
-        self.config[guild_id_str] = {
+        self.config[guild_id] = {
             "channel_id": channel_id,
             "role_id": role_id,
             "message_id": message_id
         }
-        self.save_config()
+        self.db.submit(
+            "INSERT OR REPLACE INTO reaction_roles (guild_id, channel_id, role_id, message_id) VALUES (?, ?, ?, ?)",
+            (guild_id, channel_id, role_id, message_id)
+        )
 
     async def setup_reaction_role(self, inter: disnake.ApplicationCommandInteraction,
                                   channel: disnake.TextChannel,
@@ -77,7 +76,7 @@ class ReactionRoleCog(commands.Cog):
             return
 
         # Получаем конфигурацию сервера
-        guild_config = self.get_guild_config(inter.guild.id)
+        guild_config = await self.get_guild_config(inter.guild.id)
 
         if not guild_config:
             await inter.response.send_message("Система ролей не настроена на этом сервере.", ephemeral=True)
@@ -136,7 +135,7 @@ class ReactionRoleCog(commands.Cog):
             return
 
         # Получаем конфигурацию сервера
-        guild_config = self.get_guild_config(payload.guild_id)
+        guild_config = await self.get_guild_config(payload.guild_id)
 
         if not guild_config:
             return
@@ -179,7 +178,7 @@ class ReactionRoleCog(commands.Cog):
         """Обработка удаления реакции (опционально - убираем роль)"""
 
         # Получаем конфигурацию сервера
-        guild_config = self.get_guild_config(payload.guild_id)
+        guild_config = await self.get_guild_config(payload.guild_id)
 
         if not guild_config:
             return
@@ -3,33 +3,346 @@ from operator import truediv
 import disnake
 from disnake.ext import commands
 import asyncio
-from datetime import datetime, timedelta
+from collections import deque
+from datetime import datetime
+import heapq
 import re
+import sys
+import time
+
+from storage import get_state_db
+
+
+# ===== НОРМАЛИЗАЦИЯ ТЕКСТА =====
+
+# Латинские/греческие двойники и leet-замены в словах с кириллицей сводятся
+# к кириллице, чтобы 'бoг' (латинская o) или 'б0г' совпадали с 'бог'.
+# Leet - по начертанию: '3' это 'з', поэтому 'н3гр' -> 'нзгр', а не 'негр'.
+# Только буквы, которые выглядят одинаково: транслитерация (b -> б, n -> н)
+# превращала английские 'bogus' и 'drone' в 'богус' и 'дроне'
+_CONFUSABLES = {
+    # латиница, визуально совпадающая с кириллицей
+    "a": "а", "c": "с", "e": "е", "k": "к", "o": "о", "p": "р", "x": "х", "y": "у",
+    # греческие двойники
+    "α": "а", "ε": "е", "κ": "к", "ο": "о", "π": "п", "ρ": "р", "τ": "т", "χ": "х",
+    # кириллица, которая пишется по-разному
+    "ё": "е", "і": "и", "ї": "и", "є": "е", "ў": "у",
+    # leet
+    "0": "о", "3": "з", "@": "а", "$": "с", "!": "1", "|": "1",
+}
+# Невидимые символы, которыми разбивают слова
+_INVISIBLE = "\u00ad\u200b\u200c\u200d\u2060"
+
+
+def _build_normalize_table() -> list:
+    """
+    Таблица для str.translate. Список по кодам символов, а не dict из
+    str.maketrans: на каждом символе, которого нет в dict, translate()
+    ловит KeyError, и обычный кириллический текст обрабатывается вдвое
+    медленнее. Символы за пределами списка translate() оставляет как есть.
+    """
+    mapping = str.maketrans({**_CONFUSABLES, **{ch: None for ch in _INVISIBLE}})
+    table = list(range(max(mapping) + 1))
+    for code, value in mapping.items():
+        table[code] = value
+    return table
+
+
+NORMALIZE_TABLE = _build_normalize_table()
+
+# Даже так translate() заметно дороже lower(), поэтому сначала дешёвая
+# проверка, есть ли в тексте что заменять (у чисто кириллических сообщений нет)
+_NEEDS_TRANSLATE = re.compile("[" + re.escape("".join(_CONFUSABLES) + _INVISIBLE) + "]")
+_INVISIBLE_RE = re.compile("[" + _INVISIBLE + "]")
+# Двойники заменяются только в словах, где есть и кириллица, и что заменять:
+# чисто латинский текст остаётся латинским, а обычные кириллические слова
+# ('ok привет') не гоняются через translate() по одному
+_MIXED_WORD = re.compile(r"(?<!\S)(?=\S*[а-яёіїєў])\S*[" + re.escape("".join(_CONFUSABLES)) + r"]\S*")
+# Такие слова редки, а _MIXED_WORD проверяет каждую позицию текста. Дешёвый
+# отсев: шаблон начинается с класса символов, и regex быстро проматывает до
+# двойника. Двойник в смешанном слове стоит до кириллицы или после неё -
+# второй случай ищется тем же шаблоном в перевёрнутой строке
+_CONFUSABLE_THEN_CYRILLIC = re.compile("[" + re.escape("".join(_CONFUSABLES)) + r"]\S*?[а-яёіїєў]")
+
+# Повторы букв ('неееегр' -> 'негр', 'haaaram' -> 'haram') - любых, не только
+# кириллических: регулярка KeywordMatcher допускает повтор каждой буквы.
+# Цифры не трогаем, чтобы '1488' не совпадало с '148'
+_REPEATS = re.compile(r"([^\W\d_])\1+")
+
+
+def _fold_word(m) -> str:
+    return m.group().translate(NORMALIZE_TABLE)
+
+
+def fold_text(text: str) -> str:
+    """
+    Регистр, невидимые символы; в словах с кириллицей - двойники и leet ->
+    кириллица. Повторы букв не трогает
+    """
+    text = text.lower()
+    if not _NEEDS_TRANSLATE.search(text):
+        return text
+    text = _INVISIBLE_RE.sub("", text)
+    if not (_CONFUSABLE_THEN_CYRILLIC.search(text) or _CONFUSABLE_THEN_CYRILLIC.search(text[::-1])):
+        return text
+    return _MIXED_WORD.sub(_fold_word, text)
+
+
+def normalize_text(text: str) -> str:
+    """Полная каноническая форма: fold_text + схлопывание повторов букв"""
+    return _REPEATS.sub(r"\1", fold_text(text))
+
+
+class KeywordMatcher:
+    """
+    Поиск запрещённых слов за один проход по сообщению.
+
+    Ключевые слова приводятся к канонической форме (normalize_text) и
+    собираются в префиксное дерево, из которого компилируется одна
+    регулярка: общие префиксы проверяются один раз, а не для каждого слова.
+    Сообщение только проходит через fold_text, а повторы букв
+    ('неееегр') допускает сама регулярка - это дешевле отдельного прохода
+    по тексту. Категория определяется по найденному слову.
+    """
+
+    def __init__(self, categories):
+        # categories: {"religious": [...], "political": [...]}
+        self.category_of = {}
+        for category, keywords in categories.items():
+            for keyword in keywords:
+                keyword = normalize_text(keyword)
+                if keyword:
+                    self.category_of.setdefault(keyword, set()).add(category)
+
+        # Регулярка жадная и находит самое длинное слово в позиции, поэтому
+        # слово наследует категории всех своих префиксов-слов
+        for keyword, found in self.category_of.items():
+            for i in range(1, len(keyword)):
+                found |= self.category_of.get(keyword[:i], set())
+
+        self.categories = frozenset(categories)
+        self.pattern = re.compile(self._build_trie_pattern(self.category_of))
+
+    @staticmethod
+    def _build_trie_pattern(keywords):
+        trie = {}
+        for keyword in keywords:
+            node = trie
+            for ch in keyword:
+                node = node.setdefault(ch, {})
+            node[""] = True
+
+        def build(node, first=False):
+            # Первая буква без '+': иначе regex теряет быстрый поиск по
+            # первому символу, а повтор в начале слова search() и так пропустит.
+            # '+' ставится ровно там, где повтор схлопнет _REPEATS, иначе
+            # найденное слово не найдётся в category_of
+            branches = [
+                re.escape(ch) + ("" if first or not _REPEATS.match(ch * 2) else "+") + build(child)
+                for ch, child in sorted(node.items()) if ch
+            ]
+            if not branches:
+                return ""
+            pattern = branches[0] if len(branches) == 1 else "(?:" + "|".join(branches) + ")"
+            # Слово может закончиться здесь, а может продолжиться более длинным
+            return f"(?:{pattern})?" if "" in node else pattern
+
+        return build(trie, first=True) or "(?!)"
+
+    def match(self, content: str) -> set:
+        """Возвращает множество категорий, слова которых встречаются в тексте"""
+        content = fold_text(content)
+        found = set()
+        pos = 0
+        while True:
+            m = self.pattern.search(content, pos)
+            if m is None:
+                return found
+            found |= self.category_of[_REPEATS.sub(r"\1", m.group())]
+            if found == self.categories:
+                return found
+            # Следующее слово может перекрываться с найденным
+            pos = m.start() + 1
+
+
+# ===== АНТИСПАМ =====
+
+class SpamLimiter:
+    """
+    Скользящее окно по пользователям: спам - это threshold сообщений за
+    window секунд.
+
+    Для каждого пользователя хранится deque(maxlen=threshold) с моментами
+    последних сообщений (time.monotonic), поэтому проверка - O(1): окно
+    превышено, если самое старое из последних threshold сообщений моложе
+    window. Замолчавшие пользователи выметаются раз в sweep_interval.
+    """
+
+    def __init__(self, window: float = 2.0, threshold: int = 3, sweep_interval: float = 60.0):
+        self.window = window
+        self.threshold = threshold
+        self.sweep_interval = sweep_interval
+        self.buckets = {}
+        self._last_sweep = 0.0
+
+    def hit(self, user_id: int, now: float = None) -> bool:
+        """Учитывает сообщение пользователя; True, если порог превышен"""
+        if now is None:
+            now = time.monotonic()
+
+        bucket = self.buckets.get(user_id)
+        if bucket is None:
+            bucket = self.buckets[user_id] = deque(maxlen=self.threshold)
+        bucket.append(now)
+
+        if now - self._last_sweep >= self.sweep_interval:
+            self.sweep(now)
+
+        return len(bucket) >= self.threshold and now - bucket[0] < self.window
+
+    def sweep(self, now: float = None) -> int:
+        """Удаляет пользователей, у которых последнее сообщение вне окна"""
+        if now is None:
+            now = time.monotonic()
+        self._last_sweep = now
+        idle = [user_id for user_id, bucket in self.buckets.items() if now - bucket[-1] >= self.window]
+        for user_id in idle:
+            del self.buckets[user_id]
+        return len(idle)
+
+    def stats(self) -> dict:
+        """Сколько пользователей отслеживается и сколько это занимает памяти"""
+        memory = sys.getsizeof(self.buckets) + sum(sys.getsizeof(b) for b in self.buckets.values())
+        return {
+            "tracked_users": len(self.buckets),
+            "memory_bytes": memory,
+        }
+
+    def clear(self):
+        self.buckets.clear()
+
+
+# ===== ПЛАНИРОВЩИК РАЗМУТОВ =====
+
+class MuteScheduler:
+    """
+    Одна фоновая задача на все муты вместо корутины со sleep() на каждого.
+
+    Сроки хранятся в куче (expires_at, user_id) и дублируются в базе, так
+    что после перезапуска (autopull) муты поднимаются из базы, а истёкшие за
+    время простоя снимаются по порядку. Время - unix time, чтобы переживать
+    перезапуски.
+    """
+
+    def __init__(self, db, on_expire):
+        self.db = db                # storage.StateDB, таблица mutes
+        self.on_expire = on_expire  # async (user_id, reason) -> None
+        self.expires = {}           # user_id -> (expires_at, reason)
+        self.heap = []
+        self._wakeup = asyncio.Event()
+        self._task = None
+
+        for user_id, expires_at, reason in self.db.fetchall_sync("SELECT user_id, expires_at, reason FROM mutes"):
+            self.expires[user_id] = (expires_at, reason)
+            self.heap.append((expires_at, user_id))
+        heapq.heapify(self.heap)
+
+    def __contains__(self, user_id) -> bool:
+        return user_id in self.expires
+
+    def __len__(self) -> int:
+        return len(self.expires)
+
+    def start(self, loop):
+        if self._task is None or self._task.done():
+            self._task = loop.create_task(self._run())
+
+    def stop(self):
+        if self._task and not self._task.done():
+            self._task.cancel()
+
+    def add(self, user_id: int, duration_seconds: float, reason: str = ""):
+        expires_at = time.time() + duration_seconds
+        self.expires[user_id] = (expires_at, reason)
+        heapq.heappush(self.heap, (expires_at, user_id))
+        self.db.submit(
+            "INSERT OR REPLACE INTO mutes (user_id, expires_at, reason) VALUES (?, ?, ?)",
+            (user_id, expires_at, reason)
+        )
+        # Будим задачу: новый срок может оказаться ближайшим
+        self._wakeup.set()
+
+    def remove(self, user_id: int):
+        # Запись в куче остаётся и будет пропущена при извлечении
+        if self.expires.pop(user_id, None) is not None:
+            self.db.submit("DELETE FROM mutes WHERE user_id = ?", (user_id,))
+
+    async def _run(self):
+        while True:
+            self._wakeup.clear()
+            if not self.heap:
+                await self._wakeup.wait()
+                continue
+
+            expires_at, user_id = self.heap[0]
+            delay = expires_at - time.time()
+            if delay > 0:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=delay)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            heapq.heappop(self.heap)
+            current = self.expires.get(user_id)
+            if current is None or current[0] != expires_at:
+                continue  # мут сняли или продлили
+
+            reason = current[1]
+            self.remove(user_id)
+            try:
+                await self.on_expire(user_id, reason)
+            except Exception as e:
+                print(f"Ошибка при снятии мута с пользователя {user_id}: {e}")
 
 
 class ModerationCog(commands.Cog):
+    # Антиспам: SPAM_THRESHOLD сообщений за SPAM_WINDOW_SEC секунд -> мут
+    SPAM_WINDOW_SEC = 2.0
+    SPAM_THRESHOLD = 3
+    SPAM_MUTE_SEC = 600
+
+    # Списки запрещенных слов (религия и политика)
+    religious_keywords = [
+        'аллах', 'бог', 'ислам', 'христианство', 'иудаизм', 'буддизм',
+        'коран', 'библия', 'тора', 'мечеть', 'церковь', 'синагога',
+        'мусульман', 'христиан', 'иудей', 'буддист', 'религи', 'харам',
+        'haram', 'бисмилях', 'бисмиля'
+    ]
+
+    political_keywords = [
+        'политик', 'президент', 'правительство', 'государство', 'власть',
+        'выборы', 'партия', 'оппозиция', 'демократия', 'диктатура',
+        'коммунизм', 'социализм', 'либерализм', 'консерватизм',
+        'парламент', 'министр', 'депутат', 'голосование', 'сво', 'zvo',
+        '1488', '!488', 'гитлер', 'нигер', 'негр', 'negr', 'нegr', 'nеgr', 'nегr',
+        'neгr', 'neгр', 'нeгр', 'раса', 'дрон', 'камикадзе',
+        'украина', 'россия', 'фронт', 'окоп'
+    ]
+
     def __init__(self, bot):
         self.bot = bot
-        self.user_message_count = {}
-        self.muted_users = set()
-
-        # Списки запрещенных слов (религия и политика)
-        self.religious_keywords = [
-            'аллах', 'бог', 'ислам', 'христианство', 'иудаизм', 'буддизм',
-            'коран', 'библия', 'тора', 'мечеть', 'церковь', 'синагога',
-            'мусульман', 'христиан', 'иудей', 'буддист', 'религи', 'харам',
-            'haram', 'HARAM', 'бисмилях', 'бисмиля', 'БИСМИЛЯХ', 'БИСМИЛЯ'
-        ]
-
-        self.political_keywords = [
-            'политик', 'президент', 'правительство', 'государство', 'власть',
-            'выборы', 'партия', 'оппозиция', 'демократия', 'диктатура',
-            'коммунизм', 'социализм', 'либерализм', 'консерватизм',
-            'парламент', 'министр', 'депутат', 'голосование', 'сво', 'zvo', 'ZVO',
-            'ZvO', '1488', 'гитлер', 'нигер', 'негр', 'negr', 'нegr', 'nеgr', 'nегr', 'neгr',
-            'neгр', 'нeгр', 'раса', '!488', 'zVO', 'Zvo', 'СВО', 'сВО', 'Сво', 'дрон', 'камикадзе',
-            'украина', 'россия', 'УКРАИНА', 'РОССИЯ', 'фронт', 'окоп'
-        ]
+        self.spam_limiter = SpamLimiter(self.SPAM_WINDOW_SEC, self.SPAM_THRESHOLD)
+        # Активные муты переживают перезапуск бота
+        self.muted_users = MuteScheduler(get_state_db(), self.unmute_user)
+        self.muted_users.start(self.bot.loop)
+
+        # Регистр, двойники в кириллических словах и leet учитываются
+        # нормализацией; чисто латинские написания в списках перечислены явно
+        self.keyword_matcher = KeywordMatcher({
+            "religious": self.religious_keywords,
+            "political": self.political_keywords,
+        })
 
     @commands.Cog.listener()
     async def on_message(self, message):
@@ -44,34 +357,14 @@ class ModerationCog(commands.Cog):
         await self.check_prohibited_content(message)
 
     async def check_spam(self, message):
-        user_id = message.author.id
-        current_time = datetime.now()
-
-        # Инициализация счетчика для пользователя
-        if user_id not in self.user_message_count:
-            self.user_message_count[user_id] = []
-
-        # Добавляем время сообщения
-        self.user_message_count[user_id].append(current_time)
-
-        # Очищаем старые сообщения (старше 10 секунд)
-        self.user_message_count[user_id] = [
-            msg_time for msg_time in self.user_message_count[user_id]
-            if current_time - msg_time < timedelta(seconds=2)
-        ]
-
-        # Если 3 или более сообщений за 10 секунд - мут
-        if len(self.user_message_count[user_id]) >= 3:
-            await self.mute_user(message.author, message.channel, 600, "Спам")  # 10 минут
+        if self.spam_limiter.hit(message.author.id):
+            await self.mute_user(message.author, message.channel, self.SPAM_MUTE_SEC, "Спам")  # 10 минут
 
     async def check_prohibited_content(self, message):
-        content = message.content.lower()
-
-        # Проверка на религиозные темы
-        religious_found = any(keyword in content for keyword in self.religious_keywords)
-
-        # Проверка на политические темы
-        political_found = any(keyword in content for keyword in self.political_keywords)
+        # Один проход по тексту для всех категорий
+        found = self.keyword_matcher.match(message.content)
+        religious_found = "religious" in found
+        political_found = "political" in found
 
         if religious_found or political_found:
             try:
@@ -110,7 +403,7 @@ class ModerationCog(commands.Cog):
         if user.id in self.muted_users:
             return
 
-        self.muted_users.add(user.id)
+        self.muted_users.add(user.id, duration_seconds, reason)
 
         try:
             # Создаем ephemeral сообщение для нарушителя
@@ -131,28 +424,31 @@ class ModerationCog(commands.Cog):
                 # Если ЛС закрыты, логируем это
                 print(f"Не удалось отправить сообщение о муте пользователю {user.name}")
 
-            # Ждем указанное время
-            await asyncio.sleep(duration_seconds)
-
-            # Размучиваем пользователя
-            self.muted_users.remove(user.id)
-
-            # Ephemeral уведомление о размуте
-            embed = disnake.Embed(
-                title="🔊 Мут снят",
-                description="Вы снова можете писать в чат",
-                color=disnake.Color.green(),
-                timestamp=datetime.now()
-            )
+        except Exception as e:
+            print(f"Ошибка при муте пользователя {user.name}: {e}")
 
-            # Пытаемся отправить в ЛС
+    async def unmute_user(self, user_id, reason):
+        """Вызывается планировщиком, когда срок мута истёк"""
+        user = self.bot.get_user(user_id)
+        if user is None:
             try:
-                await user.send(embed=embed)
-            except disnake.Forbidden:
-                print(f"Не удалось отправить сообщение о размуте пользователю {user.name}")
+                user = await self.bot.fetch_user(user_id)
+            except disnake.HTTPException:
+                return
 
-        except Exception as e:
-            print(f"Ошибка при муте пользователя {user.name}: {e}")
+        # Ephemeral уведомление о размуте
+        embed = disnake.Embed(
+            title="🔊 Мут снят",
+            description="Вы снова можете писать в чат",
+            color=disnake.Color.green(),
+            timestamp=datetime.now()
+        )
+
+        # Пытаемся отправить в ЛС
+        try:
+            await user.send(embed=embed)
+        except disnake.Forbidden:
+            print(f"Не удалось отправить сообщение о размуте пользователю {user.name}")
 
     @commands.Cog.listener()
     async def on_message_edit(self, before, after):
@@ -243,8 +539,9 @@ class ModerationCog(commands.Cog):
 
     def cog_unload(self):
         """Очистка при выгрузке кога"""
-        self.user_message_count.clear()
-        self.muted_users.clear()
+        self.spam_limiter.clear()
+        # Сами муты остаются в базе и поднимутся при следующей загрузке
+        self.muted_users.stop()
 
 
 def setup(bot):
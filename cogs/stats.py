@@ -1,95 +1,227 @@
 import disnake
 from disnake.ext import commands, tasks
 import asyncio
+import collections
 import datetime
-import json
-import os
+import heapq
+import time
+
+from storage import get_state_db
+
+
+def _retry_after(e: disnake.HTTPException, default: float) -> float:
+    """Пауза из заголовка Retry-After ответа 429 (своего retry_after у HTTPException нет)"""
+    try:
+        return float(e.response.headers["Retry-After"])
+    except (AttributeError, KeyError, TypeError, ValueError):
+        return default
+
+
+class MemberCounter:
+    """
+    Счётчики людей и ботов по серверам.
+
+    Полный проход по guild.members делается один раз (seed) и при сверке
+    (reconcile), а события входа/выхода меняют счётчики за O(1).
+    """
+
+    def __init__(self):
+        self.counts = {}  # guild_id -> [люди, боты]
+
+    def seed(self, guild):
+        bots = sum(1 for member in guild.members if member.bot)
+        self.counts[guild.id] = [len(guild.members) - bots, bots]
+
+    def humans(self, guild) -> int:
+        if guild.id not in self.counts:
+            self.seed(guild)
+        return self.counts[guild.id][0]
+
+    def bots(self, guild) -> int:
+        if guild.id not in self.counts:
+            self.seed(guild)
+        return self.counts[guild.id][1]
+
+    def _adjust(self, guild, is_bot: bool, delta: int):
+        counts = self.counts.get(guild.id)
+        if counts is None:
+            # Сервер ещё не посчитан: guild.members уже учитывает событие
+            self.seed(guild)
+            return
+        counts[1 if is_bot else 0] = max(0, counts[1 if is_bot else 0] + delta)
+
+    def member_joined(self, member):
+        self._adjust(member.guild, member.bot, 1)
+
+    def member_left(self, member):
+        self._adjust(member.guild, member.bot, -1)
+
+    def member_updated(self, before, after):
+        if before.bot != after.bot:
+            self._adjust(after.guild, before.bot, -1)
+            self._adjust(after.guild, after.bot, 1)
+
+    def reconcile(self, guild) -> int:
+        """Пересчитывает сервер с нуля и возвращает накопившееся расхождение по людям"""
+        old = self.counts.get(guild.id)
+        self.seed(guild)
+        return 0 if old is None else self.counts[guild.id][0] - old[0]
+
+    def forget(self, guild):
+        self.counts.pop(guild.id, None)
+
+
+class RenameBudget:
+    """
+    Лимит Discord на переименование канала: не больше limit раз за period
+    секунд. Хранит время последних переименований каждого канала.
+    """
+
+    def __init__(self, limit: int = 2, period: float = 600.0):
+        self.limit = limit
+        self.period = period
+        self.history = {}  # channel_id -> deque(monotonic)
+
+    def delay(self, channel_id: int) -> float:
+        """Сколько секунд ждать до следующего разрешённого переименования"""
+        history = self.history.get(channel_id)
+        if not history or len(history) < self.limit:
+            return 0.0
+        return max(0.0, history[0] + self.period - time.monotonic())
+
+    def record(self, channel_id: int):
+        history = self.history.get(channel_id)
+        if history is None:
+            history = self.history[channel_id] = collections.deque(maxlen=self.limit)
+        history.append(time.monotonic())
+
+
+class UpdateScheduler:
+    """
+    Отложенные обновления по серверам: на каждый сервер не больше одного
+    ожидающего обновления, повторные запросы до его выполнения схлопываются.
+    Значение считается в момент выполнения, поэтому побеждает последнее.
+    """
+
+    def __init__(self, handler, debounce: float = 2.0):
+        self.handler = handler  # async (guild_id) -> None
+        self.debounce = debounce
+        self.pending = {}       # guild_id -> когда выполнить (monotonic)
+        self.heap = []
+        self.counters = {"scheduled": 0, "coalesced": 0, "executed": 0}
+        self._wakeup = asyncio.Event()
+        self._task = None
+
+    def start(self, loop):
+        if self._task is None or self._task.done():
+            self._task = loop.create_task(self._run())
+
+    def stop(self):
+        if self._task and not self._task.done():
+            self._task.cancel()
+
+    def schedule(self, guild_id: int, delay: float = None):
+        if guild_id in self.pending:
+            self.counters["coalesced"] += 1
+            return
+        due = time.monotonic() + (self.debounce if delay is None else delay)
+        self.pending[guild_id] = due
+        heapq.heappush(self.heap, (due, guild_id))
+        self.counters["scheduled"] += 1
+        self._wakeup.set()
+
+    def stats(self) -> dict:
+        return {**self.counters, "pending": len(self.pending)}
+
+    async def _run(self):
+        while True:
+            self._wakeup.clear()
+            if not self.heap:
+                await self._wakeup.wait()
+                continue
+
+            due, guild_id = self.heap[0]
+            delay = due - time.monotonic()
+            if delay > 0:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=delay)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            heapq.heappop(self.heap)
+            if self.pending.get(guild_id) != due:
+                continue
+            # Снимаем до вызова, чтобы обработчик мог перепланировать сервер
+            del self.pending[guild_id]
+            self.counters["executed"] += 1
+            try:
+                await self.handler(guild_id)
+            except Exception as e:
+                print(f"❌ Ошибка в обработчике очереди: {e}")
 
 
 class Stats(commands.Cog):
     def __init__(self, bot):
         self.bot = bot
+        self.member_counter = MemberCounter()
         self.server_stats = {}
+        self.stats_channel_cache = {}  # guild_id -> есть ли канал статистики
         self.last_update = {}
-        self.data_file = "stats_data.json"
-        self.update_queue = asyncio.Queue()
-        self.is_processing = False
+        self.db = get_state_db()
+        self.update_scheduler = UpdateScheduler(self.process_update)
+        self.rename_budget = RenameBudget()
+        self.suppressed_renames = 0
 
         self.load_stats_data()
         self.auto_update.start()
         # Запускаем обработчик очереди обновлений
-        self.bot.loop.create_task(self.process_update_queue())
+        self.update_scheduler.start(self.bot.loop)
 
     def cog_unload(self):
         self.auto_update.cancel()
-        self.save_stats_data()
+        self.update_scheduler.stop()
 
     # === ФУНКЦИОНАЛ СОХРАНЕНИЯ ДАННЫХ ===
     def load_stats_data(self):
         """Загружает сохраненные данные о каналах статистики"""
         try:
-            if os.path.exists(self.data_file):
-                with open(self.data_file, 'r', encoding='utf-8') as f:
-                    data = json.load(f)
-                    self.server_stats = {int(guild_id): channel_id for guild_id, channel_id in
-                                         data.get('server_stats', {}).items()}
-            else:
-                self.server_stats = {}
+            rows = self.db.fetchall_sync("SELECT guild_id, channel_id FROM stats_channels")
+            self.server_stats = {guild_id: channel_id for guild_id, channel_id in rows}
         except Exception as e:
             print(f"❌ Ошибка при загрузке данных: {e}")
             self.server_stats = {}
 
-    def save_stats_data(self):
-        """Сохраняет данные о каналах статистики"""
-        try:
-            data = {
-                'server_stats': self.server_stats,
-                'last_save': datetime.datetime.now().isoformat()
-            }
-            with open(self.data_file, 'w', encoding='utf-8') as f:
-                json.dump(data, f, ensure_ascii=False, indent=2)
-        except Exception as e:
-            print(f"❌ Ошибка при сохранении данных: {e}")
-
-    # === СИСТЕМА ОЧЕРЕДИ ОБНОВЛЕНИЙ ===
-    async def process_update_queue(self):
-        """Обрабатывает очередь обновлений для избежания спама API"""
-        while True:
-            try:
-                guild_id = await self.update_queue.get()
-                guild = self.bot.get_guild(guild_id)
-
-                if guild and await self.is_stats_channel_exists(guild):
-                    # Небольшая задержка для группировки быстрых обновлений
-                    await asyncio.sleep(2)
-
-                    # Пропускаем дублирующиеся обновления
-                    while not self.update_queue.empty():
-                        try:
-                            next_guild_id = self.update_queue.get_nowait()
-                            if next_guild_id == guild_id:
-                                self.update_queue.task_done()
-                            else:
-                                # Возвращаем обратно если другой сервер
-                                await self.update_queue.put(next_guild_id)
-                                break
-                        except asyncio.QueueEmpty:
-                            break
+    def set_stats_channel(self, guild_id, channel_id):
+        """Запоминает канал статистики сервера (запись в базу в фоне)"""
+        if self.server_stats.get(guild_id) == channel_id:
+            return
+        self.server_stats[guild_id] = channel_id
+        self.db.submit(
+            "INSERT OR REPLACE INTO stats_channels (guild_id, channel_id, updated_at) VALUES (?, ?, ?)",
+            (guild_id, channel_id, time.time())
+        )
 
-                    await self.update_member_count(guild)
-                    print(f"🔄 Обновлена статистика для {guild.name}")
+    def forget_stats_channel(self, guild_id):
+        """Забывает канал статистики сервера"""
+        if self.server_stats.pop(guild_id, None) is not None:
+            self.db.submit("DELETE FROM stats_channels WHERE guild_id = ?", (guild_id,))
 
-                self.update_queue.task_done()
+    # === СИСТЕМА ОЧЕРЕДИ ОБНОВЛЕНИЙ ===
+    async def process_update(self, guild_id):
+        """Выполняет отложенное обновление сервера из UpdateScheduler"""
+        guild = self.bot.get_guild(guild_id)
+        if guild and await self.is_stats_channel_exists(guild):
+            await self.update_member_count(guild)
+            print(f"🔄 Обновлена статистика для {guild.name}")
 
-            except Exception as e:
-                print(f"❌ Ошибка в обработчике очереди: {e}")
+    def update_stats(self) -> dict:
+        """Счётчики очереди: ожидающие, схлопнутые и отложенные из-за лимита"""
+        return {**self.update_scheduler.stats(), "suppressed_renames": self.suppressed_renames}
 
     async def schedule_update(self, guild):
-        """Добавляет обновление в очередь"""
-        try:
-            await self.update_queue.put(guild.id)
-        except Exception as e:
-            print(f"❌ Ошибка при добавлении в очередь: {e}")
+        """Добавляет обновление в очередь (повторные схлопываются)"""
+        self.update_scheduler.schedule(guild.id)
 
     # === АВТООБНОВЛЕНИЕ ===
     @tasks.loop(hours=1)
@@ -99,13 +231,17 @@ class Stats(commands.Cog):
 
         for guild in self.bot.guilds:
             try:
+                # Сверяем инкрементальные счётчики с реальным списком участников
+                drift = self.member_counter.reconcile(guild)
+                if drift:
+                    print(f"🔧 Счётчик участников {guild.name} расходился на {drift:+d}")
+
                 if await self.is_stats_channel_exists(guild):
                     await self.update_member_count(guild)
                 self.last_update[guild.id] = datetime.datetime.now()
             except Exception as e:
                 print(f"❌ Ошибка при автообновлении на сервере {guild.name}: {e}")
 
-        self.save_stats_data()
 
     @auto_update.before_loop
     async def before_auto_update(self):
@@ -125,6 +261,16 @@ class Stats(commands.Cog):
 
     async def is_stats_channel_exists(self, guild):
         """Проверяет, существует ли уже канал статистики"""
+        # Результат кэшируется до ближайшего события создания/изменения/удаления
+        # канала на сервере, так что события участников обходятся поиском в dict
+        if guild.id in self.stats_channel_cache:
+            return self.stats_channel_cache[guild.id]
+
+        exists = await self._resolve_stats_channel(guild)
+        self.stats_channel_cache[guild.id] = exists
+        return exists
+
+    async def _resolve_stats_channel(self, guild):
         if guild.id in self.server_stats:
             channel = guild.get_channel(self.server_stats[guild.id])
             if channel and channel.name.startswith("👥 Всего участников:"):
@@ -136,6 +282,9 @@ class Stats(commands.Cog):
 
         return False
 
+    def invalidate_stats_channel(self, guild):
+        self.stats_channel_cache.pop(guild.id, None)
+
     async def check_bot_permissions(self, guild):
         """Проверяет, есть ли у бота необходимые права"""
         required_permissions = disnake.Permissions(
@@ -170,8 +319,7 @@ class Stats(commands.Cog):
 
             for channel in category.channels:
                 if channel.name.startswith("👥 Всего участников:"):
-                    self.server_stats[guild.id] = channel.id
-                    self.save_stats_data()
+                    self.set_stats_channel(guild.id, channel.id)
                     return True
             return False
         except Exception as e:
@@ -181,6 +329,7 @@ class Stats(commands.Cog):
     # === СОЗДАНИЕ КАНАЛА ===
     async def setup_stats_channel(self, guild):
         """Создает категорию и голосовой канал для статистики"""
+        self.invalidate_stats_channel(guild)
         try:
             if await self.is_stats_channel_exists(guild):
                 await self.restore_stats_channel(guild)
@@ -197,16 +346,14 @@ class Stats(commands.Cog):
                     reason="Создание категории для статистики сервера"
                 )
 
-            real_members = sum(1 for member in guild.members if not member.bot)
-            total_members = guild.member_count
+            real_members = self.member_counter.humans(guild)
 
             voice_channel = await category.create_voice_channel(
                 f"👥 Всего участников: {real_members}",
                 reason="Создание канала статистики"
             )
 
-            self.server_stats[guild.id] = voice_channel.id
-            self.save_stats_data()
+            self.set_stats_channel(guild.id, voice_channel.id)
 
             await voice_channel.set_permissions(guild.default_role, connect=False, view_channel=True)
 
@@ -225,15 +372,14 @@ class Stats(commands.Cog):
     # === УДАЛЕНИЕ КАНАЛА ===
     async def delete_stats_channel(self, guild):
         """Удаляет канал и категорию статистики"""
+        self.invalidate_stats_channel(guild)
         try:
             if not await self.check_bot_permissions(guild):
                 return False
 
             category = disnake.utils.get(guild.categories, name="https://discord.moonrein.net")
             if not category:
-                if guild.id in self.server_stats:
-                    del self.server_stats[guild.id]
-                    self.save_stats_data()
+                self.forget_stats_channel(guild.id)
                 return True
 
             for channel in category.channels:
@@ -241,9 +387,7 @@ class Stats(commands.Cog):
 
             await category.delete(reason="Удаление статистики сервера")
 
-            if guild.id in self.server_stats:
-                del self.server_stats[guild.id]
-                self.save_stats_data()
+            self.forget_stats_channel(guild.id)
 
             return True
 
@@ -269,13 +413,27 @@ class Stats(commands.Cog):
                 if not voice_channel:
                     return
 
-            real_members = sum(1 for member in guild.members if not member.bot)
-            total_members = guild.member_count
+            real_members = self.member_counter.humans(guild)
 
             new_name = f"👥 Всего участников: {real_members}"
 
             if voice_channel.name != new_name:
-                await voice_channel.edit(name=new_name)
+                # Discord разрешает 2 переименования канала за 10 минут:
+                # не упираемся в 429, а откладываем до освобождения лимита
+                wait = self.rename_budget.delay(voice_channel.id)
+                if wait > 0:
+                    self.suppressed_renames += 1
+                    self.update_scheduler.schedule(guild.id, delay=wait)
+                    return
+
+                try:
+                    await voice_channel.edit(name=new_name)
+                except disnake.HTTPException as e:
+                    if e.status != 429:
+                        raise
+                    self.update_scheduler.schedule(guild.id, delay=_retry_after(e, 60))
+                    return
+                self.rename_budget.record(voice_channel.id)
                 print(f"📊 Обновлена статистика {guild.name}: {real_members} участников")
 
         except Exception as e:
@@ -327,6 +485,10 @@ class Stats(commands.Cog):
         # Ждем полной готовности бота
         await asyncio.sleep(2)
 
+        # Один полный подсчёт участников, дальше счётчики ведутся по событиям
+        for guild in self.bot.guilds:
+            self.member_counter.seed(guild)
+
         # Запускаем автоматическое создание
         await self.auto_setup_on_startup()
 
@@ -335,6 +497,7 @@ class Stats(commands.Cog):
     @commands.Cog.listener()
     async def on_member_join(self, member):
         """Обновляет статистику когда участник заходит на сервер"""
+        self.member_counter.member_joined(member)
         if await self.is_stats_channel_exists(member.guild):
             print(f"👤 {member.name} присоединился к {member.guild.name}")
             await self.schedule_update(member.guild)
@@ -342,6 +505,7 @@ class Stats(commands.Cog):
     @commands.Cog.listener()
     async def on_member_remove(self, member):
         """Обновляет статистику когда участник выходит с сервера"""
+        self.member_counter.member_left(member)
         if await self.is_stats_channel_exists(member.guild):
             print(f"👤 {member.name} покинул {member.guild.name}")
             await self.schedule_update(member.guild)
@@ -349,6 +513,7 @@ class Stats(commands.Cog):
     @commands.Cog.listener()
     async def on_member_update(self, before, after):
         """Обновляет статистику когда участник меняет статус бота"""
+        self.member_counter.member_updated(before, after)
         if before.bot != after.bot and await self.is_stats_channel_exists(after.guild):
             print(f"🤖 Изменен статус бота для {after.name} на {after.guild.name}")
             await self.schedule_update(after.guild)
@@ -370,10 +535,26 @@ class Stats(commands.Cog):
     @commands.Cog.listener()
     async def on_guild_remove(self, guild):
         """Удаляет данные когда бота удаляют с сервера"""
+        self.member_counter.forget(guild)
+        self.invalidate_stats_channel(guild)
         if guild.id in self.server_stats:
-            del self.server_stats[guild.id]
-            self.save_stats_data()
+            self.forget_stats_channel(guild.id)
             print(f"🗑️ Удалены данные статистики для {guild.name}")
 
+    @commands.Cog.listener()
+    async def on_guild_channel_create(self, channel):
+        """Сбрасывает кэш канала статистики"""
+        self.invalidate_stats_channel(channel.guild)
+
+    @commands.Cog.listener()
+    async def on_guild_channel_delete(self, channel):
+        """Сбрасывает кэш канала статистики"""
+        self.invalidate_stats_channel(channel.guild)
+
+    @commands.Cog.listener()
+    async def on_guild_channel_update(self, before, after):
+        """Сбрасывает кэш канала статистики"""
+        self.invalidate_stats_channel(after.guild)
+
 def setup(bot):
     bot.add_cog(Stats(bot))
\ No newline at end of file
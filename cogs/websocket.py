@@ -1,15 +1,36 @@
 # cogs/websocket.py
 import asyncio
+import collections
+import contextlib
+import io
 import json
+import multiprocessing
 import os
+import random
 import time
-from typing import Optional, Dict, List
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from typing import Optional, Dict, List, Iterable, NamedTuple, Tuple
 
 import aiohttp
 from aiohttp import WSMsgType, ClientWebSocketResponse, ClientTimeout
 import disnake
 from disnake.ext import commands, tasks
 
+from mc_alerts import Alert, AlertEngine, load_rules
+from mc_graph import WINDOWS, GraphCache, bucket_end, render_chart
+from mc_history import METRICS, RealmHistory
+from mc_presence import PresenceTracker
+from storage import get_state_db
+
+try:  # orjson необязателен: без него работает stdlib json
+    import orjson
+    _json_loads = orjson.loads
+    JSON_BACKEND = "orjson"
+except ImportError:
+    _json_loads = json.loads
+    JSON_BACKEND = "json"
+
 
 # -------------------- утилиты --------------------
 
@@ -51,16 +72,764 @@ def _to_id(env_val: Optional[str]) -> Optional[int]:
         return None
 
 
+def _env_float(name: str, default: float) -> float:
+    try:
+        return float(os.getenv(name) or default)
+    except Exception:
+        return default
+
+
+def _retry_after(e: disnake.HTTPException, default: float) -> float:
+    """Пауза из заголовка Retry-After ответа 429 (своего retry_after у HTTPException нет)"""
+    try:
+        return float(e.response.headers["Retry-After"])
+    except (AttributeError, KeyError, TypeError, ValueError):
+        return default
+
+
+def _changed(prev: Optional[float], cur: Optional[float], eps: float) -> bool:
+    if prev is None and cur is None:
+        return False
+    if prev is None or cur is None:
+        return True
+    return abs(prev - cur) >= eps
+
+
+# ===================== КАДРЫ BRIDGE =====================
+
+STATS_TYPES = ("server.stats", "stats.report")
+
+
+class StatsFrame(NamedTuple):
+    """Проверенный кадр статистики; realm пустой - кадр для realm по умолчанию"""
+    realm: str
+    players: int
+    max_players: int
+    tps_1m: Optional[float]
+    mspt: Optional[float]
+    players_list: Optional[Tuple[str, ...]]  # None - bridge не прислал список
+
+    @classmethod
+    def from_payload(cls, payload: object) -> Optional["StatsFrame"]:
+        """Разбирает уже декодированный JSON; None, если это не кадр статистики или схема не та"""
+        if not isinstance(payload, dict) or payload.get("type") not in STATS_TYPES:
+            return None
+        data = payload.get("data") or payload.get("payload") or {}
+        if not isinstance(data, dict):
+            return None
+        players_section = data.get("players") or {}
+        tps_section = data.get("tps") or {}
+        players_list = data.get("players_list")
+        if not isinstance(players_section, dict) or not isinstance(tps_section, dict) \
+                or not isinstance(players_list, (list, type(None))):
+            return None
+        realm = payload.get("realm") or data.get("realm") or ""
+        if not isinstance(realm, str):
+            return None
+
+        return cls(
+            realm=realm.strip(),
+            players=_to_int(
+                data.get("players_online"),
+                data.get("players_count"),
+                players_section.get("online"),
+                len(players_list or ()),
+            ),
+            max_players=_to_int(
+                data.get("players_max"),
+                players_section.get("max"),
+            ),
+            tps_1m=_to_float(tps_section.get("1m"), data.get("tps_1m")),
+            mspt=_to_float(tps_section.get("mspt"), data.get("mspt")),
+            players_list=None if players_list is None else tuple(
+                p if isinstance(p, str) else str(p.get("name", "")) if isinstance(p, dict) else str(p)
+                for p in players_list
+            ),
+        )
+
+
+class FrameDecoder:
+    """
+    Декодирует TEXT-кадры bridge в StatsFrame.
+
+    Bridge шлёт и чат, и события игроков, и статистику, а нужна только
+    статистика наших realm'ов. Поэтому сначала дешёвый поиск подстрок
+    по сырому тексту (значение type в кавычках и имена realm'ов), и
+    только прошедшие кадры идут в полный разбор JSON (orjson, если есть).
+    Ложные срабатывания фильтра безопасны - их отсеет from_payload.
+    """
+
+    def __init__(self, realms: Iterable[str]):
+        self._type_markers = tuple(f'"{t}"' for t in STATS_TYPES)
+        self._realm_markers = tuple(f'"{r}"' for r in realms)
+        self.received = 0
+        self.filtered = 0   # отброшены без разбора JSON
+        self.decoded = 0    # кадры статистики
+        self.invalid = 0    # битый JSON или не та схема
+
+    def accepts(self, raw: str) -> bool:
+        if not any(m in raw for m in self._type_markers):
+            return False
+        # Кадр без realm идёт в realm по умолчанию; с чужим realm - мимо
+        if '"realm"' in raw and not any(m in raw for m in self._realm_markers):
+            return False
+        return True
+
+    def decode(self, raw: str) -> Optional[StatsFrame]:
+        self.received += 1
+        if not self.accepts(raw):
+            self.filtered += 1
+            return None
+        try:
+            frame = StatsFrame.from_payload(_json_loads(raw))
+        except ValueError:  # orjson.JSONDecodeError и json.JSONDecodeError - подклассы ValueError
+            frame = None
+        if frame is None:
+            self.invalid += 1
+        else:
+            self.decoded += 1
+        return frame
+
+    def stats(self) -> dict:
+        return {
+            "backend": JSON_BACKEND,
+            "received": self.received,
+            "filtered": self.filtered,
+            "decoded": self.decoded,
+            "invalid": self.invalid,
+        }
+
+
+# ===================== ПЕРЕИМЕНОВАНИЯ =====================
+
+def rename_significance(kind: str, shown: Optional[tuple], new: tuple) -> float:
+    """
+    Насколько важно показать new вместо shown, от 0 до 1.
+    online: (online, players); tps: (online, tps_1m, mspt).
+    """
+    if shown is None or shown[0] != new[0]:
+        return 1.0  # первый показ или переход онлайн/оффлайн
+    if kind == "online":
+        return min(1.0, abs(new[1] - shown[1]) / max(shown[1], 5))
+    score = 0.0
+    for prev, cur, scale in ((shown[1], new[1], 5.0), (shown[2], new[2], 50.0)):
+        if (prev is None) != (cur is None):
+            score = max(score, 0.5)
+        elif prev is not None:
+            score = max(score, abs(cur - prev) / scale)
+    return min(1.0, score)
+
+
+class _RenameSlot:
+    __slots__ = (
+        "kind", "tokens", "refilled", "last_edit", "blocked_until",
+        "shown_name", "shown_values", "name", "values", "significance", "min_interval", "verified",
+    )
+
+    def __init__(self, kind: str, capacity: float):
+        self.kind = kind
+        self.tokens = capacity
+        self.refilled = time.monotonic()
+        self.last_edit = 0.0
+        self.blocked_until = 0.0
+        self.shown_name: Optional[str] = None
+        self.shown_values: Optional[tuple] = None
+        self.name: Optional[str] = None   # желаемое имя, ещё не показанное
+        self.values: Optional[tuple] = None
+        self.significance = 0.0
+        self.min_interval = 0.0
+        self.verified = False  # shown_name сверен с живым каналом (или выставлен нами)
+
+
+class RenameCoalescer:
+    """
+    Переименования голосовых каналов в пределах лимита Discord
+    (2 переименования канала за 10 минут).
+
+    На каждый канал - ведро токенов и только последнее желаемое имя:
+    промежуточные значения затираются и не отправляются. Значимые
+    изменения (онлайн/оффлайн, заметный скачок онлайна или TPS) тратят
+    токен сразу; мелкие ждут полного ведра, чтобы не съесть лимит перед
+    важным событием. Если готовы несколько каналов, первым идёт самый
+    значимый.
+    """
+
+    def __init__(self, edit, capacity: int = 2, period: float = 600.0, min_significance: float = 0.15, current_name=None):
+        self.edit = edit  # async (channel_id, name) -> bool (False - канала нет)
+        self.current_name = current_name  # (channel_id) -> имя канала в Discord сейчас
+        self.capacity = float(capacity)
+        self.rate = capacity / period
+        self.min_significance = min_significance
+        self.slots: Dict[int, _RenameSlot] = {}
+        self.counters = {"requested": 0, "attempted": 0, "applied": 0, "suppressed": 0, "rate_limited": 0, "errors": 0}
+        self._wakeup = asyncio.Event()
+        self._task = None
+
+    def start(self, loop):
+        if self._task is None or self._task.done():
+            self._task = loop.create_task(self._run())
+
+    def stop(self):
+        if self._task and not self._task.done():
+            self._task.cancel()
+
+    def want(self, channel_id: int, kind: str, name: str, values: tuple, min_interval: float = 0.0):
+        slot = self.slots.get(channel_id)
+        if slot is None:
+            slot = self.slots[channel_id] = _RenameSlot(kind, self.capacity)
+        if not slot.verified and self.current_name is not None:
+            # Канал уже называется как надо (например, после рестарта) - квоту
+            # не тратим; переименованный, пока бот лежал, - переименуем обратно
+            live = self.current_name(channel_id)
+            if live is not None:
+                slot.verified = True
+                if live != slot.shown_name:
+                    slot.shown_name, slot.shown_values = live, None
+        slot.min_interval = min_interval
+
+        if name == (slot.name or slot.shown_name):
+            return
+        if slot.name is not None:
+            self.counters["suppressed"] += 1  # прошлое желаемое имя так и не покажем
+        if name == slot.shown_name:
+            slot.name = slot.values = None
+            return
+
+        self.counters["requested"] += 1
+        slot.name, slot.values = name, values
+        slot.significance = rename_significance(kind, slot.shown_values, values)
+        self._wakeup.set()
+
+    def _refill(self, slot: _RenameSlot, now: float):
+        slot.tokens = min(self.capacity, slot.tokens + (now - slot.refilled) * self.rate)
+        slot.refilled = now
+
+    def _ready_at(self, slot: _RenameSlot, now: float) -> float:
+        self._refill(slot, now)
+        need = 1.0 if slot.significance >= self.min_significance else self.capacity
+        return max(
+            slot.blocked_until,
+            slot.last_edit + slot.min_interval,
+            now + max(0.0, need - slot.tokens) / self.rate,
+        )
+
+    def stats(self) -> dict:
+        return {**self.counters, "pending": sum(1 for s in self.slots.values() if s.name is not None)}
+
+    def export(self) -> dict:
+        """Состояние каналов для снимка; monotonic-время переводится в настенное"""
+        now, wall = time.monotonic(), time.time()
+        out = {}
+        for channel_id, slot in self.slots.items():
+            self._refill(slot, now)
+            out[str(channel_id)] = {
+                "kind": slot.kind,
+                "shown_name": slot.shown_name,
+                "shown_values": list(slot.shown_values) if slot.shown_values is not None else None,
+                "tokens": slot.tokens,
+                "last_edit": wall - (now - slot.last_edit) if slot.last_edit else 0.0,
+            }
+        return out
+
+    def restore(self, data: dict, saved_at: float):
+        """Слоты из снимка; shown_name сверяется с живым каналом при первом want()"""
+        now, wall = time.monotonic(), time.time()
+        for channel_id, d in data.items():
+            slot = _RenameSlot(d["kind"], self.capacity)
+            slot.shown_name = d.get("shown_name")
+            values = d.get("shown_values")
+            slot.shown_values = tuple(values) if values is not None else None
+            # Токены за время простоя успели накопиться
+            slot.tokens = min(self.capacity, float(d.get("tokens", self.capacity)) + (wall - saved_at) * self.rate)
+            if d.get("last_edit"):
+                slot.last_edit = now - (wall - d["last_edit"])
+            self.slots[int(channel_id)] = slot
+
+    async def _fire(self, channel_id: int, slot: _RenameSlot):
+        name, values = slot.name, slot.values
+        prev_name, prev_values = slot.shown_name, slot.shown_values
+        now = time.monotonic()
+        slot.tokens -= 1
+        slot.last_edit = now
+        self.counters["attempted"] += 1
+        try:
+            exists = await self.edit(channel_id, name)
+        except disnake.HTTPException as e:
+            if e.status == 429:
+                self.counters["rate_limited"] += 1
+                slot.tokens = 0.0
+                slot.blocked_until = time.monotonic() + _retry_after(e, 60)
+            else:
+                self.counters["errors"] += 1
+                slot.blocked_until = time.monotonic() + 60
+                print(f"[MinecraftCog] rename {channel_id} error: {e!r}")
+            return
+        except Exception as e:
+            self.counters["errors"] += 1
+            slot.blocked_until = time.monotonic() + 60
+            print(f"[MinecraftCog] rename {channel_id} error: {e!r}")
+            return
+
+        if not exists:
+            del self.slots[channel_id]
+            return
+        self.counters["applied"] += 1
+        slot.shown_name, slot.shown_values = name, values
+        slot.verified = True
+        if slot.name is None:
+            # Пока ждали ответа, want() вернул старое показанное имя (и снял
+            # желаемое, сравнив его с устаревшим shown_name) - его и показываем
+            if prev_name is not None and prev_name != name:
+                self.counters["requested"] += 1
+                slot.name, slot.values = prev_name, prev_values
+                slot.significance = rename_significance(slot.kind, values, prev_values) if prev_values is not None else 1.0
+                self._wakeup.set()
+        elif slot.name == name:  # пока ждали ответа, могло прийти новое имя
+            slot.name = slot.values = None
+        else:
+            slot.significance = rename_significance(slot.kind, values, slot.values)
+
+    async def _run(self):
+        while True:
+            self._wakeup.clear()
+            now = time.monotonic()
+            pending = [(cid, s) for cid, s in self.slots.items() if s.name is not None]
+            if not pending:
+                await self._wakeup.wait()
+                continue
+
+            ready_at = {cid: self._ready_at(s, now) for cid, s in pending}
+            ready = [(cid, s) for cid, s in pending if ready_at[cid] <= now]
+            if not ready:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=min(ready_at.values()) - now)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            ready.sort(key=lambda item: item[1].significance, reverse=True)
+            for cid, slot in ready:
+                if slot.name is None:
+                    continue
+                # Одна ошибка не должна останавливать все переименования
+                try:
+                    await self._fire(cid, slot)
+                except Exception as e:
+                    self.counters["errors"] += 1
+                    slot.blocked_until = time.monotonic() + 60
+                    print(f"[MinecraftCog] rename loop error: {e!r}")
+
+
+# ===================== ПЕРЕПОДКЛЮЧЕНИЕ =====================
+
+class ReconnectBackoff:
+    """
+    Когда снова пробовать подключиться к bridge.
+
+    closed    - неудачи копятся, пауза растёт как base * 2^n (до cap) с
+                полным джиттером, чтобы не долбить лежащий bridge;
+    open      - после failure_threshold неудач подряд пауза cooldown
+                (circuit breaker);
+    half_open - после cooldown одна пробная попытка: удача закрывает
+                цепь, неудача снова открывает.
+
+    Счётчик неудач сбрасывается, только если сессия прожила stable_after
+    секунд: иначе "подключился и сразу отвалился" крутился бы без пауз.
+    """
+
+    def __init__(
+        self,
+        base: float = 1.0,
+        cap: float = 60.0,
+        failure_threshold: int = 8,
+        cooldown: float = 300.0,
+        stable_after: float = 30.0,
+    ):
+        self.base = base
+        self.cap = cap
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.stable_after = stable_after
+        self.state = "closed"
+        self.failures = 0
+        self.next_attempt = 0.0  # monotonic
+        self.opened = 0          # сколько раз срабатывал breaker
+
+    def ready(self, now: float) -> bool:
+        if now < self.next_attempt:
+            return False
+        if self.state == "open":
+            self.state = "half_open"
+        return True
+
+    def on_failure(self, now: float) -> float:
+        """Учитывает неудачу; возвращает паузу до следующей попытки"""
+        self.failures += 1
+        if self.state == "half_open" or self.failures >= self.failure_threshold:
+            if self.state != "open":
+                self.opened += 1
+            self.state = "open"
+            delay = self.cooldown
+        else:
+            delay = random.uniform(0, min(self.cap, self.base * 2 ** (self.failures - 1)))
+        self.next_attempt = now + delay
+        return delay
+
+    def on_connected(self):
+        self.state = "closed"
+
+    def on_disconnected(self, now: float, uptime: float) -> float:
+        if uptime >= self.stable_after:
+            self.failures = 0
+            self.next_attempt = now + random.uniform(0, self.base)
+            return self.next_attempt - now
+        return self.on_failure(now)
+
+
+# ======================= АЛЕРТЫ =======================
+
+class AlertSender:
+    """
+    Отправка алертов в канал с ограничением частоты: ведро на burst
+    сообщений, дальше одно сообщение в per секунд. Пока ждём, алерты
+    копятся (не больше max_queue, старые вытесняются) и уходят одним
+    сообщением до 10 эмбедов.
+    """
+
+    def __init__(self, bot, channel_id: int, burst: int = 3, per: float = 20.0, max_queue: int = 50):
+        self.bot = bot
+        self.channel_id = channel_id
+        self.burst = float(burst)
+        self.per = per
+        self.tokens = float(burst)
+        self.refilled = time.monotonic()
+        self.queue = collections.deque(maxlen=max_queue)
+        self.counters = {"queued": 0, "sent_messages": 0, "sent_embeds": 0, "dropped": 0, "rate_limited": 0, "errors": 0}
+        self._wakeup = asyncio.Event()
+        self._task = None
+
+    def push(self, embed: disnake.Embed):
+        if len(self.queue) == self.queue.maxlen:
+            self.counters["dropped"] += 1
+        self.queue.append(embed)
+        self.counters["queued"] += 1
+        self._wakeup.set()
+        if self._task is None or self._task.done():
+            self._task = self.bot.loop.create_task(self._run())
+
+    def stop(self):
+        if self._task and not self._task.done():
+            self._task.cancel()
+
+    def stats(self) -> dict:
+        return {**self.counters, "queue_depth": len(self.queue), "tokens": round(self.tokens, 2)}
+
+    async def _run(self):
+        while True:
+            if not self.queue:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+
+            now = time.monotonic()
+            self.tokens = min(self.burst, self.tokens + (now - self.refilled) / self.per)
+            self.refilled = now
+            if self.tokens < 1:
+                await asyncio.sleep((1 - self.tokens) * self.per)
+                continue
+
+            channel = self.bot.get_channel(self.channel_id)
+            embeds = [self.queue.popleft() for _ in range(min(10, len(self.queue)))]
+            if channel is None:
+                self.counters["errors"] += len(embeds)
+                print(f"[MinecraftCog] канал алертов {self.channel_id} не найден")
+                continue
+
+            self.tokens -= 1
+            try:
+                await channel.send(embeds=embeds)
+                self.counters["sent_messages"] += 1
+                self.counters["sent_embeds"] += len(embeds)
+            except disnake.HTTPException as e:
+                if e.status != 429:
+                    self.counters["errors"] += 1
+                    print(f"[MinecraftCog] ошибка отправки алерта: {e!r}")
+                    continue
+                self.counters["rate_limited"] += 1
+                self.queue.extendleft(reversed(embeds))
+                await asyncio.sleep(_retry_after(e, 5))
+            except Exception as e:
+                # Сетевая ошибка или таймаут не должны останавливать отправку алертов
+                self.counters["errors"] += 1
+                print(f"[MinecraftCog] ошибка отправки алерта: {e!r}")
+
+
+def _alert_embed(alert: Alert) -> disnake.Embed:
+    rule = alert.rule
+    if alert.kind == "firing":
+        title = f"🚨 {alert.realm}: {rule.name}"
+        color = disnake.Color.red()
+        text = f"{rule.metric} {rule.agg} за {rule.window:g} с = **{alert.value:.2f}** ({rule.op} {rule.threshold:g})"
+    else:
+        title = f"✅ {alert.realm}: {rule.name} снят"
+        color = disnake.Color.green()
+        text = f"{rule.metric} {rule.agg} за {rule.window:g} с = **{alert.value:.2f}** (порог снятия {rule.clear:g})"
+    return disnake.Embed(title=title, description=text, color=color, timestamp=datetime.fromtimestamp(alert.ts))
+
+
+# ======================= REALM STATE =======================
+
+class RealmState:
+    """
+    Всё, что относится к одному realm: его каналы, последние значения,
+    дебаунс переименований и пороги изменений. Кадры из общего WS
+    раскладываются по этим объектам через dict realm -> RealmState.
+    """
+
+    def __init__(
+        self,
+        realm: str,
+        online_channel_id: Optional[int] = None,
+        tps_channel_id: Optional[int] = None,
+        tps_eps: float = 0.05,
+        mspt_eps: float = 0.05,
+        update_min_sec: int = 10,
+    ):
+        self.realm = realm
+        self.voice_channel_id_online = online_channel_id
+        self.voice_channel_id_tps = tps_channel_id
+        self.TPS_CHANGE_EPS = tps_eps
+        self.MSPT_CHANGE_EPS = mspt_eps
+        self.CHANNEL_UPDATE_MIN_SEC = update_min_sec
+
+        # Активность / значения
+        self._last_stats_ts: float = 0.0
+        self.server_status: Dict[str, object] = {
+            "realm": realm,
+            "online": False,
+            "players": 0,
+            "max_players": 0,
+            "tps_1m": None,
+            "mspt": None,
+            "stale": False,  # соединение живо, но статистика давно не приходила
+        }
+        self._prev_players: Optional[int] = None
+        self._prev_tps: Optional[float] = None
+        self._prev_mspt: Optional[float] = None
+
+        # Состояние известно (кадр, оффлайн или снимок); до этого имена каналов не трогаем
+        self.known = False
+
+        # История значений (mc_history.RealmHistory), задаётся когом
+        self.history: Optional[RealmHistory] = None
+
+    def channel_id(self, kind: str) -> Optional[int]:
+        return self.voice_channel_id_online if kind == "online" else self.voice_channel_id_tps
+
+    def set_channel_id(self, kind: str, ch_id: int):
+        if kind == "online":
+            self.voice_channel_id_online = ch_id
+        else:
+            self.voice_channel_id_tps = ch_id
+
+    # ---------------- имена каналов ----------------
+
+    def build_online_name(self) -> str:
+        s = self.server_status
+        realm = self.realm
+        if s.get("stale"):
+            base = f"🟡 MC {realm}: нет данных"
+        elif s.get("online"):
+            p = _to_int(s.get("players", 0))
+            m = _to_int(s.get("max_players", 0))
+            base = f"🟢 MC {realm}: {p}/{m}" if m else f"🟢 MC {realm}: {p}"
+        else:
+            base = f"🔴 MC {realm}: оффлайн"
+        return base[:95]
+
+    def build_tps_name(self) -> str:
+        s = self.server_status
+        realm = self.realm
+        tps_1m = _to_float(s.get("tps_1m"))
+        mspt = _to_float(s.get("mspt"))
+        if s.get("stale"):
+            name = f"⚙️ TPS {realm}: нет данных"
+        elif not s.get("online"):
+            name = f"⚙️ TPS {realm}: отсутствует"
+        else:
+            tps_part = f"{tps_1m:.1f}" if tps_1m is not None else "—"
+            mspt_part = f" | {mspt:.2f} mspt" if mspt is not None else ""
+            name = f"⚙️ TPS {realm}: {tps_part}{mspt_part}"
+        return name[:95]
+
+    def build_name(self, kind: str) -> str:
+        return self.build_online_name() if kind == "online" else self.build_tps_name()
+
+    def rename_values(self, kind: str) -> tuple:
+        """Значения, по которым RenameCoalescer оценивает важность изменения имени"""
+        s = self.server_status
+        state = "stale" if s.get("stale") else ("online" if s.get("online") else "offline")
+        if kind == "online":
+            return state, _to_int(s.get("players", 0))
+        return state, _to_float(s.get("tps_1m")), _to_float(s.get("mspt"))
+
+    def export(self) -> dict:
+        return {
+            "status": dict(self.server_status),
+            "prev": [self._prev_players, self._prev_tps, self._prev_mspt],
+            "last_stats_ts": self._last_stats_ts,
+        }
+
+    def restore(self, data: dict):
+        self.server_status.update(data.get("status") or {})
+        self.server_status["realm"] = self.realm
+        self._prev_players, self._prev_tps, self._prev_mspt = data.get("prev") or (None, None, None)
+        self._last_stats_ts = float(data.get("last_stats_ts") or 0.0)
+        self.known = True
+
+    def staleness(self, now: float) -> Optional[float]:
+        """Секунд с последнего кадра статистики (None - кадров ещё не было)"""
+        return now - self._last_stats_ts if self._last_stats_ts else None
+
+    # ---------------- обновление значений ----------------
+
+    def apply_stats(self, players: int, max_players: int, tps_1m: Optional[float], mspt: Optional[float]):
+        """Обновляет статус; возвращает (players_changed, tps_changed)"""
+        self.server_status.update({
+            "realm": self.realm,
+            "online": True,
+            "players": players,
+            "max_players": max_players,
+            "tps_1m": tps_1m,
+            "mspt": mspt,
+            "stale": False,
+        })
+        self.known = True
+        self._last_stats_ts = time.time()
+
+        players_changed = (self._prev_players is None) or (players != self._prev_players)
+        self._prev_players = players
+
+        tps_changed = _changed(self._prev_tps, tps_1m, self.TPS_CHANGE_EPS)
+        mspt_changed = _changed(self._prev_mspt, mspt, self.MSPT_CHANGE_EPS)
+        self._prev_tps = tps_1m
+        self._prev_mspt = mspt
+        return players_changed, (tps_changed or mspt_changed)
+
+    def go_offline(self):
+        self.server_status.update({
+            "online": False,
+            "players": 0,
+            "tps_1m": None,
+            "mspt": None,
+            "stale": False,
+        })
+        self.known = True
+        self._forget_prev()
+
+    def mark_stale(self):
+        # Сокет не трогаем: значения просто больше не считаем актуальными
+        self.server_status["stale"] = True
+        self._forget_prev()
+
+    def _forget_prev(self):
+        # Следующий кадр статистики обязательно обновит оба имени
+        self._prev_players = None
+        self._prev_tps = None
+        self._prev_mspt = None
+
+
+def _load_realms() -> Dict[str, RealmState]:
+    """
+    Realm'ы и их каналы из MC_REALMS (JSON):
+        {"anarchy": {"online_channel_id": 1, "tps_channel_id": 2},
+         "survival": {"online_channel_id": 3, "tps_channel_id": 4, "tps_eps": 0.1}}
+    Без MC_REALMS - один realm из MC_REALM / MC_ONLINE_CHANNEL_ID / MC_TPS_CHANNEL_ID.
+    """
+    tps_eps = _env_float("MC_TPS_CHANGE_EPS", 0.05)
+    mspt_eps = _env_float("MC_MSPT_CHANGE_EPS", 0.05)
+    update_min_sec = max(3, int(_env_float("MC_CHANNEL_UPDATE_MIN_SEC", 10)))
+
+    raw = (os.getenv("MC_REALMS") or "").strip()
+    if raw:
+        try:
+            mapping = json.loads(raw)
+            realms = {}
+            for realm, cfg in mapping.items():
+                cfg = cfg or {}
+                realms[realm] = RealmState(
+                    realm,
+                    online_channel_id=_to_id(cfg.get("online_channel_id")),
+                    tps_channel_id=_to_id(cfg.get("tps_channel_id")),
+                    tps_eps=float(cfg.get("tps_eps", tps_eps)),
+                    mspt_eps=float(cfg.get("mspt_eps", mspt_eps)),
+                    update_min_sec=max(3, int(cfg.get("update_min_sec", update_min_sec))),
+                )
+            if realms:
+                return realms
+        except Exception as e:
+            print(f"[MinecraftCog] MC_REALMS parse error: {e!r}")
+
+    realm = (os.getenv("MC_REALM") or "anarchy").strip()
+    return {realm: RealmState(
+        realm,
+        online_channel_id=_to_id(os.getenv("MC_ONLINE_CHANNEL_ID")),
+        tps_channel_id=_to_id(os.getenv("MC_TPS_CHANNEL_ID")),
+        tps_eps=tps_eps,
+        mspt_eps=mspt_eps,
+        update_min_sec=update_min_sec,
+    )}
+
+
+# ======================= СНИМОК =======================
+
+SNAPSHOT_VERSION = 1
+
+
+def _load_snapshot(db) -> Optional[dict]:
+    row = db.fetchone_sync("SELECT version, saved_at, data FROM mc_snapshot WHERE id = 1")
+    if row is None:
+        return None
+    version, saved_at, data = row
+    if version != SNAPSHOT_VERSION:
+        print(f"[MinecraftCog] снимок версии {version} пропущен (ожидается {SNAPSHOT_VERSION})")
+        return None
+    try:
+        snapshot = json.loads(data)
+    except ValueError as e:
+        print(f"[MinecraftCog] снимок повреждён: {e!r}")
+        return None
+    snapshot["saved_at"] = saved_at
+    return snapshot
+
+
+# ======================= ГРАФИКИ =======================
+
+def _graph_data(history: RealmHistory, metric: str, since: float, until: float):
+    """
+    Ряд для /mc graph и сводка (мин, сред, макс); выполняется в потоке,
+    поэтому history - снимок RealmHistory.snapshot(), а не живая история
+    """
+    tier, series = history.query(metric, since, until)
+    values = [row[2] for row in series if row[2] == row[2]]
+    summary = (
+        min(row[1] for row in series if row[1] == row[1]),
+        sum(values) / len(values),
+        max(row[3] for row in series if row[3] == row[3]),
+    ) if values else None
+    return tier, series, summary
+
+
 # ========================== COG ===========================
 
 class MinecraftCog(commands.Cog):
     """
     Минимальный и устойчивый WS‑клиент к bridge:
-    - только ONLINE / TPS(1m) / MSPT для выбранного REALM;
+    - ONLINE / TPS(1m) / MSPT для всех настроенных realm'ов через одно соединение;
     - autoping=ON (автоподтверждение PING серверу);
     - без собственных пингов/idle‑watchdog (не дёргаем соединение);
     - мягкий реконнект при реальном разрыве;
-    - дебаунс переименования голосовых каналов.
+    - переименования голосовых каналов через RenameCoalescer (лимит Discord).
     """
 
     def __init__(self, bot: commands.Bot):
@@ -69,7 +838,6 @@ class MinecraftCog(commands.Cog):
         # Конфигурация
         self.WS_URL: str = (os.getenv("MC_WS_URL") or "ws://bridge:8765/ws").strip().rstrip("/")
         self.WS_TOKEN: str = (os.getenv("MC_WS_TOKEN") or "").strip()
-        self.REALM: str = (os.getenv("MC_REALM") or "anarchy").strip()
 
         # Логи/тримминг
         self.DEBUG: bool = (os.getenv("MC_WS_DEBUG") or "0").strip().lower() in {"1", "true", "yes"}
@@ -78,66 +846,92 @@ class MinecraftCog(commands.Cog):
         except Exception:
             self.TRUNC = 400
 
-        # Обновление имён каналов
-        try:
-            self.CHANNEL_UPDATE_MIN_SEC: int = max(3, int(os.getenv("MC_CHANNEL_UPDATE_MIN_SEC") or "10"))
-        except Exception:
-            self.CHANNEL_UPDATE_MIN_SEC = 10
-        try:
-            self.TPS_CHANGE_EPS: float = float(os.getenv("MC_TPS_CHANGE_EPS") or "0.05")
-        except Exception:
-            self.TPS_CHANGE_EPS = 0.05
-        try:
-            self.MSPT_CHANGE_EPS: float = float(os.getenv("MC_MSPT_CHANGE_EPS") or "0.05")
-        except Exception:
-            self.MSPT_CHANGE_EPS = 0.05
+        # Realm'ы: realm -> состояние; кадры без realm уходят в первый
+        self.realms: Dict[str, RealmState] = _load_realms()
+        self.default_realm: RealmState = next(iter(self.realms.values()))
+        self.decoder = FrameDecoder(self.realms)
+
+        # История TPS/MSPT/онлайна; с MC_HISTORY_DIR кольца лежат в файлах (mmap)
+        history_dir = (os.getenv("MC_HISTORY_DIR") or "").strip() or None
+        for rs in self.realms.values():
+            rs.history = RealmHistory(rs.realm, history_dir)
+
+        # Кто из игроков онлайн и сессии игры (mc_sessions / mc_playtime)
+        self.db = get_state_db()
+        self.presence = PresenceTracker(
+            self.db, retention_days=_env_float("MC_SESSIONS_RETENTION_DAYS", 90.0)
+        )
+
+        # Алерты по порогам: без MC_ALERT_CHANNEL_ID правила не проверяются
+        alert_channel_id = _to_id(os.getenv("MC_ALERT_CHANNEL_ID"))
+        self.alerts: Optional[AlertEngine] = None
+        self.alert_sender: Optional[AlertSender] = None
+        if alert_channel_id:
+            self.alerts = AlertEngine(load_rules(os.getenv("MC_ALERT_RULES")))
+            self.alert_sender = AlertSender(self.bot, alert_channel_id)
+
+        # /mc graph: рисуем в отдельном процессе, готовые PNG кэшируем по минутам
+        self.graph_cache = GraphCache()
+        self._render_pool: Optional[ProcessPoolExecutor] = None
 
-        # Каналы/категория
+        # Переименования каналов в пределах лимита Discord
+        self.renamer = RenameCoalescer(self._edit_channel, current_name=self._live_channel_name)
+
+        # Категория для автосоздания каналов
         self.category_id: Optional[int] = _to_id(os.getenv("MC_CATEGORY_ID"))
         self.category_name: Optional[str] = (os.getenv("MC_CATEGORY_NAME") or "").strip() or None
-        self.voice_channel_id_online: Optional[int] = _to_id(os.getenv("MC_ONLINE_CHANNEL_ID"))
-        self.voice_channel_id_tps: Optional[int] = _to_id(os.getenv("MC_TPS_CHANNEL_ID"))
 
         # Состояние WS
         self._session: Optional[aiohttp.ClientSession] = None
         self._ws: Optional[ClientWebSocketResponse] = None
         self._conn_id: int = 0  # поколение соединения
+        self._unloading = False
+        self._good_url: Optional[str] = None  # последний URL, к которому удалось подключиться
+        self._connected_at: Optional[float] = None
+
+        # Переподключение и здоровье соединения
+        self.CONNECT_TIMEOUT: float = _env_float("MC_WS_CONNECT_TIMEOUT", 10.0)
+        self.STALE_AFTER_SEC: float = _env_float("MC_STALE_AFTER_SEC", 90.0)
+        self.backoff = ReconnectBackoff(
+            cap=_env_float("MC_WS_BACKOFF_MAX", 60.0),
+            cooldown=_env_float("MC_WS_BREAKER_COOLDOWN", 300.0),
+        )
+        self.conn_counters = {"attempts": 0, "failures": 0, "sessions": 0}
+        self._last_connect_latency: Optional[float] = None
+        self._last_session_uptime: Optional[float] = None
 
-        # Активность / значения
-        self._last_stats_ts: float = 0.0
-        self.server_status: Dict[str, object] = {
-            "realm": self.REALM,
-            "online": False,
-            "players": 0,
-            "max_players": 0,
-            "tps_1m": None,
-            "mspt": None,
-        }
-        self._prev_players: Optional[int] = None
-        self._prev_tps: Optional[float] = None
-        self._prev_mspt: Optional[float] = None
-
-        # Дебаунс имён
-        self._last_online_name: Optional[str] = None
-        self._last_tps_name: Optional[str] = None
-        self._last_online_rename_ts: float = 0.0
-        self._last_tps_rename_ts: float = 0.0
+        # Снимок состояния: переживает редеплой без лишних переименований
+        self.RESTORE_MAX_GAP_SEC: float = _env_float("MC_RESTORE_MAX_GAP_SEC", 300.0)
+        self._restore_snapshot()
 
         # Запускаем фоновые циклы
         self.ensure_channels_once.start()
         self.connect_loop.start()
         self.periodic_update.start()
+        self.renamer.start(self.bot.loop)
 
     # ---------------- lifecycle ----------------
 
     def cog_unload(self):
+        self._unloading = True
         for loop in (self.ensure_channels_once, self.connect_loop, self.periodic_update):
             with contextlib.suppress(Exception):
                 loop.cancel()
+        self.renamer.stop()
+        if self.alert_sender is not None:
+            self.alert_sender.stop()
         if self._ws is not None and not self._ws.closed:
             asyncio.create_task(self._ws.close())
         if self._session and not self._session.closed:
             asyncio.create_task(self._session.close())
+        # Открытые сессии уходят в снимок, а не закрываются: после короткого
+        # рестарта они продолжатся, после долгого - закроются моментом снимка
+        self._save_snapshot()
+        for rs in self.realms.values():
+            with contextlib.suppress(Exception):
+                rs.history.close()
+        if self._render_pool is not None:
+            self._render_pool.shutdown(wait=False, cancel_futures=True)
 
     async def _ensure_session(self):
         if self._session is None or self._session.closed:
@@ -147,17 +941,18 @@ class MinecraftCog(commands.Cog):
 
     @tasks.loop(count=1)
     async def ensure_channels_once(self):
-        await self._ensure_channels_ready("online", create=True)
-        await self._ensure_channels_ready("tps", create=True)
-        await self._update_channel_name_now("online", force=True)
-        await self._update_channel_name_now("tps", force=True)
+        for rs in self.realms.values():
+            await self._ensure_channels_ready(rs, "online", create=True)
+            await self._ensure_channels_ready(rs, "tps", create=True)
+            self._request_rename(rs, "online")
+            self._request_rename(rs, "tps")
 
     @ensure_channels_once.before_loop
     async def _before_ensure(self):
         await self.bot.wait_until_ready()
 
-    async def _ensure_channels_ready(self, kind: str, create: bool = False) -> bool:
-        ch_id = self.voice_channel_id_online if kind == "online" else self.voice_channel_id_tps
+    async def _ensure_channels_ready(self, rs: RealmState, kind: str, create: bool = False) -> bool:
+        ch_id = rs.channel_id(kind)
         if ch_id:
             ch = self.bot.get_channel(ch_id)
             if isinstance(ch, disnake.VoiceChannel):
@@ -173,12 +968,9 @@ class MinecraftCog(commands.Cog):
                     break
             if cat:
                 try:
-                    name = self._build_online_name() if kind == "online" else self._build_tps_name()
-                    vc = await cat.create_voice_channel(name=name or "loading...", reason=f"init {kind}")
-                    if kind == "online":
-                        self.voice_channel_id_online = vc.id
-                    else:
-                        self.voice_channel_id_tps = vc.id
+                    name = rs.build_name(kind)
+                    vc = await cat.create_voice_channel(name=name or "loading...", reason=f"init {rs.realm} {kind}")
+                    rs.set_channel_id(kind, vc.id)
                     return True
                 except Exception:
                     pass
@@ -189,7 +981,7 @@ class MinecraftCog(commands.Cog):
                 for c in g.channels:
                     if isinstance(c, disnake.CategoryChannel) and c.name == self.category_name:
                         self.category_id = c.id
-                        return await self._ensure_channels_ready(kind, create=True)
+                        return await self._ensure_channels_ready(rs, kind, create=True)
 
         return False
 
@@ -197,16 +989,26 @@ class MinecraftCog(commands.Cog):
 
     def _url_candidates(self) -> List[str]:
         base = self.WS_URL.rstrip("/")
-        return [base, base[:-3]] if base.endswith("/ws") else [f"{base}/ws", base]
-
-    @tasks.loop(seconds=5)
+        urls = [base, base[:-3]] if base.endswith("/ws") else [f"{base}/ws", base]
+        # Сначала тот, что работал в прошлый раз
+        if self._good_url in urls:
+            urls.remove(self._good_url)
+            urls.insert(0, self._good_url)
+        return urls
+
+    @tasks.loop(seconds=1)
     async def connect_loop(self):
         """
-        Подключаемся, только если сокета нет/он закрыт.
+        Подключаемся, только если сокета нет/он закрыт и ReconnectBackoff
+        разрешает попытку. Заодно проверяем, не устарела ли статистика.
         Без автопингов: autoping=ON — клиент автоматически отвечает PONG на серверные PING.
         """
+        self._check_stale()
+
         if self._ws is not None and not self._ws.closed:
             return
+        if not self.backoff.ready(time.monotonic()):
+            return
 
         await self._ensure_session()
         assert self._session is not None
@@ -214,45 +1016,93 @@ class MinecraftCog(commands.Cog):
         headers = {"Authorization": f"Bearer {self.WS_TOKEN}"} if self.WS_TOKEN else None
 
         for url in self._url_candidates():
+            self.conn_counters["attempts"] += 1
+            started = time.monotonic()
             try:
                 ws = await self._session.ws_connect(
                     url,
                     headers=headers,
                     autoping=True,      # <-- ВАЖНО: отвечаем на серверные PING
                     heartbeat=None,     # свой ping не шлём; сервер сам пингует
-                    timeout=15.0,
+                    timeout=self.CONNECT_TIMEOUT,
                     receive_timeout=None,
                     max_msg_size=4 * 1024 * 1024,
                 )
-                self._conn_id += 1
-                conn_id = self._conn_id
-                self._ws = ws
-                self._last_stats_ts = 0.0
-
-                if self.DEBUG:
-                    status = getattr(ws, "response", None).status if getattr(ws, "response", None) else "?"
-                    print(f"[MinecraftCog] WS connected #{conn_id}: {url} (autoping=ON, heartbeat=None) status={status}")
-
-                asyncio.create_task(self._listen_loop(ws, conn_id))
-                return
             except Exception as e:
+                self.conn_counters["failures"] += 1
                 if self.DEBUG:
                     print(f"[MinecraftCog] connect fail: {url}: {e!r}")
-                # пробуем следующий вариант URL
+                continue  # пробуем следующий вариант URL
+
+            self._last_connect_latency = time.monotonic() - started
+            self._connected_at = time.monotonic()
+            self._good_url = url
+            self.backoff.on_connected()
+            self.conn_counters["sessions"] += 1
+
+            self._conn_id += 1
+            conn_id = self._conn_id
+            self._ws = ws
+
+            if self.DEBUG:
+                status = getattr(ws, "response", None).status if getattr(ws, "response", None) else "?"
+                print(f"[MinecraftCog] WS connected #{conn_id}: {url} in {self._last_connect_latency * 1000:.0f} ms status={status}")
+
+            asyncio.create_task(self._listen_loop(ws, conn_id))
+            return
+
+        delay = self.backoff.on_failure(time.monotonic())
+        await self._go_offline()
+        print(f"[MinecraftCog] bridge недоступен, следующая попытка через {delay:.1f} с ({self.backoff.state})")
+
+    def _check_stale(self):
+        """Realm без статистики дольше STALE_AFTER_SEC помечаем устаревшим, сокет не рвём"""
+        now = time.time()
+        for rs in self.realms.values():
+            if not rs.server_status.get("online") or rs.server_status.get("stale"):
+                continue
+            age = rs.staleness(now)
+            if age is not None and age > self.STALE_AFTER_SEC:
+                rs.mark_stale()
+                print(f"[MinecraftCog] realm {rs.realm}: нет статистики {age:.0f} с, помечен устаревшим")
+                self._request_rename(rs, "online")
+                self._request_rename(rs, "tps")
+
+    def connection_stats(self) -> dict:
+        """Состояние соединения: breaker, задержка подключения, аптайм, кадры, устаревание realm'ов"""
+        now = time.monotonic()
+        connected = self._ws is not None and not self._ws.closed
+        wall = time.time()
+        return {
+            **self.conn_counters,
+            "state": self.backoff.state,
+            "consecutive_failures": self.backoff.failures,
+            "breaker_opened": self.backoff.opened,
+            "next_attempt_in_sec": round(max(0.0, self.backoff.next_attempt - now), 1),
+            "url": self._good_url,
+            "connected": connected,
+            "uptime_sec": round(now - self._connected_at, 1) if connected and self._connected_at else 0.0,
+            "last_session_uptime_sec": self._last_session_uptime,
+            "last_connect_latency_ms": round(self._last_connect_latency * 1000, 1) if self._last_connect_latency is not None else None,
+            "frames": self.decoder.stats(),
+            "staleness_sec": {
+                name: (round(age, 1) if (age := rs.staleness(wall)) is not None else None)
+                for name, rs in self.realms.items()
+            },
+        }
 
     async def _listen_loop(self, ws: ClientWebSocketResponse, conn_id: int):
         try:
             async for msg in ws:
                 if msg.type == WSMsgType.TEXT:
                     raw = msg.data
+                    frame = self.decoder.decode(raw)
+                    if frame is None:
+                        continue
                     if self.DEBUG:
                         preview = raw if len(raw) <= self.TRUNC else raw[: self.TRUNC] + "…"
                         print(f"[MinecraftCog] WS TEXT#{conn_id} ({len(raw)}b): {preview}")
-                    try:
-                        payload = json.loads(raw)
-                    except Exception:
-                        continue
-                    await self._handle_message(payload)
+                    await self._handle_message(frame)
 
                 elif msg.type in (WSMsgType.CLOSED, WSMsgType.CLOSING, WSMsgType.ERROR):
                     break
@@ -273,156 +1123,259 @@ class MinecraftCog(commands.Cog):
             except Exception:
                 pass
             # Если за это время уже подключились новым conn_id — оффлайн не трогаем
-            if conn_id == self._conn_id:
+            if conn_id == self._conn_id and not self._unloading:
+                now = time.monotonic()
+                self._last_session_uptime = round(now - (self._connected_at or now), 1)
+                self._connected_at = None
+                self.backoff.on_disconnected(now, self._last_session_uptime)
                 await self._go_offline()
 
-    # ---------------- имена каналов ----------------
-
-    def _build_online_name(self) -> str:
-        s = self.server_status
-        realm = s.get("realm", self.REALM)
-        if s.get("online"):
-            p = _to_int(s.get("players", 0))
-            m = _to_int(s.get("max_players", 0))
-            base = f"🟢 MC {realm}: {p}/{m}" if m else f"🟢 MC {realm}: {p}"
-        else:
-            base = f"🔴 MC {realm}: оффлайн"
-        return base[:95]
+    # ---------------- снимок ----------------
 
-    def _build_tps_name(self) -> str:
-        s = self.server_status
-        realm = s.get("realm", self.REALM)
-        tps_1m = _to_float(s.get("tps_1m"))
-        mspt = _to_float(s.get("mspt"))
-        if not s.get("online"):
-            name = f"⚙️ TPS {realm}: отсутствует"
-        else:
-            tps_part = f"{tps_1m:.1f}" if tps_1m is not None else "—"
-            mspt_part = f" | {mspt:.2f} mspt" if mspt is not None else ""
-            name = f"⚙️ TPS {realm}: {tps_part}{mspt_part}"
-        return name[:95]
-
-    async def _update_channel_name_now(self, kind: str, force: bool = False):
-        ch_id = self.voice_channel_id_online if kind == "online" else self.voice_channel_id_tps
-        if not ch_id:
-            return
-        ch = self.bot.get_channel(ch_id)
-        if ch is None:
-            return
-
-        new_name = self._build_online_name() if kind == "online" else self._build_tps_name()
-        now = time.time()
-
-        if not force:
-            last_name = self._last_online_name if kind == "online" else self._last_tps_name
-            last_ts = self._last_online_rename_ts if kind == "online" else self._last_tps_rename_ts
-            if last_name == new_name:
-                if self.DEBUG: print(f"[MinecraftCog] rename[{kind}] skip: same name")
-                return
-            if now - last_ts < self.CHANNEL_UPDATE_MIN_SEC:
-                if self.DEBUG: print(f"[MinecraftCog] rename[{kind}] skip: debounced ({now - last_ts:.1f}s < {self.CHANNEL_UPDATE_MIN_SEC}s)")
-                return
+    def _save_snapshot(self):
+        """Состояние realm'ов, каналов и открытых сессий в mc_snapshot (JSON, не pickle)"""
+        snapshot = {
+            "realms": {name: rs.export() for name, rs in self.realms.items()},
+            "renames": self.renamer.export(),
+            "presence": self.presence.export(),
+        }
+        self.db.submit(
+            "INSERT OR REPLACE INTO mc_snapshot (id, version, saved_at, data) VALUES (1, ?, ?, ?)",
+            (SNAPSHOT_VERSION, time.time(), json.dumps(snapshot, ensure_ascii=False))
+        )
+        # Заодно сбрасываем на диск кольца истории и их незакрытые корзины
+        for rs in self.realms.values():
+            try:
+                rs.history.flush()
+            except Exception as e:
+                print(f"[MinecraftCog] history flush {rs.realm}: {e!r}")
 
+    def _restore_snapshot(self):
         try:
-            await ch.edit(name=new_name, reason=f"MC status ({kind})")
-            if kind == "online":
-                self._last_online_name = new_name
-                self._last_online_rename_ts = now
-            else:
-                self._last_tps_name = new_name
-                self._last_tps_rename_ts = now
-            if self.DEBUG: print(f"[MinecraftCog] channel rename [{kind}] -> {new_name}")
+            snapshot = _load_snapshot(self.db)
         except Exception as e:
-            print(f"[MinecraftCog] rename[{kind}] error: {e!r}")
-
-    # ---------------- оффлайн/онлайн ----------------
+            print(f"[MinecraftCog] снимок не прочитан: {e!r}")
+            return
+        if snapshot is None:
+            return
 
-    async def _go_offline(self):
-        # помечаем оффлайн минимально
-        self.server_status.update({
-            "online": False,
-            "players": 0,
-            "tps_1m": None,
-            "mspt": None,
-        })
-        self._prev_players = None
-        self._prev_tps = None
-        self._prev_mspt = None
-        await self._update_channel_name_now("online", force=True)
-        await self._update_channel_name_now("tps", force=True)
+        saved_at = snapshot["saved_at"]
+        gap = time.time() - saved_at
+        # Имена каналов и квоту переименований восстанавливаем всегда
+        self.renamer.restore(snapshot.get("renames") or {}, saved_at)
+
+        if gap <= self.RESTORE_MAX_GAP_SEC:
+            # Короткий перерыв (редеплой): считаем, что сервер жил дальше,
+            # и даём bridge свежее окно устаревания, чтобы прислать кадр
+            for name, data in (snapshot.get("realms") or {}).items():
+                rs = self.realms.get(name)
+                if rs is not None:
+                    rs.restore(data)
+                    if rs.server_status.get("online"):
+                        rs._last_stats_ts = time.time()
+            self.presence.restore(snapshot.get("presence") or {}, self.realms)
+        else:
+            # Долгий перерыв: что было с сервером - неизвестно; сессии
+            # закрываем моментом снимка, realm'ы стартуют оффлайн
+            self.presence.restore(snapshot.get("presence") or {}, self.realms, closed_at=saved_at)
+        print(f"[MinecraftCog] снимок восстановлен (перерыв {gap:.0f} с)")
 
-    # ---------------- обработка кадров ----------------
+    # ---------------- имена каналов ----------------
 
-    async def _handle_message(self, payload: Dict[str, object]):
-        t = payload.get("type")
-        if t not in ("server.stats", "stats.report"):
-            return
+    def _live_channel_name(self, channel_id: int) -> Optional[str]:
+        ch = self.bot.get_channel(channel_id)
+        return getattr(ch, "name", None)
 
-        # realm
-        data = payload.get("data") or payload.get("payload") or {}
-        realm = (payload.get("realm") or data.get("realm") or "").strip()
-        if realm and realm != self.REALM:
+    def _request_rename(self, rs: RealmState, kind: str):
+        """Передаёт актуальное имя канала в RenameCoalescer; он сам решит, когда менять"""
+        ch_id = rs.channel_id(kind)
+        if not ch_id or not rs.known:
             return
+        self.renamer.want(ch_id, kind, rs.build_name(kind), rs.rename_values(kind), rs.CHANNEL_UPDATE_MIN_SEC)
 
-        # players
-        players_section = data.get("players") or {}
-        players = _to_int(
-            data.get("players_online"),
-            data.get("players_count"),
-            players_section.get("online"),
-            len(data.get("players_list") or []),
-        )
-        max_players = _to_int(
-            data.get("players_max"),
-            players_section.get("max"),
-        )
+    async def _edit_channel(self, channel_id: int, name: str) -> bool:
+        ch = self.bot.get_channel(channel_id)
+        if ch is None:
+            return False
+        await ch.edit(name=name, reason="MC status")
+        if self.DEBUG: print(f"[MinecraftCog] channel rename {channel_id} -> {name}")
+        return True
 
-        # tps/mspt
-        tps_section = data.get("tps") or {}
-        tps_1m = _to_float(tps_section.get("1m"), data.get("tps_1m"))
-        mspt = _to_float(tps_section.get("mspt"), data.get("mspt"))
+    def rename_stats(self) -> dict:
+        """Счётчики переименований: запрошено, отправлено, затёрто, 429"""
+        return self.renamer.stats()
 
-        # обновление статуса
-        self.server_status.update({
-            "realm": self.REALM,
-            "online": True,
-            "players": players,
-            "max_players": max_players,
-            "tps_1m": tps_1m,
-            "mspt": mspt,
-        })
-        self._last_stats_ts = time.time()
+    # ---------------- оффлайн/онлайн ----------------
 
-        # триггеры обновления имён
-        players_changed = (self._prev_players is None) or (players != self._prev_players)
-        self._prev_players = players
+    async def _go_offline(self):
+        # соединение общее, поэтому оффлайн - все realm'ы
+        now = time.time()
+        for rs in self.realms.values():
+            self.presence.close_realm(rs.realm, now)
+            if self.alerts is not None:
+                self.alerts.reset(rs.realm)
+            rs.go_offline()
+            self._request_rename(rs, "online")
+            self._request_rename(rs, "tps")
 
-        def _changed(prev: Optional[float], cur: Optional[float], eps: float) -> bool:
-            if prev is None and cur is None:
-                return False
-            if prev is None or cur is None:
-                return True
-            return abs(prev - cur) >= eps
+    # ---------------- обработка кадров ----------------
 
-        tps_changed = _changed(self._prev_tps, tps_1m, self.TPS_CHANGE_EPS)
-        mspt_changed = _changed(self._prev_mspt, mspt, self.MSPT_CHANGE_EPS)
-        self._prev_tps = tps_1m
-        self._prev_mspt = mspt
+    async def _handle_message(self, frame: StatsFrame):
+        # realm -> состояние за O(1); чужие realm'ы пропускаем
+        rs = self.realms.get(frame.realm) if frame.realm else self.default_realm
+        if rs is None:
+            return
 
-        await self._update_channel_name_now("online", force=players_changed)
-        await self._update_channel_name_now("tps", force=(tps_changed or mspt_changed))
+        # обновление статуса и триггеры обновления имён
+        players_changed, tps_changed = rs.apply_stats(frame.players, frame.max_players, frame.tps_1m, frame.mspt)
+        rs.history.record(rs._last_stats_ts, frame.tps_1m, frame.mspt, frame.players)
+        if frame.players_list is not None:
+            self.presence.update(rs.realm, frame.players_list, rs._last_stats_ts)
+        if self.alerts is not None:
+            values = {"tps": frame.tps_1m, "mspt": frame.mspt, "players": float(frame.players)}
+            for alert in self.alerts.observe(rs.realm, rs._last_stats_ts, values):
+                self.alert_sender.push(_alert_embed(alert))
+
+        if players_changed:
+            self._request_rename(rs, "online")
+        if tps_changed:
+            self._request_rename(rs, "tps")
 
     # ---------------- периодический страховочный апдейт ----------------
 
     @tasks.loop(seconds=60)
     async def periodic_update(self):
         try:
-            await self._update_channel_name_now("online", force=False)
-            await self._update_channel_name_now("tps", force=False)
+            for rs in self.realms.values():
+                self._request_rename(rs, "online")
+                self._request_rename(rs, "tps")
+            self.presence.maybe_compact(self.realms, time.time())
+            self._save_snapshot()
         except Exception as e:
             if self.DEBUG:
                 print(f"[MinecraftCog] periodic_update error: {e!r}")
 
+    # ---------------- /mc graph ----------------
+
+    def _get_render_pool(self) -> ProcessPoolExecutor:
+        if self._render_pool is None:
+            # spawn, а не fork: в процессе уже крутятся потоки (база, aiohttp)
+            self._render_pool = ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context("spawn"))
+        return self._render_pool
+
+    def _realm_or_none(self, realm: str) -> Optional[RealmState]:
+        return self.realms.get(realm) if realm else self.default_realm
+
+    @commands.slash_command(name="mc")
+    async def mc(self, inter: disnake.ApplicationCommandInteraction):
+        """Статистика Minecraft-сервера"""
+
+    @mc.sub_command(name="graph")
+    async def mc_graph(
+            self,
+            inter: disnake.ApplicationCommandInteraction,
+            metric: str = commands.Param(description="Что рисовать", choices=list(METRICS)),
+            window: str = commands.Param(default="1h", description="За какой период", choices=list(WINDOWS)),
+            realm: str = commands.Param(default="", description="Realm (по умолчанию основной)")
+    ):
+        """График TPS, MSPT или онлайна за выбранный период"""
+        rs = self._realm_or_none(realm)
+        if rs is None:
+            await inter.response.send_message(f"Неизвестный realm. Доступны: {', '.join(self.realms)}", ephemeral=True)
+            return
+
+        until = bucket_end(time.time())
+        since = until - WINDOWS[window]
+        key = (rs.realm, metric, window, until)
+
+        cached = self.graph_cache.get(key)
+        if cached is None:
+            await inter.response.defer()
+            loop = asyncio.get_running_loop()
+            # Выборка из колец и сводка - в потоке, отрисовка - в процессе:
+            # на длинных окнах и то и другое заметно держало бы event loop.
+            # Поток читает снимок: живую историю пишет _handle_message
+            history = rs.history.snapshot()
+            try:
+                tier, series, summary = await loop.run_in_executor(
+                    None, _graph_data, history, metric, since, until
+                )
+                png, top = await loop.run_in_executor(
+                    self._get_render_pool(), render_chart, metric, series, since, until,
+                    20.0 if metric == "tps" else None
+                )
+            except Exception as e:
+                print(f"[MinecraftCog] /mc graph {rs.realm} {metric} {window}: {e!r}")
+                await inter.edit_original_response(content="❌ Не удалось построить график, попробуйте позже")
+                return
+            cached = (png, top, tier, summary)
+            self.graph_cache.put(key, cached)
+        png, top, tier, summary = cached
+
+        embed = disnake.Embed(
+            title=f"📈 {metric.upper()} {rs.realm} за {window}",
+            color=disnake.Color.green(),
+        )
+        if summary:
+            embed.add_field(name="Мин", value=f"{summary[0]:.2f}", inline=True)
+            embed.add_field(name="Сред", value=f"{summary[1]:.2f}", inline=True)
+            embed.add_field(name="Макс", value=f"{summary[2]:.2f}", inline=True)
+        else:
+            embed.description = "Нет данных за этот период"
+        embed.set_image(url="attachment://graph.png")
+        embed.set_footer(text=f"шкала 0–{top:g} · точность: {tier}")
+
+        file = disnake.File(io.BytesIO(png), filename="graph.png")
+        if inter.response.is_done():
+            await inter.edit_original_response(embed=embed, file=file)
+        else:
+            await inter.response.send_message(embed=embed, file=file)
+
+    @mc.sub_command(name="top")
+    async def mc_top(
+            self,
+            inter: disnake.ApplicationCommandInteraction,
+            limit: int = commands.Param(default=10, ge=1, le=25, description="Сколько игроков показать"),
+            realm: str = commands.Param(default="", description="Realm (по умолчанию основной)")
+    ):
+        """Топ игроков по времени игры"""
+        rs = self._realm_or_none(realm)
+        if rs is None:
+            await inter.response.send_message(f"Неизвестный realm. Доступны: {', '.join(self.realms)}", ephemeral=True)
+            return
+
+        top = await self.presence.top_playtime(rs.realm, limit)
+        lines = [f"**{i}.** {name} — {seconds / 3600:.1f} ч" for i, (name, seconds) in enumerate(top, 1)]
+        embed = disnake.Embed(
+            title=f"🏆 Время игры на {rs.realm}",
+            description="\n".join(lines) or "Пока нет данных",
+            color=disnake.Color.gold(),
+        )
+        await inter.response.send_message(embed=embed)
+
+    @mc.sub_command(name="who")
+    async def mc_who(
+            self,
+            inter: disnake.ApplicationCommandInteraction,
+            minutes_ago: int = commands.Param(default=0, ge=0, le=60 * 24 * 90, description="Сколько минут назад (0 - сейчас)"),
+            realm: str = commands.Param(default="", description="Realm (по умолчанию основной)")
+    ):
+        """Кто был онлайн в указанный момент"""
+        rs = self._realm_or_none(realm)
+        if rs is None:
+            await inter.response.send_message(f"Неизвестный realm. Доступны: {', '.join(self.realms)}", ephemeral=True)
+            return
+
+        ts = time.time() - minutes_ago * 60
+        players = self.presence.online(rs.realm) if minutes_ago == 0 else await self.presence.online_at(rs.realm, ts)
+        embed = disnake.Embed(
+            title=f"👥 Онлайн на {rs.realm}",
+            description=f"<t:{int(ts)}:f>\n" + (", ".join(players)[:4000] if players else "Никого"),
+            color=disnake.Color.green(),
+        )
+        embed.set_footer(text=f"Игроков: {len(players)}")
+        await inter.response.send_message(embed=embed)
+
     @connect_loop.before_loop
     @periodic_update.before_loop
     async def _before_tasks(self):
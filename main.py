@@ -5,6 +5,8 @@ import disnake
 from disnake.ext import commands
 from dotenv import load_dotenv
 
+from storage import loop_lag_monitor
+
 # Загружаем переменные окружения из локального файла внутри контейнера
 # (файл проброшен docker compose'ом)
 load_dotenv("token.env")
@@ -27,6 +29,9 @@ def main():
     # Загружаем коги при запуске
     @bot.event
     async def on_ready():
+        # Считаем, сколько времени event loop простаивает заблокированным
+        loop_lag_monitor.start()
+
         for ext in ("cogs.stats", "cogs.audit", "cogs.mod", "cogs.autorole", "cogs.websocket"):
             try:
                 bot.load_extension(ext)
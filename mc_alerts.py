@@ -0,0 +1,235 @@
+# mc_alerts.py
+import bisect
+import collections
+import json
+import math
+from typing import Dict, List, NamedTuple, Optional
+
+
+# Правила по умолчанию (MC_ALERT_RULES перекрывает целиком)
+DEFAULT_RULES = [
+    # TPS ниже 15 всю последнюю минуту
+    {"name": "tps_low", "metric": "tps", "agg": "max", "window": 60, "op": "<", "threshold": 15, "clear": 17},
+    # 95-й перцентиль MSPT за 5 минут выше 50
+    {"name": "mspt_p95_high", "metric": "mspt", "agg": "p95", "window": 300, "op": ">", "threshold": 50, "clear": 45},
+]
+
+
+class RollingWindow:
+    """
+    Значения метрики за последние window секунд. Каждое значение входит
+    и выходит из окна один раз: сумма - счётчиком, min/max - монотонными
+    очередями, перцентили - по отсортированному списку (bisect).
+    """
+
+    def __init__(self, window: float, keep_sorted: bool = False):
+        self.window = window
+        self.keep_sorted = keep_sorted
+        self.reset()
+
+    def reset(self):
+        self.items = collections.deque()  # (ts, value)
+        self.total = 0.0
+        self.mins = collections.deque()   # возрастающие значения
+        self.maxs = collections.deque()   # убывающие значения
+        self.sorted: List[float] = []
+        self.started: Optional[float] = None  # первое значение после reset
+
+    def add(self, ts: float, value: float):
+        if self.started is None:
+            self.started = ts
+        self.items.append((ts, value))
+        self.total += value
+        while self.mins and self.mins[-1][1] > value:
+            self.mins.pop()
+        self.mins.append((ts, value))
+        while self.maxs and self.maxs[-1][1] < value:
+            self.maxs.pop()
+        self.maxs.append((ts, value))
+        if self.keep_sorted:
+            bisect.insort(self.sorted, value)
+        self._evict(ts)
+
+    def _evict(self, now: float):
+        cutoff = now - self.window
+        while self.items and self.items[0][0] < cutoff:
+            ts, value = self.items.popleft()
+            self.total -= value
+            if self.mins[0][0] <= ts:
+                self.mins.popleft()
+            if self.maxs[0][0] <= ts:
+                self.maxs.popleft()
+            if self.keep_sorted:
+                del self.sorted[bisect.bisect_left(self.sorted, value)]
+
+    def covered(self, now: float) -> bool:
+        """Окно заполнено данными целиком (после старта/разрыва - не сразу)"""
+        return self.started is not None and now - self.started >= self.window and bool(self.items)
+
+    def value(self, agg: str) -> Optional[float]:
+        if not self.items:
+            return None
+        if agg == "last":
+            return self.items[-1][1]
+        if agg == "avg":
+            return self.total / len(self.items)
+        if agg == "min":
+            return self.mins[0][1]
+        if agg == "max":
+            return self.maxs[0][1]
+        q = float(agg[1:]) / 100  # "p95"
+        return self.sorted[max(0, math.ceil(q * len(self.sorted)) - 1)]
+
+
+class AlertRule(NamedTuple):
+    name: str
+    metric: str          # tps | mspt | players
+    agg: str             # last | avg | min | max | pNN
+    window: float        # секунд
+    op: str              # "<" или ">"
+    threshold: float     # срабатывание
+    clear: float         # снятие (гистерезис): для "<" выше threshold, для ">" ниже
+    cooldown: float      # не чаще одного оповещения за столько секунд
+    realms: Optional[frozenset]
+
+    @classmethod
+    def from_dict(cls, d: dict) -> "AlertRule":
+        op = d.get("op", "<")
+        if op not in ("<", ">"):
+            raise ValueError(f"{d.get('name')}: op должен быть '<' или '>'")
+        agg = str(d.get("agg", "avg"))
+        if agg not in ("last", "avg", "min", "max") and not (agg.startswith("p") and 0 < float(agg[1:]) <= 100):
+            raise ValueError(f"{d.get('name')}: неизвестная агрегация {agg}")
+        threshold = float(d["threshold"])
+        clear = float(d.get("clear", threshold))
+        if (op == "<" and clear < threshold) or (op == ">" and clear > threshold):
+            raise ValueError(f"{d.get('name')}: clear должен быть по другую сторону от threshold")
+        realms = d.get("realms")
+        return cls(
+            name=str(d["name"]),
+            metric=str(d["metric"]),
+            agg=agg,
+            window=float(d.get("window", 60)),
+            op=op,
+            threshold=threshold,
+            clear=clear,
+            cooldown=float(d.get("cooldown", 600)),
+            realms=frozenset(realms) if realms else None,
+        )
+
+    def breached(self, value: float) -> bool:
+        return value < self.threshold if self.op == "<" else value > self.threshold
+
+    def recovered(self, value: float) -> bool:
+        return value >= self.clear if self.op == "<" else value <= self.clear
+
+
+class Alert(NamedTuple):
+    kind: str            # "firing" | "resolved"
+    rule: AlertRule
+    realm: str
+    value: float
+    ts: float
+
+
+class _RuleState:
+    __slots__ = ("firing", "announced", "last_fired")
+
+    def __init__(self):
+        self.firing = False
+        self.announced = False   # оповестили ли о текущем срабатывании
+        self.last_fired = -math.inf
+
+
+class AlertEngine:
+    """
+    Проверяет правила на каждом кадре статистики. Окна общие для правил
+    с одинаковой метрикой и длиной, так что на кадр - одно добавление в
+    окно и O(правил) сравнений, без пересчёта истории.
+
+    Гистерезис: сработавшее правило снимается, только когда значение
+    пересечёт clear. Cooldown: повторное срабатывание раньше cooldown
+    не оповещает (и его снятие тоже).
+    """
+
+    def __init__(self, rules: List[AlertRule]):
+        self.rules = rules
+        self.windows: Dict[tuple, RollingWindow] = {}
+        self.states: Dict[tuple, _RuleState] = {}
+        self.counters = {"evaluations": 0, "fired": 0, "resolved": 0, "suppressed": 0}
+
+    def _window(self, realm: str, rule: AlertRule) -> RollingWindow:
+        key = (realm, rule.metric, rule.window)
+        w = self.windows.get(key)
+        if w is None:
+            w = self.windows[key] = RollingWindow(rule.window)
+        if rule.agg.startswith("p") and not w.keep_sorted:
+            w.keep_sorted = True
+            w.sorted = sorted(v for _, v in w.items)
+        return w
+
+    def observe(self, realm: str, ts: float, values: Dict[str, Optional[float]]) -> List[Alert]:
+        rules = [r for r in self.rules if r.realms is None or realm in r.realms]
+        windows = {}
+        for rule in rules:
+            windows[rule] = self._window(realm, rule)
+
+        for (w_realm, metric, _), w in self.windows.items():
+            if w_realm == realm:
+                value = values.get(metric)
+                if value is not None:
+                    w.add(ts, value)
+
+        alerts = []
+        for rule in rules:
+            w = windows[rule]
+            if not w.covered(ts):
+                continue
+            value = w.value(rule.agg)
+            if value is None:
+                continue
+            self.counters["evaluations"] += 1
+            state = self.states.setdefault((realm, rule.name), _RuleState())
+
+            if not state.firing and rule.breached(value):
+                state.firing = True
+                if ts - state.last_fired >= rule.cooldown:
+                    state.announced = True
+                    state.last_fired = ts
+                    self.counters["fired"] += 1
+                    alerts.append(Alert("firing", rule, realm, value, ts))
+                else:
+                    state.announced = False
+                    self.counters["suppressed"] += 1
+            elif state.firing and rule.recovered(value):
+                state.firing = False
+                if state.announced:
+                    self.counters["resolved"] += 1
+                    alerts.append(Alert("resolved", rule, realm, value, ts))
+        return alerts
+
+    def reset(self, realm: str):
+        """Realm пропал: окна копим заново, чтобы не сравнивать с данными до разрыва"""
+        for (w_realm, _, _), w in self.windows.items():
+            if w_realm == realm:
+                w.reset()
+
+    def stats(self) -> dict:
+        return {**self.counters, "firing": sum(1 for s in self.states.values() if s.firing)}
+
+
+def load_rules(raw: Optional[str]) -> List[AlertRule]:
+    """Правила из JSON-списка (MC_ALERT_RULES) или DEFAULT_RULES"""
+    data = DEFAULT_RULES
+    if raw and raw.strip():
+        try:
+            data = json.loads(raw)
+        except Exception as e:
+            print(f"[MinecraftCog] MC_ALERT_RULES parse error: {e!r}")
+    rules = []
+    for d in data:
+        try:
+            rules.append(AlertRule.from_dict(d))
+        except Exception as e:
+            print(f"[MinecraftCog] правило алерта пропущено: {e!r}")
+    return rules
@@ -0,0 +1,195 @@
+# mc_graph.py
+import math
+import struct
+import zlib
+from collections import OrderedDict
+from typing import Optional, Sequence, Tuple
+
+try:  # NumPy есть в requirements.txt и ускоряет разбивку длинных рядов; без него - чистый Python
+    import numpy as np
+except ImportError:
+    np = None
+
+
+# Окна графика: имя -> длина в секундах
+WINDOWS = {
+    "15m": 15 * 60,
+    "1h": 3600,
+    "6h": 6 * 3600,
+    "24h": 24 * 3600,
+    "7d": 7 * 86400,
+    "30d": 30 * 86400,
+}
+
+WIDTH, HEIGHT = 600, 200
+NUMPY_MIN_POINTS = 2000  # на коротких рядах чистый Python быстрее импорта/копирования
+
+BACKGROUND = (43, 45, 49)
+GRID = (63, 65, 71)
+LINE_COLORS = {
+    "tps": (87, 242, 135),
+    "mspt": (254, 163, 64),
+    "players": (88, 101, 242),
+}
+
+
+# -------------------- ряд -> столбцы --------------------
+
+def bin_series(series: Sequence[tuple], since: float, until: float, width: int):
+    """
+    Раскладывает ряд (ts, min, avg, max) по width столбцам.
+    Возвращает три списка (min, avg, max); пустые столбцы - NaN.
+    """
+    if np is not None and len(series) >= NUMPY_MIN_POINTS:
+        return _bin_numpy(series, since, until, width)
+
+    nan = math.nan
+    lo = [math.inf] * width
+    hi = [-math.inf] * width
+    total = [0.0] * width
+    count = [0] * width
+    scale = width / max(until - since, 1e-9)
+    for ts, mn, avg, mx in series:
+        if avg != avg:
+            continue
+        col = min(width - 1, max(0, int((ts - since) * scale)))
+        if mn < lo[col]:
+            lo[col] = mn
+        if mx > hi[col]:
+            hi[col] = mx
+        total[col] += avg
+        count[col] += 1
+    return (
+        [lo[i] if count[i] else nan for i in range(width)],
+        [total[i] / count[i] if count[i] else nan for i in range(width)],
+        [hi[i] if count[i] else nan for i in range(width)],
+    )
+
+
+def _bin_numpy(series, since, until, width):
+    data = np.asarray(series, dtype=np.float64)
+    data = data[~np.isnan(data[:, 2])]
+    cols = ((data[:, 0] - since) * (width / max(until - since, 1e-9))).astype(np.int64)
+    np.clip(cols, 0, width - 1, out=cols)
+
+    count = np.bincount(cols, minlength=width)
+    total = np.bincount(cols, weights=data[:, 2], minlength=width)
+    lo = np.full(width, np.inf)
+    hi = np.full(width, -np.inf)
+    np.minimum.at(lo, cols, data[:, 1])
+    np.maximum.at(hi, cols, data[:, 3])
+
+    empty = count == 0
+    with np.errstate(invalid="ignore", divide="ignore"):
+        avg = total / count
+    for arr in (lo, avg, hi):
+        arr[empty] = np.nan
+    return lo.tolist(), avg.tolist(), hi.tolist()
+
+
+# -------------------- растеризация и PNG --------------------
+
+def _blend(a, b, alpha):
+    return tuple(int(x * (1 - alpha) + y * alpha) for x, y in zip(a, b))
+
+
+def encode_png(width: int, height: int, rows: Sequence[bytes]) -> bytes:
+    """Минимальный PNG (RGB, 8 бит) без сторонних библиотек"""
+    def chunk(tag, data):
+        return struct.pack(">I", len(data)) + tag + data + struct.pack(">I", zlib.crc32(tag + data) & 0xFFFFFFFF)
+
+    raw = b"".join(b"\x00" + row for row in rows)
+    return (
+        b"\x89PNG\r\n\x1a\n"
+        + chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0))
+        + chunk(b"IDAT", zlib.compress(raw, 6))
+        + chunk(b"IEND", b"")
+    )
+
+
+def render_chart(
+    metric: str,
+    series: Sequence[tuple],
+    since: float,
+    until: float,
+    y_max: Optional[float] = None,
+    width: int = WIDTH,
+    height: int = HEIGHT,
+) -> Tuple[bytes, float]:
+    """
+    Рисует линию avg и полосу min..max по ряду (ts, min, avg, max).
+    Возвращает (PNG, верх шкалы). Функция чистая и модульного уровня -
+    её можно отдавать в пул процессов.
+    """
+    lo, avg, hi = bin_series(series, since, until, width)
+    seen = [v for v in hi if v == v]
+    top = y_max if y_max is not None else ((max(seen) * 1.1) if seen else 1.0)
+    top = max(top, 1e-9)
+
+    line = LINE_COLORS.get(metric, (255, 255, 255))
+    band = _blend(BACKGROUND, line, 0.35)
+    pixels = [bytearray(bytes(BACKGROUND) * width) for _ in range(height)]
+
+    def put(x, y, color):
+        if 0 <= y < height:
+            pixels[y][x * 3:x * 3 + 3] = bytes(color)
+
+    def to_y(v):
+        return int(round((height - 1) * (1 - min(max(v / top, 0.0), 1.0))))
+
+    for k in range(1, 4):
+        y = height * k // 4
+        pixels[y][:] = bytes(GRID) * width
+
+    prev_y = None
+    for x in range(width):
+        if avg[x] != avg[x]:
+            prev_y = None
+            continue
+        for y in range(to_y(hi[x]), to_y(lo[x]) + 1):
+            put(x, y, band)
+        y = to_y(avg[x])
+        # вертикальный отрезок от прошлого столбца, чтобы линия не рвалась
+        y0, y1 = (y, y) if prev_y is None else (min(prev_y, y), max(prev_y, y))
+        for yy in range(y0, y1 + 1):
+            put(x, yy, line)
+            put(x, yy + 1, line)
+        prev_y = y
+
+    return encode_png(width, height, [bytes(r) for r in pixels]), top
+
+
+# -------------------- кэш --------------------
+
+def bucket_end(now: float, step: int = 60) -> int:
+    """Конец текущей корзины: все вызовы в пределах одной минуты дают один ключ"""
+    return int(math.ceil(now / step) * step)
+
+
+class GraphCache:
+    """LRU готовых картинок по ключу (realm, metric, window, bucket_end)"""
+
+    def __init__(self, max_entries: int = 64):
+        self.max_entries = max_entries
+        self._items: "OrderedDict[tuple, tuple]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        item = self._items.get(key)
+        if item is None:
+            self.misses += 1
+            return None
+        self._items.move_to_end(key)
+        self.hits += 1
+        return item
+
+    def put(self, key, value):
+        self._items[key] = value
+        self._items.move_to_end(key)
+        while len(self._items) > self.max_entries:
+            self._items.popitem(last=False)
+
+    def stats(self) -> dict:
+        return {"entries": len(self._items), "hits": self.hits, "misses": self.misses}
+
@@ -0,0 +1,322 @@
+# mc_history.py
+import json
+import math
+import mmap
+import os
+import re
+import struct
+from array import array
+from typing import Dict, List, Optional, Tuple
+
+
+METRICS = ("tps", "mspt", "players")
+
+# Уровни свёртки: имя, шаг (сек), сколько корзин хранить
+TIERS = (
+    ("1m", 60, 7 * 24 * 60),      # неделя поминутно
+    ("1h", 3600, 90 * 24),        # 90 дней почасово
+    ("1d", 86400, 2 * 365),       # два года посуточно
+)
+
+NAN = float("nan")
+
+
+class Ring:
+    """
+    Кольцевой буфер фиксированного размера: время (float64) + stride чисел
+    float32 на запись. Память выделяется один раз; старые записи
+    перезаписываются новыми.
+
+    С path буфер лежит в файле через mmap и переживает перезапуск бота;
+    без path - в bytearray.
+    """
+
+    MAGIC = b"MCRING01"
+    HEADER = struct.Struct("<8sIIQQ")  # magic, stride, capacity, written, reserved
+    HEADER_SIZE = 64
+
+    def __init__(self, capacity: int, stride: int, path: Optional[str] = None):
+        self.capacity = capacity
+        self.stride = stride
+        self.path = path
+        size = self.HEADER_SIZE + capacity * 8 + capacity * stride * 4
+
+        self._file = None
+        if path:
+            fresh = not os.path.exists(path) or os.path.getsize(path) != size
+            self._file = open(path, "r+b" if not fresh else "w+b")
+            if fresh:
+                self._file.truncate(size)
+            self._buf = mmap.mmap(self._file.fileno(), size)
+            magic, stride_, capacity_, written, _ = self.HEADER.unpack_from(self._buf, 0)
+            if fresh or magic != self.MAGIC or stride_ != stride or capacity_ != capacity:
+                written = 0
+        else:
+            self._buf = bytearray(size)
+            written = 0
+
+        self.written = written
+        raw = memoryview(self._buf)
+        self._raw = raw
+        self.ts = raw[self.HEADER_SIZE:self.HEADER_SIZE + capacity * 8].cast("d")
+        self.values = raw[self.HEADER_SIZE + capacity * 8:].cast("f")
+        self._write_header()
+
+    def _write_header(self):
+        self.HEADER.pack_into(self._buf, 0, self.MAGIC, self.stride, self.capacity, self.written, 0)
+
+    def __len__(self) -> int:
+        return min(self.written, self.capacity)
+
+    def _phys(self, i: int) -> int:
+        """Логический индекс (0 - самая старая запись) -> индекс в массиве"""
+        return (self.written - len(self) + i) % self.capacity
+
+    def append(self, ts: float, values):
+        i = self.written % self.capacity
+        self.ts[i] = ts
+        self.values[i * self.stride:(i + 1) * self.stride] = array("f", values)
+        self.written += 1
+        self._write_header()
+
+    def first_ts(self) -> Optional[float]:
+        return self.ts[self._phys(0)] if len(self) else None
+
+    def last_ts(self) -> Optional[float]:
+        return self.ts[self._phys(len(self) - 1)] if len(self) else None
+
+    def _bisect(self, ts: float) -> int:
+        """Первый логический индекс с временем >= ts"""
+        lo, hi = 0, len(self)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self.ts[self._phys(mid)] < ts:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def rows(self, since: float, until: float) -> List[Tuple[float, tuple]]:
+        out = []
+        stride = self.stride
+        for i in range(self._bisect(since), len(self)):
+            p = self._phys(i)
+            ts = self.ts[p]
+            if ts > until:
+                break
+            out.append((ts, tuple(self.values[p * stride:(p + 1) * stride])))
+        return out
+
+    def nbytes(self) -> int:
+        return len(self._buf)
+
+    def copy(self) -> "Ring":
+        """Копия в bytearray: её можно читать из другого потока, пока пишется оригинал"""
+        ring = Ring(self.capacity, self.stride)
+        ring._raw[:] = self._raw
+        ring.written = self.written
+        return ring
+
+    def flush(self):
+        if self._file is not None:
+            self._buf.flush()
+
+    def close(self):
+        # mmap нельзя закрыть, пока на него смотрят memoryview
+        self.ts.release()
+        self.values.release()
+        self._raw.release()
+        if self._file is not None:
+            self._buf.flush()
+            self._buf.close()
+            self._file.close()
+            self._file = None
+
+
+class _Bucket:
+    """Накопитель текущей корзины: min/сумма/max/кол-во по каждой метрике"""
+
+    __slots__ = ("start", "count", "acc")
+
+    def __init__(self, start: float):
+        self.start = start
+        self.count = 0
+        self.acc = [math.inf, 0.0, -math.inf, 0] * len(METRICS)
+
+    def export(self) -> dict:
+        return {"start": self.start, "count": self.count, "acc": self.acc}
+
+    @classmethod
+    def restore(cls, data: dict) -> "_Bucket":
+        bucket = cls(float(data["start"]))
+        acc = [float(v) for v in data["acc"]]
+        if len(acc) != len(bucket.acc):
+            raise ValueError("acc size mismatch")
+        bucket.count = int(data["count"])
+        bucket.acc = acc
+        return bucket
+
+    def add(self, values):
+        self.count += 1
+        acc = self.acc
+        for k, v in enumerate(values):
+            if v != v:  # NaN - метрики не было в кадре
+                continue
+            j = k * 4
+            if v < acc[j]:
+                acc[j] = v
+            acc[j + 1] += v
+            if v > acc[j + 2]:
+                acc[j + 2] = v
+            acc[j + 3] += 1
+
+    def row(self) -> list:
+        """[count, min, avg, max] * METRICS в формате записи Ring"""
+        out = [float(self.count)]
+        acc = self.acc
+        for k in range(len(METRICS)):
+            j = k * 4
+            n = acc[j + 3]
+            if n:
+                out += (acc[j], acc[j + 1] / n, acc[j + 2])
+            else:
+                out += (NAN, NAN, NAN)
+        return out
+
+
+class RealmHistory:
+    """
+    История одного realm: сырые замеры в кольце + поминутная, почасовая и
+    посуточная свёртки min/avg/max. Размер всех колец фиксирован, так что
+    память не растёт, сколько бы бот ни работал.
+
+    Незакрытые корзины свёрток живут в памяти; flush() и close() пишут их
+    в <realm>.open.json рядом с кольцами, а при открытии они подхватываются
+    и продолжают копиться, так что рестарт не теряет часть минуты/часа/дня.
+    """
+
+    BUCKET_STRIDE = 1 + 3 * len(METRICS)
+
+    def __init__(self, realm: str, directory: Optional[str] = None, raw_capacity: int = 7200):
+        self.realm = realm
+
+        def path(name):
+            if not directory:
+                return None
+            safe = re.sub(r"[^A-Za-z0-9_.-]", "_", realm)
+            return os.path.join(directory, f"{safe}.{name}.ring")
+
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.raw = Ring(raw_capacity, len(METRICS), path("raw"))
+        self.tiers: Dict[str, Tuple[int, Ring]] = {
+            name: (step, Ring(capacity, self.BUCKET_STRIDE, path(name)))
+            for name, step, capacity in TIERS
+        }
+        self._open: Dict[str, _Bucket] = {}
+        self._open_path = path("open")[:-len(".ring")] + ".json" if directory else None
+        self._load_open()
+
+    def _load_open(self):
+        if not self._open_path or not os.path.exists(self._open_path):
+            return
+        try:
+            with open(self._open_path, encoding="utf-8") as f:
+                data = json.load(f)
+            for name, bucket in data.items():
+                if name in self.tiers:
+                    self._open[name] = _Bucket.restore(bucket)
+        except Exception as e:
+            print(f"[MinecraftCog] {self._open_path}: открытые корзины не прочитаны: {e!r}")
+
+    def _save_open(self):
+        if not self._open_path:
+            return
+        tmp = self._open_path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump({name: bucket.export() for name, bucket in self._open.items()}, f)
+        os.replace(tmp, self._open_path)
+
+    def record(self, ts: float, tps: Optional[float], mspt: Optional[float], players: int):
+        last = self.raw.last_ts()
+        if last is not None and ts <= last:
+            return  # часы ушли назад - кольца должны быть упорядочены по времени
+        values = (
+            NAN if tps is None else tps,
+            NAN if mspt is None else mspt,
+            float(players),
+        )
+        self.raw.append(ts, values)
+
+        for name, (step, ring) in self.tiers.items():
+            start = ts - ts % step
+            bucket = self._open.get(name)
+            if bucket is None or bucket.start != start:
+                if bucket is not None:
+                    ring.append(bucket.start, bucket.row())
+                bucket = self._open[name] = _Bucket(start)
+            bucket.add(values)
+
+    def _pick_tier(self, since: float) -> str:
+        """Самый подробный уровень, который ещё помнит момент since"""
+        first = self.raw.first_ts()
+        if first is not None and first <= since:
+            return "raw"
+        for name, (_, ring) in self.tiers.items():
+            first = ring.first_ts()
+            if first is not None and first <= since:
+                return name
+        return TIERS[-1][0]
+
+    def query(self, metric: str, since: float, until: float, tier: Optional[str] = None):
+        """
+        Ряд (ts, min, avg, max) по метрике за [since, until]. Без tier
+        выбирается самый подробный уровень, покрывающий since; для сырых
+        замеров min == avg == max. Возвращает (уровень, ряд).
+        """
+        k = METRICS.index(metric)
+        tier = tier or self._pick_tier(since)
+
+        if tier == "raw":
+            series = [(ts, v[k], v[k], v[k]) for ts, v in self.raw.rows(since, until)]
+            return tier, series
+
+        _, ring = self.tiers[tier]
+        j = 1 + k * 3
+        series = [(ts, v[j], v[j + 1], v[j + 2]) for ts, v in ring.rows(since, until)]
+        # Незакрытая корзина тоже в ответе, иначе последняя минута/час пропадёт
+        bucket = self._open.get(tier)
+        if bucket is not None and since <= bucket.start <= until:
+            row = bucket.row()
+            series.append((bucket.start, row[j], row[j + 1], row[j + 2]))
+        return tier, series
+
+    def nbytes(self) -> int:
+        return self.raw.nbytes() + sum(ring.nbytes() for _, ring in self.tiers.values())
+
+    def snapshot(self) -> "RealmHistory":
+        """
+        Отвязанная копия (кольца в памяти, корзины скопированы) для query()
+        из другого потока: сам RealmHistory не потокобезопасен - record()
+        меняет кольца и корзины, а close() освобождает mmap. Копирование -
+        memcpy колец, доли миллисекунды
+        """
+        copy = RealmHistory.__new__(RealmHistory)
+        copy.realm = self.realm
+        copy.raw = self.raw.copy()
+        copy.tiers = {name: (step, ring.copy()) for name, (step, ring) in self.tiers.items()}
+        copy._open = {name: _Bucket.restore(bucket.export()) for name, bucket in self._open.items()}
+        copy._open_path = None
+        return copy
+
+    def flush(self):
+        self.raw.flush()
+        for _, ring in self.tiers.values():
+            ring.flush()
+        self._save_open()
+
+    def close(self):
+        self._save_open()
+        self.raw.close()
+        for _, ring in self.tiers.values():
+            ring.close()
@@ -0,0 +1,160 @@
+# mc_presence.py
+import time
+from typing import Dict, FrozenSet, Iterable, List, Optional, Tuple
+
+# Длинные сессии режем на куски не длиннее этого: тогда "кто был онлайн
+# в момент T" - это диапазон индекса по started_at в [T - SESSION_CHUNK, T]
+SESSION_CHUNK = 6 * 3600
+
+
+class PresenceTracker:
+    """
+    Кто из игроков онлайн, по players_list из кадров статистики.
+
+    Открытые сессии живут в памяти (realm -> игрок -> начало), закрытые
+    дописываются в mc_sessions (только INSERT) и сразу суммируются в
+    mc_playtime. Топ по времени игры читается из индекса mc_playtime,
+    "кто был онлайн в T" - из индекса mc_sessions по началу сессии.
+    Старые сессии удаляет compact(); суммы при этом остаются.
+    """
+
+    def __init__(self, db, retention_days: float = 90.0, compact_interval: float = 3600.0):
+        self.db = db
+        self.retention = retention_days * 86400
+        self.compact_interval = compact_interval
+        self.open: Dict[str, Dict[str, float]] = {}
+        self._last_list: Dict[str, Tuple[str, ...]] = {}
+        self._last_set: Dict[str, FrozenSet[str]] = {}
+        self._last_compact = 0.0
+        self.counters = {"frames": 0, "unchanged": 0, "joins": 0, "leaves": 0, "sessions_written": 0}
+
+    # ---------------- обновление ----------------
+
+    def update(self, realm: str, players: Tuple[str, ...], now: float):
+        """Сравнивает список с прошлым кадром; возвращает (вошедшие, вышедшие)"""
+        self.counters["frames"] += 1
+        # Частый случай - тот же список в том же порядке: без множеств вообще
+        if self._last_list.get(realm) == players:
+            self.counters["unchanged"] += 1
+            return frozenset(), frozenset()
+
+        current = frozenset(players)
+        previous = self._last_set.get(realm, frozenset())
+        self._last_list[realm] = players
+        self._last_set[realm] = current
+        if current == previous:
+            self.counters["unchanged"] += 1
+            return frozenset(), frozenset()
+
+        joined = current - previous
+        left = previous - current
+        sessions = self.open.setdefault(realm, {})
+        for name in joined:
+            sessions[name] = now
+        self._close(realm, [(name, sessions.pop(name, now)) for name in left], now)
+        self.counters["joins"] += len(joined)
+        self.counters["leaves"] += len(left)
+        return joined, left
+
+    def close_realm(self, realm: str, now: float):
+        """Realm ушёл в оффлайн: закрываем все его сессии"""
+        sessions = self.open.pop(realm, {})
+        self._last_list.pop(realm, None)
+        self._last_set.pop(realm, None)
+        self._close(realm, list(sessions.items()), now)
+
+    def close_all(self, now: float):
+        for realm in list(self.open):
+            self.close_realm(realm, now)
+
+    def _close(self, realm: str, finished: List[Tuple[str, float]], now: float):
+        if not finished:
+            return
+        rows = []
+        totals = []
+        for name, start in finished:
+            totals.append((realm, name, now - start))
+            while now - start > SESSION_CHUNK:
+                rows.append((realm, name, start, start + SESSION_CHUNK))
+                start += SESSION_CHUNK
+            rows.append((realm, name, start, now))
+        self.db.submit_many(
+            "INSERT INTO mc_sessions (realm, player, started_at, ended_at) VALUES (?, ?, ?, ?)", rows
+        )
+        self.db.submit_many(
+            "INSERT INTO mc_playtime (realm, player, seconds) VALUES (?, ?, ?) "
+            "ON CONFLICT (realm, player) DO UPDATE SET seconds = seconds + excluded.seconds",
+            totals
+        )
+        self.counters["sessions_written"] += len(rows)
+
+    # ---------------- снимок ----------------
+
+    def export(self) -> dict:
+        return {realm: dict(sessions) for realm, sessions in self.open.items() if sessions}
+
+    def restore(self, data: dict, realms: Iterable[str], closed_at: Optional[float] = None):
+        """
+        Открытые сессии из снимка. С closed_at сессии сразу закрываются этим
+        моментом (перерыв был слишком долгим, чтобы продолжать их).
+        """
+        realms = set(realms)
+        for realm, sessions in data.items():
+            if realm not in realms or not sessions:
+                continue
+            if closed_at is not None:
+                self._close(realm, list(sessions.items()), closed_at)
+                continue
+            self.open[realm] = {name: float(start) for name, start in sessions.items()}
+            self._last_set[realm] = frozenset(self.open[realm])
+
+    # ---------------- запросы ----------------
+
+    def online(self, realm: str) -> List[str]:
+        return sorted(self.open.get(realm, {}))
+
+    async def online_at(self, realm: str, ts: float) -> List[str]:
+        """Кто был онлайн в момент ts"""
+        rows = await self.db.fetchall(
+            "SELECT DISTINCT player FROM mc_sessions "
+            "WHERE realm = ? AND started_at BETWEEN ? AND ? AND ended_at > ?",
+            (realm, ts - SESSION_CHUNK, ts, ts)
+        )
+        players = {row[0] for row in rows}
+        players.update(name for name, start in self.open.get(realm, {}).items() if start <= ts)
+        return sorted(players)
+
+    async def top_playtime(self, realm: str, limit: int = 10, now: Optional[float] = None) -> List[Tuple[str, float]]:
+        """Топ по суммарному времени игры, с учётом ещё открытых сессий"""
+        now = now or time.time()
+        sessions = self.open.get(realm, {})
+        totals = dict(await self.db.fetchall(
+            "SELECT player, seconds FROM mc_playtime WHERE realm = ? ORDER BY seconds DESC LIMIT ?",
+            (realm, limit)
+        ))
+        if sessions:
+            # Онлайн-игрок вне топа может в него войти за счёт текущей сессии
+            names = list(sessions)
+            for i in range(0, len(names), 500):
+                chunk = names[i:i + 500]
+                totals.update(await self.db.fetchall(
+                    f"SELECT player, seconds FROM mc_playtime WHERE realm = ? AND player IN ({','.join('?' * len(chunk))})",
+                    (realm, *chunk)
+                ))
+            for name, start in sessions.items():
+                totals[name] = totals.get(name, 0.0) + (now - start)
+        return sorted(totals.items(), key=lambda item: item[1], reverse=True)[:limit]
+
+    # ---------------- уплотнение ----------------
+
+    def maybe_compact(self, realms: Iterable[str], now: float):
+        """Не чаще compact_interval удаляет сессии старше retention"""
+        if now - self._last_compact < self.compact_interval:
+            return
+        self._last_compact = now
+        cutoff = now - self.retention - SESSION_CHUNK
+        for realm in realms:
+            self.db.submit("DELETE FROM mc_sessions WHERE realm = ? AND started_at < ?", (realm, cutoff))
+
+    def stats(self) -> dict:
+        return {**self.counters, "online": sum(len(s) for s in self.open.values())}
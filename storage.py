@@ -0,0 +1,287 @@
+# storage.py
+import asyncio
+import json
+import os
+import sqlite3
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional
+
+
+# -------------------- SQLite --------------------
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (
+    key   TEXT PRIMARY KEY,
+    value TEXT
+);
+
+-- cogs/stats.py: голосовой канал со счётчиком участников
+CREATE TABLE IF NOT EXISTS stats_channels (
+    guild_id   INTEGER PRIMARY KEY,
+    channel_id INTEGER NOT NULL,
+    updated_at REAL NOT NULL
+);
+
+-- cogs/autorole.py: сообщение с кнопкой/реакцией и выдаваемая роль
+CREATE TABLE IF NOT EXISTS reaction_roles (
+    guild_id   INTEGER PRIMARY KEY,
+    channel_id INTEGER,
+    role_id    INTEGER,
+    message_id INTEGER
+);
+
+-- cogs/audit.py: каналы логов (одна строка) и игнорируемые каналы
+CREATE TABLE IF NOT EXISTS chat_logger_config (
+    id                   INTEGER PRIMARY KEY CHECK (id = 1),
+    voice_log_channel_id INTEGER,
+    text_log_channel_id  INTEGER
+);
+CREATE TABLE IF NOT EXISTS chat_logger_ignored (
+    channel_id INTEGER PRIMARY KEY
+);
+
+-- cogs/mod.py: активные муты
+CREATE TABLE IF NOT EXISTS mutes (
+    user_id    INTEGER PRIMARY KEY,
+    expires_at REAL NOT NULL,
+    reason     TEXT
+);
+
+-- cogs/websocket.py (mc_presence): закрытые сессии игроков (только INSERT)
+-- и суммарное время игры
+CREATE TABLE IF NOT EXISTS mc_sessions (
+    realm      TEXT NOT NULL,
+    player     TEXT NOT NULL,
+    started_at REAL NOT NULL,
+    ended_at   REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS mc_sessions_started ON mc_sessions (realm, started_at);
+CREATE TABLE IF NOT EXISTS mc_playtime (
+    realm   TEXT NOT NULL,
+    player  TEXT NOT NULL,
+    seconds REAL NOT NULL,
+    PRIMARY KEY (realm, player)
+);
+CREATE INDEX IF NOT EXISTS mc_playtime_top ON mc_playtime (realm, seconds DESC);
+
+-- cogs/websocket.py: снимок состояния MinecraftCog (JSON, с версией формата)
+CREATE TABLE IF NOT EXISTS mc_snapshot (
+    id       INTEGER PRIMARY KEY CHECK (id = 1),
+    version  INTEGER NOT NULL,
+    saved_at REAL NOT NULL,
+    data     TEXT NOT NULL
+);
+
+-- Таблица старого трекера Minecraft: ни один ког её не читал, каналы
+-- MinecraftCog настраиваются через MC_REALMS / MC_*_CHANNEL_ID
+DROP TABLE IF EXISTS minecraft_tracker;
+"""
+
+
+class StateDB:
+    """
+    Общая база состояния всех когов (SQLite в режиме WAL).
+
+    Все обращения к соединению идут через один поток executor'а: из корутин
+    через await fetchall()/execute(), а запись "выстрелил и забыл" - через
+    submit(). Порядок операций сохраняется, event loop не ждёт диск.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="state-db")
+        self._conn = self._call(self._connect)
+
+    def _connect(self):
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        conn = sqlite3.connect(self.path, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.executescript(SCHEMA)
+        conn.commit()
+        return conn
+
+    def _call(self, fn, *args):
+        """Синхронно выполняет fn в потоке базы (только на старте/выгрузке)"""
+        return self._executor.submit(fn, *args).result()
+
+    def _execute(self, sql: str, params=()):
+        cur = self._conn.execute(sql, params)
+        self._conn.commit()
+        return cur.rowcount
+
+    def _executemany(self, sql: str, rows):
+        cur = self._conn.executemany(sql, rows)
+        self._conn.commit()
+        return cur.rowcount
+
+    def _fetchall(self, sql: str, params=()):
+        return self._conn.execute(sql, params).fetchall()
+
+    def _fetchone(self, sql: str, params=()):
+        return self._conn.execute(sql, params).fetchone()
+
+    # --- асинхронный доступ ---
+
+    async def execute(self, sql: str, params=()) -> int:
+        return await asyncio.get_running_loop().run_in_executor(self._executor, self._execute, sql, params)
+
+    async def executemany(self, sql: str, rows) -> int:
+        rows = list(rows)
+        return await asyncio.get_running_loop().run_in_executor(self._executor, self._executemany, sql, rows)
+
+    async def fetchall(self, sql: str, params=()) -> list:
+        return await asyncio.get_running_loop().run_in_executor(self._executor, self._fetchall, sql, params)
+
+    async def fetchone(self, sql: str, params=()):
+        return await asyncio.get_running_loop().run_in_executor(self._executor, self._fetchone, sql, params)
+
+    def submit(self, sql: str, params=()):
+        """Запись без ожидания результата (из синхронного кода когов)"""
+        fut = self._executor.submit(self._execute, sql, params)
+        fut.add_done_callback(self._log_error)
+        return fut
+
+    def submit_many(self, sql: str, rows):
+        fut = self._executor.submit(self._executemany, sql, list(rows))
+        fut.add_done_callback(self._log_error)
+        return fut
+
+    @staticmethod
+    def _log_error(fut):
+        if not fut.cancelled() and fut.exception() is not None:
+            print(f"❌ Ошибка записи в базу состояния: {fut.exception()!r}")
+
+    # --- синхронный доступ для загрузки когов ---
+
+    def fetchall_sync(self, sql: str, params=()) -> list:
+        return self._call(self._fetchall, sql, params)
+
+    def fetchone_sync(self, sql: str, params=()):
+        return self._call(self._fetchone, sql, params)
+
+    def close(self):
+        self._call(self._conn.close)
+        self._executor.shutdown(wait=True)
+
+    # --- одноразовый импорт старых файлов ---
+
+    def import_legacy(self, base_dir: str = "."):
+        self._call(self._import_legacy, base_dir)
+
+    def _import_legacy(self, base_dir: str):
+        conn = self._conn
+        if conn.execute("SELECT 1 FROM meta WHERE key = 'legacy_imported'").fetchone():
+            return
+
+        def read_json(name):
+            path = os.path.join(base_dir, name)
+            if not os.path.exists(path):
+                return None
+            try:
+                with open(path, "r", encoding="utf-8") as f:
+                    return json.load(f)
+            except Exception as e:
+                print(f"❌ Не удалось прочитать {name} для импорта: {e}")
+                return None
+
+        now = time.time()
+        imported = []
+
+        data = read_json("stats_data.json")
+        if data:
+            conn.executemany(
+                "INSERT OR IGNORE INTO stats_channels (guild_id, channel_id, updated_at) VALUES (?, ?, ?)",
+                [(int(g), int(c), now) for g, c in data.get("server_stats", {}).items()]
+            )
+            imported.append("stats_data.json")
+
+        data = read_json("reactionrole_config.json")
+        if data:
+            conn.executemany(
+                "INSERT OR IGNORE INTO reaction_roles (guild_id, channel_id, role_id, message_id) VALUES (?, ?, ?, ?)",
+                [(int(g), c.get("channel_id"), c.get("role_id"), c.get("message_id")) for g, c in data.items()]
+            )
+            imported.append("reactionrole_config.json")
+
+        data = read_json("chat_logger_config.json")
+        if data:
+            conn.execute(
+                "INSERT OR IGNORE INTO chat_logger_config (id, voice_log_channel_id, text_log_channel_id) VALUES (1, ?, ?)",
+                (data.get("voice_log_channel_id"), data.get("text_log_channel_id"))
+            )
+            conn.executemany(
+                "INSERT OR IGNORE INTO chat_logger_ignored (channel_id) VALUES (?)",
+                [(int(c),) for c in data.get("ignored_channels", [])]
+            )
+            imported.append("chat_logger_config.json")
+
+        conn.execute("INSERT INTO meta (key, value) VALUES ('legacy_imported', ?)", (",".join(imported),))
+        conn.commit()
+        if imported:
+            print(f"📦 Импортировано в {self.path}: {', '.join(imported)}")
+
+
+_state_db: Optional[StateDB] = None
+
+
+def get_state_db() -> StateDB:
+    """Общая база состояния; при первом обращении импортирует старые файлы"""
+    global _state_db
+    if _state_db is None:
+        _state_db = StateDB(os.getenv("BOT_STATE_DB") or "bot_state.db")
+        _state_db.import_legacy()
+    return _state_db
+
+
+# -------------------- метрика блокировок loop --------------------
+
+class LoopLagMonitor:
+    """
+    Меряет, насколько event loop опаздывает проснуться: задача спит
+    interval секунд, всё сверх этого - время, когда loop был занят
+    синхронным кодом.
+    """
+
+    def __init__(self, interval: float = 0.5, threshold: float = 0.05):
+        self.interval = interval
+        self.threshold = threshold  # опоздания меньше этого считаем шумом
+        self.blocked_total = 0.0
+        self.max_lag = 0.0
+        self.last_lag = 0.0
+        self.stalls = 0
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self, loop=None):
+        if self._task is None or self._task.done():
+            loop = loop or asyncio.get_running_loop()
+            self._task = loop.create_task(self._run())
+
+    def stop(self):
+        if self._task and not self._task.done():
+            self._task.cancel()
+
+    async def _run(self):
+        while True:
+            start = time.monotonic()
+            await asyncio.sleep(self.interval)
+            lag = max(0.0, time.monotonic() - start - self.interval)
+            self.last_lag = lag
+            if lag >= self.threshold:
+                self.stalls += 1
+                self.blocked_total += lag
+                self.max_lag = max(self.max_lag, lag)
+
+    def stats(self) -> dict:
+        return {
+            "blocked_total_sec": round(self.blocked_total, 3),
+            "max_lag_sec": round(self.max_lag, 3),
+            "last_lag_sec": round(self.last_lag, 3),
+            "stalls": self.stalls,
+        }
+
+
+loop_lag_monitor = LoopLagMonitor()
@@ -0,0 +1,79 @@
+import asyncio
+import os
+import sys
+import types
+
+import disnake
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from cogs.audit import LogSink  # noqa: E402
+
+
+class _RateLimited(disnake.HTTPException):
+    def __init__(self):
+        self.status = 429
+        self.response = types.SimpleNamespace(headers={"Retry-After": "0"})
+
+
+class _Channel:
+    def __init__(self, fail=False):
+        self.id = 1
+        self.fail = fail
+        self.sent = []
+
+    async def send(self, embeds):
+        if self.fail:
+            raise _RateLimited()
+        self.sent.append(embeds)
+
+
+def test_batch_lost_after_rate_limits_is_counted():
+    async def scenario():
+        sink = LogSink(types.SimpleNamespace(loop=asyncio.get_running_loop()))
+        channel = _Channel(fail=True)
+        sink.push(channel, disnake.Embed(title="a"))
+        sink.push(channel, disnake.Embed(title="b"))
+        buf = sink.buffers[channel.id]
+        ok = await sink._send_batch(buf, sink._take_batch(buf))
+        sink.close()
+        return ok, sink.counters
+
+    ok, counters = asyncio.run(scenario())
+    assert not ok
+    assert counters["rate_limited"] == 3
+    assert counters["dropped"] == 2
+
+
+def test_close_flushes_queue():
+    async def scenario():
+        sink = LogSink(types.SimpleNamespace(loop=asyncio.get_running_loop()))
+        channel = _Channel()
+        for i in range(12):
+            sink.push(channel, disnake.Embed(title=str(i)))
+        sink.close()
+        for _ in range(10):
+            await asyncio.sleep(0)
+        return channel.sent, sink.counters
+
+    sent, counters = asyncio.run(scenario())
+    assert [len(embeds) for embeds in sent] == [10, 2]
+    assert counters["dropped"] == 0
+
+
+def test_overflow_summary_is_not_counted_as_event():
+    async def scenario():
+        sink = LogSink(types.SimpleNamespace(loop=asyncio.get_running_loop()))
+        sink.MAX_QUEUE = 3
+        channel = _Channel()
+        for i in range(5):
+            sink.push(channel, disnake.Embed(title=str(i)))
+        buf = sink.buffers[channel.id]
+        await sink._send_batch(buf, sink._take_batch(buf))
+        sink.close()
+        return channel.sent, sink.counters
+
+    sent, counters = asyncio.run(scenario())
+    assert [e.title for e in sent[0]] == ["⚠️ Логи пропущены", "2", "3", "4"]
+    assert counters["dropped"] == 2
+    assert counters["sent_embeds"] == 3
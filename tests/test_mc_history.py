@@ -0,0 +1,41 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from mc_history import RealmHistory  # noqa: E402
+
+T0 = 1_000_000
+
+
+def test_open_buckets_survive_reopen(tmp_path):
+    h = RealmHistory("smp", str(tmp_path))
+    for i in range(30):
+        h.record(T0 + i, 20.0, 5.0, i)
+    h.close()
+
+    h = RealmHistory("smp", str(tmp_path))
+    for i in range(30, 40):
+        h.record(T0 + i, 20.0, 5.0, i)
+    _, series = h.query("players", T0 - 86400, T0 + 100, "1h")
+    h.close()
+
+    assert len(series) == 1
+    _, mn, avg, mx = series[0]
+    assert (mn, avg, mx) == (0.0, 19.5, 39.0)
+
+
+def test_snapshot_is_detached(tmp_path):
+    h = RealmHistory("smp", str(tmp_path))
+    for i in range(30):
+        h.record(T0 + i, 20.0, 5.0, i)
+    snap = h.snapshot()
+    for i in range(30, 90):
+        h.record(T0 + i, 20.0, 5.0, i)
+    h.close()
+
+    # кольца снимка в памяти: запись и close() оригинала их не трогают
+    _, series = snap.query("players", T0, T0 + 100, "raw")
+    assert [row[2] for row in series] == [float(i) for i in range(30)]
+    _, series = snap.query("players", T0 - 86400, T0 + 100, "1m")
+    assert series[-1][1:] == (20.0, 24.5, 29.0)  # открытая корзина T0+20..T0+29
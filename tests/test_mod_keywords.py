@@ -0,0 +1,57 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from cogs.mod import KeywordMatcher, ModerationCog, fold_text  # noqa: E402
+
+MATCHER = KeywordMatcher({
+    "religious": ModerationCog.religious_keywords,
+    "political": ModerationCog.political_keywords,
+})
+
+
+@pytest.mark.parametrize("text", [
+    "this is bogus",
+    "I love the boggle game",
+    "a tora bora",
+    "the drone flew",
+    "dron",
+    "raca",
+    "svoboda",
+])
+def test_plain_english_is_not_flagged(text):
+    assert MATCHER.match(text) == set()
+
+
+@pytest.mark.parametrize("text, category", [
+    ("Бог с ним", "religious"),
+    ("бoг", "religious"),          # латинская o в кириллическом слове
+    ("б0г", "religious"),          # leet: 0 -> о
+    ("хааарам", "religious"),
+    ("HARAM", "religious"),
+    ("СВО", "political"),
+    ("ZVO", "political"),
+    ("nеgr", "political"),         # кириллическая е
+    ("NEGR", "political"),
+    ("n​egr", "political"),
+    ("!488", "political"),
+    ("haaaram", "religious"),      # растянутые латинские слова
+    ("HARAMMM", "religious"),
+    ("zvvo", "political"),
+    ("neegr", "political"),
+])
+def test_known_spellings_are_flagged(text, category):
+    assert category in MATCHER.match(text)
+
+
+def test_latin_words_are_not_folded():
+    assert fold_text("Bogus drone") == "bogus drone"
+    assert fold_text("бoг and bog") == "бог and bog"
+
+
+def test_leet_three_folds_to_ze():
+    assert fold_text("н3гр") == "нзгр"
+    assert MATCHER.match("н3гр") == set()
@@ -0,0 +1,99 @@
+import asyncio
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from cogs.websocket import RenameCoalescer  # noqa: E402
+
+
+def test_want_stale_name_during_edit_is_requeued():
+    """want(старое имя) во время edit не роняет цикл, и старое имя возвращается"""
+    async def scenario():
+        names = {1: "A"}
+        gate = asyncio.Event()
+        started = asyncio.Event()
+
+        async def edit(channel_id, name):
+            started.set()
+            await gate.wait()
+            names[channel_id] = name
+            return True
+
+        c = RenameCoalescer(edit, capacity=10, period=1, current_name=names.get)
+        c.start(asyncio.get_running_loop())
+        c.want(1, "online", "B", (True, 5))
+        await asyncio.wait_for(started.wait(), 1)
+
+        # канал всё ещё "A" по мнению слота - имя снимается как уже показанное
+        c.want(1, "online", "A", (True, 1))
+        gate.set()
+        for _ in range(100):
+            await asyncio.sleep(0.01)
+            if names[1] == "A":
+                break
+        c.stop()
+        return names[1], c._task
+
+    name, task = asyncio.run(scenario())
+    assert name == "A"
+    assert task.cancelled()
+
+
+def test_run_survives_fire_error():
+    async def scenario():
+        names = {}
+        calls = []
+
+        async def edit(channel_id, name):
+            names[channel_id] = name
+            return True
+
+        c = RenameCoalescer(edit, capacity=10, period=1)
+        original = c._fire
+
+        async def flaky(cid, slot):
+            calls.append(cid)
+            if len(calls) == 1:
+                raise TypeError("boom")
+            await original(cid, slot)
+
+        c._fire = flaky
+        c.start(asyncio.get_running_loop())
+        c.want(1, "online", "X", (True, 1))
+        c.want(2, "online", "Y", (True, 1))
+        for _ in range(100):
+            await asyncio.sleep(0.01)
+            if 2 in names:
+                break
+        done = c._task.done()
+        c.stop()
+        return names, done, c.counters["errors"]
+
+    names, done, errors = asyncio.run(scenario())
+    assert not done
+    assert errors == 1
+    assert len(names) == 1
+
+
+def test_restore_compares_with_live_channel_name():
+    """Канал переименовали, пока бот лежал: имя из снимка не должно подавить rename"""
+    async def scenario():
+        names = {1: "renamed by hand"}
+
+        async def edit(channel_id, name):
+            names[channel_id] = name
+            return True
+
+        c = RenameCoalescer(edit, capacity=10, period=1, current_name=names.get)
+        c.restore({"1": {"kind": "online", "shown_name": "A", "shown_values": [True, 1], "tokens": 2}}, 0.0)
+        c.start(asyncio.get_running_loop())
+        c.want(1, "online", "A", (True, 1))
+        for _ in range(100):
+            await asyncio.sleep(0.01)
+            if names[1] == "A":
+                break
+        c.stop()
+        return names[1]
+
+    assert asyncio.run(scenario()) == "A"